@@ -0,0 +1,131 @@
+"""
+In-process admission control for schedule slot bookings.
+
+Concurrent booking requests for the same Schedule are resolved here before
+they reach SQLite. The first claimant for a slot becomes its leader and is the
+only one allowed to open a write transaction; later claimants either fail fast
+or wait, with a bounded timeout, for the leader's outcome. If the leader books
+the slot the waiters are rejected without touching the database, otherwise
+one of them takes over as the new leader.
+
+The layer only coordinates threads of one process. Across processes the
+conditional update in Appointment.claim_slot remains the source of truth.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class SlotBusy(Exception):
+    """
+    Raised when a slot is held or has just been booked by another request;
+    ``transient`` when a retry may still get the slot
+    """
+
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        self.transient = transient
+
+
+class SlotClaim:
+    """Ticket handed to the leader; set ``booked`` once the slot is taken."""
+
+    __slots__ = ('done', 'booked')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.booked = False
+
+
+class SlotAdmission:
+    """Per-schedule admission queue with admitted/rejected/coalesced counters."""
+
+    FAIL_FAST = 'fail_fast'
+    WAIT = 'wait'
+
+    def __init__(self, mode=WAIT, wait_timeout=2.0):
+        if mode not in (self.FAIL_FAST, self.WAIT):
+            raise ValueError(f"Unknown admission mode: {mode}")
+        self.mode = mode
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._claims = {}
+        self._counters = {'admitted': 0, 'rejected': 0, 'coalesced': 0}
+
+    @contextmanager
+    def admit(self, schedule_id):
+        """
+        Admit the caller as leader for ``schedule_id`` for the duration of
+        the block. Raises SlotBusy if the caller is not admitted.
+        """
+        claim = self._acquire(schedule_id)
+        try:
+            yield claim
+        finally:
+            self._release(schedule_id, claim)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._claims))
+
+    def _acquire(self, schedule_id):
+        deadline = time.monotonic() + self.wait_timeout
+        coalesced = False
+
+        while True:
+            with self._lock:
+                current = self._claims.get(schedule_id)
+                if current is None:
+                    claim = SlotClaim()
+                    self._claims[schedule_id] = claim
+                    self._counters['admitted'] += 1
+                    return claim
+
+                if self.mode == self.FAIL_FAST:
+                    self._counters['rejected'] += 1
+                    raise SlotBusy('This schedule slot is being booked by another request.', transient=True)
+
+                if not coalesced:
+                    self._counters['coalesced'] += 1
+                    coalesced = True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not current.done.wait(remaining):
+                self._reject()
+                raise SlotBusy('Timed out waiting for a concurrent booking of this slot.', transient=True)
+
+            if current.booked:
+                self._reject()
+                raise SlotBusy('This schedule slot is no longer available.')
+            # The leader gave up without booking, compete to become the next one
+
+    def _release(self, schedule_id, claim):
+        with self._lock:
+            if self._claims.get(schedule_id) is claim:
+                del self._claims[schedule_id]
+        claim.done.set()
+
+    def _reject(self):
+        with self._lock:
+            self._counters['rejected'] += 1
+
+
+_slot_admission = None
+_slot_admission_lock = threading.Lock()
+
+
+def get_slot_admission():
+    """Return the process-wide admission layer configured from settings."""
+    global _slot_admission
+    if _slot_admission is None:
+        with _slot_admission_lock:
+            if _slot_admission is None:
+                config = getattr(settings, 'BOOKING_ADMISSION', {})
+                _slot_admission = SlotAdmission(
+                    mode=config.get('MODE', SlotAdmission.WAIT),
+                    wait_timeout=config.get('WAIT_TIMEOUT', 2.0),
+                )
+    return _slot_admission
@@ -0,0 +1,141 @@
+"""
+Idempotency-Key support for appointment write endpoints.
+
+A client that retries a POST with the same ``Idempotency-Key`` header gets the
+stored response of the first attempt back, so retries do not re-run
+validation, the booking transaction or the notification e-mails.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def _request_hash(request):
+    """Fingerprint of the request so a key cannot be reused for another one."""
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(payload.encode())
+    return digest.hexdigest()
+
+
+def _replay(stored):
+    response = Response(stored.response_body, status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def transient(response):
+    """Mark ``response`` as one a retry may change, so it is not stored."""
+    response.idempotency_transient = True
+    return response
+
+
+def _reserve(request, key, request_hash):
+    """
+    Insert the pending row of ``key``; returns None, or the row already
+    holding the key when another request got there first
+    """
+    pending_ttl = getattr(settings, 'IDEMPOTENCY_PENDING_TTL', timedelta(minutes=1))
+    try:
+        with transaction.atomic():
+            IdempotencyKey.purge_expired()
+            # An expired entry may still hold the key until it is evicted
+            IdempotencyKey.objects.filter(
+                user=request.user, key=key, expires_at__lte=timezone.now()
+            ).delete()
+            IdempotencyKey.objects.create(
+                user=request.user,
+                key=key,
+                request_hash=request_hash,
+                # Un rand ramas pending dupa o cadere elibereaza cheia dupa pending_ttl
+                expires_at=timezone.now() + pending_ttl,
+            )
+    except IntegrityError:
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        # Eliberata intre timp de cererea care o tinea: tot in curs pentru client
+        return stored or IdempotencyKey(request_hash=request_hash)
+    return None
+
+
+def _store(request, key, response):
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', timedelta(hours=24))
+    IdempotencyKey.objects.filter(user=request.user, key=key, status_code__isnull=True).update(
+        status_code=response.status_code,
+        response_body=response.data,
+        expires_at=timezone.now() + ttl,
+    )
+
+
+def _abandon(request, key):
+    IdempotencyKey.objects.filter(user=request.user, key=key, status_code__isnull=True).delete()
+
+
+def idempotent(view_method):
+    """
+    Replay stored responses for requests carrying an ``Idempotency-Key``
+
+    Requests without the header go straight to the view. The key is
+    reserved with a pending row before the view runs, so a retry arriving
+    while the first attempt is still running gets 409 instead of running
+    the view a second time. Responses with a 5xx status, or marked
+    ``transient``, are not stored and free the key so the client can retry.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        request_hash = _request_hash(request)
+        stored = _reserve(request, key, request_hash)
+        if stored is not None:
+            if stored.request_hash != request_hash:
+                return Response(
+                    {'error': 'Idempotency-Key was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if stored.status_code is None:
+                return Response(
+                    {'error': 'A request with this Idempotency-Key is still in progress'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            logger.info(f"Replaying stored response for idempotency key {key}")
+            return _replay(stored)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            _abandon(request, key)
+            raise
+
+        if response.status_code < 500 and not getattr(response, 'idempotency_transient', False):
+            _store(request, key, response)
+        else:
+            _abandon(request, key)
+        return response
+
+    return wrapper
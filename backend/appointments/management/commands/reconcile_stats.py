@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from appointments.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute the admin dashboard counters and correct any drift (run periodically, e.g. nightly via cron)"
+
+    def handle(self, *args, **options):
+        drift = reconcile()
+        for name, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f"{name}: {stored} -> {actual}")
+        self.stdout.write(self.style.SUCCESS(f"Stat counters reconciled ({len(drift)} corrected)."))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_idempotencykey'),
+        ('doctors', '0002_agenda_pagination_indexes'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['-created_at', '-id'], name='appt_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'schedule'], name='appt_doctor_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'schedule'], name='appt_patient_schedule_idx'),
+        ),
+    ]
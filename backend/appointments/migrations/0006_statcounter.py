@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_counters(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Doctor = apps.get_model('doctors', 'Doctor')
+    Patient = apps.get_model('patients', 'Patient')
+    StatCounter = apps.get_model('appointments', 'StatCounter')
+
+    values = {
+        'appointments.total': Appointment.objects.count(),
+        'doctors.total': Doctor.objects.count(),
+        'patients.total': Patient.objects.count(),
+    }
+    for status, count in Appointment.objects.values_list('status').annotate(n=Count('id')):
+        values[f'appointments.status.{status}'] = count
+    for day, count in Appointment.objects.values_list('schedule__date').annotate(n=Count('id')):
+        values[f'appointments.date.{day.isoformat()}'] = count
+
+    StatCounter.objects.bulk_create(
+        [StatCounter(name=name, value=value) for name, value in values.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_agenda_pagination_indexes'),
+        ('doctors', '0002_agenda_pagination_indexes'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
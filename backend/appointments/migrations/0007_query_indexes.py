@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_statcounter'),
+        ('doctors', '0003_query_indexes'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('reminder_sent', False), ('status', 'confirmed')), fields=['schedule'], name='appt_reminder_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 10:38
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_reminder_due_at(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    NotificationPreferences = apps.get_model('authentication', 'NotificationPreferences')
+
+    prefs_by_user = {
+        prefs.user_id: prefs
+        for prefs in NotificationPreferences.objects.filter(
+            email_enabled=True, appointment_reminders=True
+        )
+    }
+    pending = Appointment.objects.filter(
+        reminder_sent=False, status__in=['pending', 'confirmed']
+    ).select_related('patient', 'schedule')
+
+    changed = []
+    for appointment in pending.iterator():
+        prefs = prefs_by_user.get(appointment.patient.user_id)
+        if prefs is None:
+            continue
+        start = timezone.make_aware(
+            datetime.combine(appointment.schedule.date, appointment.schedule.start_time),
+            timezone.get_current_timezone(),
+        )
+        appointment.reminder_due_at = start - timedelta(hours=prefs.reminder_hours_before)
+        changed.append(appointment)
+    Appointment.objects.bulk_update(changed, ['reminder_due_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_query_indexes'),
+        ('doctors', '0003_query_indexes'),
+        ('patients', '0001_initial'),
+        ('authentication', '0005_remove_notificationpreferences_marketing_emails'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_reminder_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('reminder_sent', False), ('status', 'confirmed')), fields=['reminder_due_at'], name='appt_reminder_due_idx'),
+        ),
+        migrations.RunPython(backfill_reminder_due_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 12:28
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_slot_columns(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Schedule = apps.get_model('doctors', 'Schedule')
+    slot = Schedule.objects.filter(pk=OuterRef('schedule_id'))
+    Appointment.objects.update(
+        slot_date=Subquery(slot.values('date')[:1]),
+        slot_start_time=Subquery(slot.values('start_time')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_idempotency_pending'),
+        ('doctors', '0004_schedule_templates'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_doctor_schedule_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_patient_schedule_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='slot_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='slot_start_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_slot_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'slot_date', 'slot_start_time', 'id'], name='appt_doctor_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'slot_date', 'slot_start_time', 'id'], name='appt_patient_slot_idx'),
+        ),
+    ]
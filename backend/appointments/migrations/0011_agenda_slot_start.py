@@ -0,0 +1,60 @@
+# Generated by Django 5.2 on 2026-10-18 13:03
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_slot_at(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    appointments = list(Appointment.objects.select_related('schedule').only(
+        'id', 'schedule__date', 'schedule__start_time',
+    ))
+    for appointment in appointments:
+        appointment.slot_at = timezone.make_aware(
+            datetime.combine(appointment.schedule.date, appointment.schedule.start_time)
+        )
+    Appointment.objects.bulk_update(appointments, ['slot_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0010_agenda_slot_columns'),
+        ('doctors', '0004_schedule_templates'),
+        ('patients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_doctor_slot_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_patient_slot_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='slot_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_slot_at, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='appointment',
+            name='slot_date',
+        ),
+        migrations.RemoveField(
+            model_name='appointment',
+            name='slot_start_time',
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'slot_at', 'id'], name='appt_doctor_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'slot_at', 'id'], name='appt_patient_slot_idx'),
+        ),
+    ]
@@ -1,9 +1,18 @@
 from django.db import models, transaction, IntegrityError
 from doctors.models import Doctor, Schedule
+from doctors.slot_index import unindex_slots
 from patients.models import Patient
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-import time
-import random
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from notifications.models import ReminderChange
+from . import reminders
+
+
+class SlotAlreadyBooked(Exception):
+    """Raised when a booking loses the race for a schedule slot."""
+
 
 class Appointment(models.Model):
     STATUS_CHOICES = (
@@ -21,6 +30,11 @@ class Appointment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True, null=True)
     reminder_sent = models.BooleanField(default=False)
+    # When the reminder email is due, kept up to date by appointments.reminders
+    reminder_due_at = models.DateTimeField(null=True, blank=True)
+    # Start of the schedule slot, copied so the agendas can walk an index in
+    # slot order; set on save and claim_slot, and when the slot moves (signals)
+    slot_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         constraints = [
@@ -30,9 +44,34 @@ class Appointment(models.Model):
                 name='unique_active_appointment_per_schedule'
             )
         ]
+        # Index -> query map, kept in sync with the README "Database indexes" table
+        indexes = [
+            # Admin listing, cursor pagination on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='appt_created_id_idx'),
+            # Doctor and patient agendas, cursor pagination on (slot_at, id);
+            # the patient one also serves the AppointmentSerializer.validate
+            # overlap check
+            models.Index(fields=['doctor', 'slot_at', 'id'], name='appt_doctor_slot_idx'),
+            models.Index(fields=['patient', 'slot_at', 'id'], name='appt_patient_slot_idx'),
+            # Confirmed appointments still waiting for a reminder, by due time,
+            # reminder scheduler
+            models.Index(
+                fields=['reminder_due_at'],
+                condition=models.Q(status='confirmed', reminder_sent=False),
+                name='appt_reminder_due_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Appointment: {self.patient} with {self.doctor} on {self.schedule.date}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so status transitions can be detected
+        if 'status' in field_names:
+            instance._loaded_status = instance.status
+        return instance
     
     def clean(self):
         # Only prevent double booking
@@ -53,6 +92,7 @@ class Appointment(models.Model):
         # Run full_clean to trigger model validation before saving
         # This ensures the clean() method runs and prevents double booking
         self.full_clean()
+        self.copy_slot()
 
         # Update schedule availability based on appointment status
         if self.status in ['pending', 'confirmed']:
@@ -92,44 +132,106 @@ class Appointment(models.Model):
             # For other statuses, just save normally
             super().save(*args, **kwargs)
 
+    def copy_slot(self):
+        """Copy the start of the schedule slot for the agenda index."""
+        self.slot_at = reminders.slot_start(self.schedule)
+
     @classmethod
-    def create_with_retry(cls, **kwargs):
+    def claim_slot(cls, **kwargs):
         """
-        Create appointment with retry logic for SQLite race conditions
-        Demonstrates transaction control and conflict resolution
+        Book a schedule slot with a single compare-and-set write.
+
+        The slot is claimed with ``UPDATE ... SET is_available = false WHERE
+        id = X AND is_available = true`` and only the request whose update
+        touches a row goes on to insert the appointment. Losing requests get
+        SlotAlreadyBooked immediately instead of sleeping and retrying.
+        Because the transaction opens with a write, SQLite hands out the write
+        lock up front and concurrent bookings never fail upgrading a read lock.
+        The patient's reminder preferences are read before the transaction
+        and the ReminderChange row is logged after it, so the write lock is
+        held only for the claim, the insert and the dashboard counters.
         """
-        max_retries = 3
-        base_delay = 0.1  # 100ms
-        
-        for attempt in range(max_retries):
-            try:
-                with transaction.atomic():
-                    # Verify schedule availability
-                    schedule = Schedule.objects.get(id=kwargs['schedule'].id)
-                    if not schedule.is_available:
-                        raise ValidationError("Schedule slot is no longer available")
-
-                    # Create appointment
-                    appointment = cls.objects.create(**kwargs)
-
-                    # Success - return the appointment
-                    return appointment
-
-            except ValidationError as e:
-                # Validation errors from full_clean are not retriable
-                raise e
-            except IntegrityError as e:
-                if attempt == max_retries - 1:
-                    # Last attempt failed
-                    raise ValidationError(f"Unable to book appointment: {str(e)}")
-
-                # Wait with exponential backoff before retry
-                delay = base_delay * (2 ** attempt) + random.uniform(0, 0.1)
-                time.sleep(delay)
-
-                # Log the retry attempt
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info(f"Appointment booking retry {attempt + 1}/{max_retries} after {delay:.3f}s")
-        
-        raise ValidationError("Unable to book appointment after maximum retries")
+        schedule = kwargs['schedule']
+        appointment = cls(**kwargs)
+        appointment.copy_slot()
+        prefs = reminders.preferences_for_patient(appointment.patient_id)
+        appointment.reminder_due_at = reminders.reminder_due_at(schedule, prefs)
+        # Semnalele pre_save/post_save sar peste ce se face aici
+        appointment._claiming = True
+
+        try:
+            with transaction.atomic():
+                claimed = Schedule.objects.filter(
+                    pk=schedule.pk, is_available=True
+                ).update(is_available=False)
+                if not claimed:
+                    raise SlotAlreadyBooked('This schedule slot is no longer available.')
+
+                try:
+                    # Bypass save(): the claim above already covers clean() and
+                    # the schedule availability update
+                    models.Model.save(appointment, force_insert=True)
+                except IntegrityError:
+                    # The partial unique constraint caught an active appointment
+                    # on a slot that was still flagged as available
+                    raise SlotAlreadyBooked('This schedule slot is already booked.')
+                unindex_slots([schedule.pk])
+        finally:
+            appointment._claiming = False
+
+        ReminderChange.objects.create(appointment_id=appointment.pk)
+        schedule.is_available = False
+        return appointment
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored response for a request carrying an ``Idempotency-Key`` header
+
+    Replays of the same key by the same user get the stored response back
+    until ``expires_at``, without running the view again. The row is
+    inserted before the view runs, with no ``status_code`` while the first
+    request is still in progress.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # Empty while the request holding the key is running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'key'],
+                name='unique_idempotency_key_per_user'
+            )
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user_id}"
+
+    @classmethod
+    def purge_expired(cls, limit=100):
+        """Delete up to ``limit`` expired keys, oldest first."""
+        expired = cls.objects.filter(
+            expires_at__lte=timezone.now()
+        ).order_by('expires_at').values_list('pk', flat=True)[:limit]
+        return cls.objects.filter(pk__in=list(expired)).delete()[0]
+
+
+class StatCounter(models.Model):
+    """
+    Named counter maintained incrementally for the admin dashboard
+
+    See appointments.stats for the counter names and how they are kept in
+    sync with the appointments, doctors and patients tables.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,38 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Cursor pagination used only when the client asks for it
+
+    Requests carrying ``cursor`` or ``page_size`` get a page with opaque
+    ``next``/``previous`` cursors; requests without them keep receiving the
+    full, unpaginated list.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class AppointmentCursorPagination(OptionalCursorPagination):
+    """Newest first, keyed on (created_at, id) for the admin listing."""
+    ordering = ('-created_at', '-id')
+
+
+class AgendaCursorPagination(OptionalCursorPagination):
+    """
+    Upcoming first, keyed on the slot start copied on Appointment for doctor
+    and patient agendas (appt_doctor_slot_idx, appt_patient_slot_idx)
+
+    DRF builds the cursor position from the first ordering field alone, so
+    that field has to be close to unique: a single datetime keeps the
+    position exact inside a day, only appointments sharing a slot (the
+    cancelled ones next to the rebooking) fall back to the cursor offset.
+    """
+    ordering = ('slot_at', 'id')
@@ -0,0 +1,166 @@
+"""
+Per-request query counting and duplicate-query (N+1) detection.
+
+QueryCounter wraps the database connection for the duration of a block and
+groups every executed statement by its normalized SQL, so the same SELECT
+issued once per row shows up as a single group with a high count.
+
+Viewsets declare how many queries each action may run:
+
+    class DoctorViewSet(viewsets.ModelViewSet):
+        query_budgets = {'list': 3, 'retrieve': 3}
+
+The budget must not depend on the number of rows returned.
+QueryCountMiddleware logs requests that exceed their budget or repeat a
+statement, and QueryBudgetTestMixin enforces the budgets in tests.
+"""
+
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger('appointments')
+
+DEFAULT_DUPLICATE_THRESHOLD = 3
+
+
+def normalize_sql(sql):
+    """Replace literal values so repeated statements compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(?:, \?)+\)', '(?)', sql)
+
+
+class QueryCounter:
+    """Counts the statements executed on ``connection`` while active."""
+
+    def __init__(self):
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements[normalize_sql(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self):
+        return sum(self.statements.values())
+
+    def duplicates(self, threshold=2):
+        """Statements executed at least ``threshold`` times, most repeated first."""
+        return [
+            (sql, count) for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+    @contextmanager
+    def count(self):
+        with connection.execute_wrapper(self):
+            yield self
+
+
+def get_query_budget(view_class, action):
+    """Budget declared by ``view_class`` for ``action``, or None."""
+    budgets = getattr(view_class, 'query_budgets', None) or {}
+    return budgets.get(action)
+
+
+class QueryCountMiddleware:
+    """
+    Log the query count of every API request that has a budget and warn
+    about requests over budget or repeating a statement
+
+    Enabled by ``QUERY_COUNT['ENABLED']``; in DEBUG the count is also
+    returned in the ``X-Query-Count`` header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'QUERY_COUNT', {})
+        self.enabled = config.get('ENABLED', False)
+        self.duplicate_threshold = config.get('DUPLICATE_THRESHOLD', DEFAULT_DUPLICATE_THRESHOLD)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with counter.count():
+            response = self.get_response(request)
+
+        self._report(request, counter)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(counter.total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # DRF viewsets expose their class and the method -> action mapping
+        view_class = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        if view_class is not None and action:
+            request.query_budget = get_query_budget(view_class, action)
+            request.query_budget_label = f'{view_class.__name__}.{action}'
+        return None
+
+    def _report(self, request, counter):
+        label = getattr(request, 'query_budget_label', request.path)
+        budget = getattr(request, 'query_budget', None)
+
+        if budget is not None and counter.total > budget:
+            logger.warning(
+                f"{request.method} {label} ran {counter.total} queries, budget is {budget}"
+            )
+        for sql, count in counter.duplicates(self.duplicate_threshold):
+            logger.warning(f"{request.method} {label} repeated a query {count} times: {sql}")
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin checking that an endpoint stays within its query budget
+    regardless of how many rows it returns
+    """
+
+    budget_sizes = (1, 5, 20)
+
+    def assertQueryBudget(self, view_class, action, seed, request, sizes=None):
+        """
+        For every size, call ``seed(size)`` to grow the data set to ``size``
+        rows, then ``request()`` and check that it ran no more queries than
+        the budget of ``view_class.action``, the same number for every size,
+        and no statement once per row.
+        """
+        budget = get_query_budget(view_class, action)
+        self.assertIsNotNone(budget, f'{view_class.__name__} declares no budget for {action}')
+
+        counts = {}
+        for size in sizes or self.budget_sizes:
+            seed(size)
+            with CaptureQueriesContext(connection) as ctx:
+                response = request()
+            self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+
+            queries = [query['sql'] for query in ctx.captured_queries]
+            counts[size] = len(queries)
+            self.assertLessEqual(
+                len(queries), budget,
+                f'{view_class.__name__}.{action} ran {len(queries)} queries for '
+                f'{size} rows, budget is {budget}:\n' + '\n'.join(queries)
+            )
+            repeated = [
+                (sql, count) for sql, count in Counter(map(normalize_sql, queries)).items()
+                if size > 1 and count >= size
+            ]
+            self.assertFalse(
+                repeated,
+                f'{view_class.__name__}.{action} runs a query per row: {repeated}'
+            )
+
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f'{view_class.__name__}.{action} query count grows with rows: {counts}'
+        )
@@ -0,0 +1,79 @@
+"""
+Precomputed reminder due times.
+
+Appointment.reminder_due_at holds the moment the patient's reminder email
+is due: the slot start minus NotificationPreferences.reminder_hours_before,
+or NULL when the patient has no preferences or has turned email reminders
+off. The reminder dispatcher only has to select rows with
+``reminder_due_at <= now``.
+
+The value is recomputed when an appointment is saved, when the patient's
+preferences change and when the slot of a booked schedule moves (see
+appointments.signals). Every change is also logged in ReminderChange for
+the reminder daemon.
+"""
+
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from authentication.models import NotificationPreferences
+from notifications.models import ReminderChange
+
+
+def slot_start(schedule):
+    """Aware datetime at which ``schedule`` starts."""
+    return timezone.make_aware(
+        datetime.combine(schedule.date, schedule.start_time),
+        timezone.get_current_timezone(),
+    )
+
+
+def reminder_due_at(schedule, prefs):
+    """When the reminder for an appointment on ``schedule`` is due, or None."""
+    if prefs is None or not (prefs.email_enabled and prefs.appointment_reminders):
+        return None
+    return slot_start(schedule) - timedelta(hours=prefs.reminder_hours_before)
+
+
+def preferences_for_patient(patient_id):
+    try:
+        return NotificationPreferences.objects.get(user__patient=patient_id)
+    except NotificationPreferences.DoesNotExist:
+        return None
+
+
+# refresh_reminders default: look up each patient's own preferences
+PATIENT_PREFERENCES = object()
+
+
+def refresh_reminders(appointments, prefs=PATIENT_PREFERENCES):
+    """
+    Recompute ``reminder_due_at`` for ``appointments`` (a queryset)
+
+    ``prefs`` applies one set of preferences (or None, no reminders) to
+    every appointment, which is how a change to one user's preferences is
+    propagated. Returns the number of rows changed.
+    """
+    cache = {}
+    changed = []
+    for appointment in appointments.select_related('schedule'):
+        if prefs is PATIENT_PREFERENCES:
+            if appointment.patient_id not in cache:
+                cache[appointment.patient_id] = preferences_for_patient(appointment.patient_id)
+            appointment_prefs = cache[appointment.patient_id]
+        else:
+            appointment_prefs = prefs
+        due_at = reminder_due_at(appointment.schedule, appointment_prefs)
+        if due_at != appointment.reminder_due_at:
+            appointment.reminder_due_at = due_at
+            changed.append(appointment)
+
+    if changed:
+        # bulk_update skips save() and its slot bookkeeping, only this column
+        # changes; it also skips the signals, so log the change for the daemon
+        type(changed[0]).objects.bulk_update(changed, ['reminder_due_at'])
+        ReminderChange.objects.bulk_create(
+            [ReminderChange(appointment_id=appointment.pk) for appointment in changed]
+        )
+    return len(changed)
@@ -1,20 +1,82 @@
 from rest_framework import serializers
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from django.utils import timezone
 from .models import Appointment
+from doctors.models import Schedule
 from doctors.serializers import DoctorSerializer, ScheduleSerializer
 from patients.serializers import PatientSerializer
 
 class AppointmentSerializer(serializers.ModelSerializer):
+    """
+    Appointment representation with sparse fieldsets
+
+    On GET requests ``?fields=id,status,date`` limits the output to the named
+    fields and ``?expand=doctor_details`` keeps the flat fields plus only the
+    listed nested objects. Without either parameter the full nested
+    representation is returned. The slim ``date``/``start_time``/``end_time``
+    fields are only included when asked for by name.
+    """
     doctor_details = DoctorSerializer(source='doctor', read_only=True)
     patient_details = PatientSerializer(source='patient', read_only=True)
     schedule_details = ScheduleSerializer(source='schedule', read_only=True)
-    
+    date = serializers.DateField(source='schedule.date', read_only=True)
+    start_time = serializers.TimeField(source='schedule.start_time', read_only=True)
+    end_time = serializers.TimeField(source='schedule.end_time', read_only=True)
+
+    EXPANDABLE_FIELDS = ('doctor_details', 'patient_details', 'schedule_details')
+    OPT_IN_FIELDS = ('date', 'start_time', 'end_time')
+
     class Meta:
         model = Appointment
         fields = ['id', 'patient', 'doctor', 'schedule', 'doctor_details', 'patient_details', 
-                  'schedule_details', 'status', 'created_at', 'updated_at', 'notes']
+                  'schedule_details', 'status', 'created_at', 'updated_at', 'notes',
+                  'date', 'start_time', 'end_time']
         read_only_fields = ['id', 'created_at', 'updated_at', 'doctor_details', 'patient_details', 'schedule_details']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        params = request.query_params if request and request.method == 'GET' else {}
+        selected = self.selected_fields(params)
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, params):
+        """Names of the fields to render for the given query parameters."""
+        all_fields = list(cls.Meta.fields)
+        requested = cls._split(params.get('fields'))
+        expand = cls._split(params.get('expand'))
+
+        if requested is None and expand is None:
+            return [f for f in all_fields if f not in cls.OPT_IN_FIELDS]
+
+        if requested is None:
+            requested = [
+                f for f in all_fields
+                if f not in cls.EXPANDABLE_FIELDS and f not in cls.OPT_IN_FIELDS
+            ]
+        wanted = set(requested) | set(expand or ())
+        return [f for f in all_fields if f in wanted]
+
+    @staticmethod
+    def _split(value):
+        if value is None:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    def to_representation(self, instance):
+        # schedule.doctor is always the appointment's doctor, reuse the loaded
+        # instance so ScheduleSerializer.get_doctor_name does not query again
+        if (
+            'schedule_details' in self.fields
+            and Appointment.schedule.is_cached(instance)
+            and Appointment.doctor.is_cached(instance)
+            and instance.schedule.doctor_id == instance.doctor_id
+        ):
+            Schedule.doctor.field.set_cached_value(instance.schedule, instance.doctor)
+        return super().to_representation(instance)
     
     def validate_schedule(self, value):
         """
@@ -73,11 +135,13 @@ class AppointmentSerializer(serializers.ModelSerializer):
         # Verifica daca pacientul nu are deja o programare in acelasi timp
         if schedule and patient:
             # Verifica overlap cu alte programari ale aceluiasi pacient
+            day_start = timezone.make_aware(datetime.combine(schedule.date, time.min))
             existing_appointments = Appointment.objects.filter(
                 patient=patient,
-                schedule__date=schedule.date,
+                slot_at__gte=day_start,
+                slot_at__lt=day_start + timedelta(days=1),
                 status__in=['pending', 'confirmed']
-            ).exclude(pk=self.instance.pk if self.instance else None)
+            ).exclude(pk=self.instance.pk if self.instance else None).select_related('schedule')
             
             for existing in existing_appointments:
                 # Verifica overlap de timp
@@ -0,0 +1,109 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from authentication.models import NotificationPreferences
+from doctors.models import Doctor, Schedule
+from notifications.models import ReminderChange
+from patients.models import Patient
+from .models import Appointment
+from . import reminders, stats
+
+
+@receiver(post_save, sender=Appointment)
+def count_appointment_save(sender, instance, created, **kwargs):
+    """Keep the dashboard counters in step with new appointments and status changes"""
+    if created:
+        stats.bump(stats.appointment_deltas(instance.status, instance.schedule.date))
+    else:
+        old_status = getattr(instance, '_loaded_status', None)
+        if old_status and old_status != instance.status:
+            stats.bump(stats.status_change_deltas(old_status, instance.status))
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Appointment)
+def count_appointment_delete(sender, instance, **kwargs):
+    status = getattr(instance, '_loaded_status', instance.status)
+    schedule = Appointment.schedule.field.get_cached_value(instance, None)
+    if schedule:
+        day = schedule.date
+    else:
+        # Cascade deletes load appointments without their schedule
+        day = Schedule.objects.filter(pk=instance.schedule_id).values_list('date', flat=True).first()
+    stats.bump(stats.appointment_deltas(status, day, sign=-1))
+
+
+@receiver(post_save, sender=Doctor)
+def count_doctor_create(sender, instance, created, **kwargs):
+    if created:
+        stats.bump({stats.TOTAL_DOCTORS: 1})
+
+
+@receiver(post_delete, sender=Doctor)
+def count_doctor_delete(sender, instance, **kwargs):
+    stats.bump({stats.TOTAL_DOCTORS: -1})
+
+
+@receiver(post_save, sender=Patient)
+def count_patient_create(sender, instance, created, **kwargs):
+    if created:
+        stats.bump({stats.TOTAL_PATIENTS: 1})
+
+
+@receiver(post_delete, sender=Patient)
+def count_patient_delete(sender, instance, **kwargs):
+    stats.bump({stats.TOTAL_PATIENTS: -1})
+
+
+@receiver(pre_save, sender=Appointment)
+def set_reminder_due_at(sender, instance, update_fields=None, **kwargs):
+    """Precompute when the reminder is due, for the dispatcher's indexed lookup"""
+    if update_fields is not None and 'reminder_due_at' not in update_fields:
+        return
+    if instance.reminder_sent or getattr(instance, '_claiming', False):
+        # claim_slot computes it before its transaction
+        return
+    prefs = reminders.preferences_for_patient(instance.patient_id)
+    instance.reminder_due_at = reminders.reminder_due_at(instance.schedule, prefs)
+
+
+def _unsent_reminders(**filters):
+    return Appointment.objects.filter(
+        reminder_sent=False, status__in=['pending', 'confirmed'], **filters
+    )
+
+
+@receiver(post_save, sender=NotificationPreferences)
+def refresh_reminders_for_preferences(sender, instance, **kwargs):
+    reminders.refresh_reminders(_unsent_reminders(patient__user=instance.user_id), prefs=instance)
+
+
+@receiver(post_delete, sender=NotificationPreferences)
+def clear_reminders_for_preferences(sender, instance, **kwargs):
+    reminders.refresh_reminders(_unsent_reminders(patient__user=instance.user_id), prefs=None)
+
+
+@receiver(post_save, sender=Schedule)
+def refresh_reminders_for_schedule(sender, instance, created, update_fields=None, **kwargs):
+    """A booked slot moved, its appointments' slot start, date counter and reminder move with it"""
+    loaded_slot = getattr(instance, '_loaded_slot', None)
+    instance._loaded_slot = (instance.date, instance.start_time)
+    if created or loaded_slot is None or loaded_slot == instance._loaded_slot:
+        return
+    moved = Appointment.objects.filter(schedule=instance).update(
+        slot_at=reminders.slot_start(instance)
+    )
+    old_date = loaded_slot[0]
+    if moved and old_date != instance.date:
+        # Programarile trec pe alta zi, contorul pe zile le urmeaza
+        stats.bump({stats.date_counter(old_date): -moved, stats.date_counter(instance.date): moved})
+    reminders.refresh_reminders(_unsent_reminders(schedule=instance))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def record_reminder_change(sender, instance, **kwargs):
+    """Tell the reminder daemon to re-read this appointment"""
+    if getattr(instance, '_claiming', False):
+        # claim_slot logs it after its transaction
+        return
+    ReminderChange.objects.create(appointment_id=instance.pk)
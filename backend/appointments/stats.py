@@ -0,0 +1,143 @@
+"""
+Incrementally maintained counters for the admin dashboard.
+
+Counters live in the StatCounter table and are adjusted in the same
+transaction as the change they count (see appointments.signals), so
+admin_stats reads a handful of rows instead of scanning the tables.
+Writes that bypass model signals (queryset.update, bulk_create) must call
+``bump`` themselves; ``reconcile`` recomputes everything from the source
+tables and corrects any drift.
+
+Counter names:
+    appointments.total
+    appointments.status.<status>
+    appointments.date.<YYYY-MM-DD>   appointments by schedule date
+    doctors.total
+    patients.total
+"""
+
+import logging
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Appointment, StatCounter
+from doctors.models import Doctor
+from patients.models import Patient
+
+logger = logging.getLogger(__name__)
+
+TOTAL_APPOINTMENTS = 'appointments.total'
+TOTAL_DOCTORS = 'doctors.total'
+TOTAL_PATIENTS = 'patients.total'
+
+
+def status_counter(status):
+    return f'appointments.status.{status}'
+
+
+def date_counter(day):
+    return f'appointments.date.{day.isoformat()}'
+
+
+def appointment_deltas(status=None, day=None, sign=1):
+    """Counter deltas for adding (sign=1) or removing (sign=-1) an appointment."""
+    deltas = {TOTAL_APPOINTMENTS: sign}
+    if status:
+        deltas[status_counter(status)] = sign
+    if day:
+        deltas[date_counter(day)] = sign
+    return deltas
+
+
+def status_change_deltas(old_status, new_status, count=1):
+    """Counter deltas for ``count`` appointments moving between statuses."""
+    return {status_counter(old_status): -count, status_counter(new_status): count}
+
+
+def bump(deltas):
+    """Apply ``{name: delta}`` to the counters, creating missing ones."""
+    now = timezone.now()
+    with transaction.atomic():
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            updated = StatCounter.objects.filter(name=name).update(
+                value=F('value') + delta, updated_at=now
+            )
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    StatCounter.objects.create(name=name, value=delta)
+            except IntegrityError:
+                # Created concurrently, fall back to the increment
+                StatCounter.objects.filter(name=name).update(
+                    value=F('value') + delta, updated_at=now
+                )
+
+
+def dashboard_counters(today):
+    """Counters shown on the admin dashboard, read in a single query."""
+    status_prefix = status_counter('')
+    rows = StatCounter.objects.filter(
+        Q(name__in=[TOTAL_APPOINTMENTS, TOTAL_DOCTORS, TOTAL_PATIENTS, date_counter(today)])
+        | Q(name__startswith=status_prefix)
+    ).values_list('name', 'value')
+    values = dict(rows)
+
+    return {
+        'total_appointments': values.get(TOTAL_APPOINTMENTS, 0),
+        'appointments_today': values.get(date_counter(today), 0),
+        'appointments_by_status': {
+            name[len(status_prefix):]: value
+            for name, value in values.items()
+            if name.startswith(status_prefix) and value
+        },
+        'total_doctors': values.get(TOTAL_DOCTORS, 0),
+        'total_patients': values.get(TOTAL_PATIENTS, 0),
+    }
+
+
+def compute():
+    """Exact counter values computed from the source tables."""
+    values = Counter({
+        TOTAL_APPOINTMENTS: Appointment.objects.count(),
+        TOTAL_DOCTORS: Doctor.objects.count(),
+        TOTAL_PATIENTS: Patient.objects.count(),
+    })
+    for status, count in Appointment.objects.values_list('status').annotate(n=Count('id')):
+        values[status_counter(status)] = count
+    by_date = Appointment.objects.values_list('schedule__date').annotate(n=Count('id'))
+    for day, count in by_date:
+        values[date_counter(day)] = count
+    return values
+
+
+@transaction.atomic
+def reconcile():
+    """
+    Overwrite the counters with exact values
+
+    Returns ``{name: (stored, actual)}`` for every counter that had drifted.
+    """
+    actual = compute()
+    stored = dict(StatCounter.objects.values_list('name', 'value'))
+    drift = {}
+
+    for name in set(actual) | set(stored):
+        expected = actual.get(name, 0)
+        current = stored.get(name)
+        if current == expected:
+            continue
+        drift[name] = (current or 0, expected)
+        if expected == 0 and name.startswith('appointments.date.'):
+            StatCounter.objects.filter(name=name).delete()
+        else:
+            StatCounter.objects.update_or_create(name=name, defaults={'value': expected})
+
+    if drift:
+        logger.warning(f"Stat counters reconciled, {len(drift)} drifted")
+    return drift
@@ -1,14 +1,28 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from datetime import time, timedelta
+import threading
+from base64 import b64decode
+from urllib.parse import parse_qs, urlsplit
 from django.contrib.auth.models import User
+from unittest.mock import patch
+from authentication.models import NotificationPreferences
 from doctors.models import Doctor, Schedule
+from doctors.slot_index import get_slot_index
 from patients.models import Patient
-from .models import Appointment
+from .models import Appointment, IdempotencyKey, SlotAlreadyBooked, StatCounter
+from . import reminders, stats
+from notifications.models import Notification, OutboxMessage, ReminderChange
 from .serializers import AppointmentSerializer
+from .admission import SlotAdmission, SlotBusy
+from .querycount import QueryBudgetTestMixin, QueryCounter
+from .views import AppointmentViewSet
 
 
 def _next_weekday():
@@ -212,3 +226,754 @@ class AppointmentBookingTest(TestCase):
             str(response.data)
         )
 
+
+
+class ClaimSlotTest(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(username='doc4', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+
+        self.patient_user = User.objects.create_user(username='pat4', password='pass')
+        self.patient = Patient.objects.create(user=self.patient_user)
+        other_user = User.objects.create_user(username='pat5', password='pass')
+        self.other_patient = Patient.objects.create(user=other_user)
+
+        self.schedule = Schedule.objects.create(
+            doctor=self.doctor,
+            date=_next_weekday(),
+            start_time=time(10, 0),
+            end_time=time(11, 0),
+            is_available=True,
+        )
+
+    def test_claim_marks_schedule_unavailable(self):
+        appointment = Appointment.claim_slot(
+            patient=self.patient, doctor=self.doctor,
+            schedule=self.schedule, status='pending',
+        )
+
+        self.assertEqual(appointment.status, 'pending')
+        self.schedule.refresh_from_db()
+        self.assertFalse(self.schedule.is_available)
+
+    def test_claim_sets_reminder_and_logs_change_outside_the_claim(self):
+        NotificationPreferences.objects.create(user=self.patient_user, reminder_hours_before=24)
+
+        with CaptureQueriesContext(connection) as ctx:
+            appointment = Appointment.claim_slot(
+                patient=self.patient, doctor=self.doctor,
+                schedule=self.schedule, status='pending',
+            )
+
+        appointment.refresh_from_db()
+        self.assertEqual(
+            appointment.reminder_due_at,
+            reminders.slot_start(self.schedule) - timedelta(hours=24),
+        )
+        self.assertEqual(ReminderChange.objects.filter(appointment_id=appointment.pk).count(), 1)
+        # Preferintele se citesc inainte, jurnalul se scrie dupa tranzactie
+        queries = [query['sql'] for query in ctx.captured_queries]
+        opened = next(n for n, sql in enumerate(queries) if sql.startswith('SAVEPOINT'))
+        closed = max(n for n, sql in enumerate(queries) if sql.startswith('RELEASE SAVEPOINT'))
+        claim = ' '.join(queries[opened:closed])
+        self.assertNotIn('notificationpreferences', claim)
+        self.assertNotIn('reminderchange', claim)
+
+    def test_losing_claim_fails_without_insert(self):
+        Appointment.claim_slot(
+            patient=self.patient, doctor=self.doctor,
+            schedule=self.schedule, status='pending',
+        )
+
+        stale_schedule = Schedule.objects.get(pk=self.schedule.pk)
+        stale_schedule.is_available = True  # what a racing request last read
+        with self.assertRaises(SlotAlreadyBooked):
+            Appointment.claim_slot(
+                patient=self.other_patient, doctor=self.doctor,
+                schedule=stale_schedule, status='pending',
+            )
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_constraint_violation_releases_claim(self):
+        # Slot flagged as available even though an active booking exists
+        Appointment.claim_slot(
+            patient=self.patient, doctor=self.doctor,
+            schedule=self.schedule, status='pending',
+        )
+        Schedule.objects.filter(pk=self.schedule.pk).update(is_available=True)
+
+        with self.assertRaises(SlotAlreadyBooked):
+            Appointment.claim_slot(
+                patient=self.other_patient, doctor=self.doctor,
+                schedule=self.schedule, status='pending',
+            )
+        self.schedule.refresh_from_db()
+        self.assertTrue(self.schedule.is_available)
+
+    def test_lost_race_returns_conflict(self):
+        client = APIClient()
+        client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'schedule': self.schedule.id,
+        }
+
+        with patch.object(
+            Appointment, 'claim_slot',
+            side_effect=SlotAlreadyBooked('This schedule slot is no longer available.'),
+        ):
+            response = client.post(reverse('appointment-list'), data, format='json', secure=True)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Appointment.objects.count(), 0)
+
+
+class SlotAdmissionTest(SimpleTestCase):
+    def _hold_slot(self, admission, schedule_id, booked):
+        """Keep a leader inside the admission block until released."""
+        entered = threading.Event()
+        release = threading.Event()
+
+        def leader():
+            with admission.admit(schedule_id) as claim:
+                entered.set()
+                release.wait(5)
+                claim.booked = booked
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        entered.wait(5)
+        return thread, release
+
+    def test_fail_fast_rejects_concurrent_claimant(self):
+        admission = SlotAdmission(mode=SlotAdmission.FAIL_FAST)
+        thread, release = self._hold_slot(admission, 1, booked=True)
+
+        with self.assertRaises(SlotBusy):
+            with admission.admit(1):
+                pass
+        # Other slots are not affected
+        with admission.admit(2):
+            pass
+
+        release.set()
+        thread.join()
+        self.assertEqual(
+            admission.stats(),
+            {'admitted': 2, 'rejected': 1, 'coalesced': 0, 'in_flight': 0},
+        )
+
+    def test_waiter_rejected_once_leader_books(self):
+        admission = SlotAdmission(mode=SlotAdmission.WAIT, wait_timeout=5)
+        thread, release = self._hold_slot(admission, 1, booked=True)
+
+        threading.Timer(0.05, release.set).start()
+        with self.assertRaises(SlotBusy):
+            with admission.admit(1):
+                pass
+
+        thread.join()
+        stats = admission.stats()
+        self.assertEqual(stats['coalesced'], 1)
+        self.assertEqual(stats['rejected'], 1)
+
+    def test_waiter_takes_over_when_leader_fails(self):
+        admission = SlotAdmission(mode=SlotAdmission.WAIT, wait_timeout=5)
+        thread, release = self._hold_slot(admission, 1, booked=False)
+
+        threading.Timer(0.05, release.set).start()
+        with admission.admit(1) as claim:
+            claim.booked = True
+
+        thread.join()
+        stats = admission.stats()
+        self.assertEqual(stats['admitted'], 2)
+        self.assertEqual(stats['rejected'], 0)
+
+    def test_wait_is_bounded(self):
+        admission = SlotAdmission(mode=SlotAdmission.WAIT, wait_timeout=0.05)
+        thread, release = self._hold_slot(admission, 1, booked=True)
+
+        with self.assertRaises(SlotBusy):
+            with admission.admit(1):
+                pass
+
+        release.set()
+        thread.join()
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(username='doc6', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+
+        self.patient_user = User.objects.create_user(username='pat6', password='pass')
+        self.patient = Patient.objects.create(user=self.patient_user)
+
+        self.schedule = Schedule.objects.create(
+            doctor=self.doctor,
+            date=_next_weekday(),
+            start_time=time(12, 0),
+            end_time=time(13, 0),
+            is_available=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.patient_user)
+        self.data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'schedule': self.schedule.id,
+        }
+
+    def _book(self, key, data=None):
+        return self.client.post(
+            reverse('appointment-list'), data or self.data, format='json',
+            secure=True, HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_stored_response(self):
+        first = self._book('booking-1')
+        self.assertEqual(first.status_code, 201)
+
+        retry = self._book('booking-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_key_reused_for_other_request_is_rejected(self):
+        self.assertEqual(self._book('booking-2').status_code, 201)
+
+        other = dict(self.data, notes='different')
+        response = self._book('booking-2', other)
+        self.assertEqual(response.status_code, 422)
+
+    def test_cancel_retry_does_not_notify_twice(self):
+        appointment_id = self._book('booking-3').data['id']
+        cancel_url = reverse('appointment-cancel', kwargs={'pk': appointment_id})
+
+        first = self.client.post(cancel_url, secure=True, HTTP_IDEMPOTENCY_KEY='cancel-3')
+        retry = self.client.post(cancel_url, secure=True, HTTP_IDEMPOTENCY_KEY='cancel-3')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(
+            Notification.objects.filter(template='appointment_cancelled_doctor').count(), 1
+        )
+
+    def test_retry_while_first_request_runs_gets_409(self):
+        claim_slot = Appointment.claim_slot
+        retries = []
+
+        def claim_and_retry(**kwargs):
+            # Retry-ul clientului soseste cat timp prima cerere inca ruleaza
+            retries.append(self._book('booking-5'))
+            return claim_slot(**kwargs)
+
+        with patch.object(Appointment, 'claim_slot', side_effect=claim_and_retry):
+            first = self._book('booking-5')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertIn('in progress', retries[0].data['error'])
+        # Once the first request is done the retry replays its response
+        replay = self._book('booking-5')
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay.data['id'], first.data['id'])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_transient_slot_busy_is_not_stored(self):
+        admission = SlotAdmission(mode=SlotAdmission.FAIL_FAST)
+        with admission.admit(self.schedule.id):
+            with patch('appointments.views.get_slot_admission', return_value=admission):
+                busy = self._book('booking-6')
+        self.assertEqual(busy.status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.filter(key='booking-6').exists())
+
+        retry = self._book('booking-6')
+        self.assertEqual(retry.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', retry)
+
+    def test_key_is_freed_when_the_view_raises(self):
+        other = Patient.objects.create(user=User.objects.create_user(username='pat6b', password='pass'))
+        response = self._book('booking-7', dict(self.data, patient=other.id))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(IdempotencyKey.objects.filter(key='booking-7').exists())
+
+    def test_expired_key_is_evicted(self):
+        self.assertEqual(self._book('booking-4').status_code, 201)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(IdempotencyKey.purge_expired(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class AppointmentPaginationTest(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(username='doc7', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+        self.patient_user = User.objects.create_user(username='pat7', password='pass')
+        self.patient = Patient.objects.create(user=self.patient_user)
+        self.admin = User.objects.create_user(username='admin7', password='pass', is_staff=True)
+
+        day = _next_weekday()
+        for hour in (9, 11, 10, 12, 13):
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=day,
+                start_time=time(hour, 0), end_time=time(hour, 30),
+            )
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, schedule=schedule,
+            )
+        self.client = APIClient()
+        self.url = reverse('appointment-list')
+
+    def _walk(self, page_size):
+        ids = []
+        response = self.client.get(self.url, {'page_size': page_size}, secure=True)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'], secure=True)
+
+    def test_admin_pages_newest_first(self):
+        self.client.force_authenticate(user=self.admin)
+        expected = list(
+            Appointment.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(self._walk(page_size=2), expected)
+
+    def test_patient_agenda_pages_by_slot(self):
+        self.client.force_authenticate(user=self.patient_user)
+        expected = list(
+            Appointment.objects.order_by('schedule__date', 'schedule__start_time')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(self._walk(page_size=2), expected)
+
+    def test_agenda_pages_within_a_day_without_offsets(self):
+        self.client.force_authenticate(user=self.doctor.user)
+        expected = list(
+            Appointment.objects.order_by('schedule__start_time').values_list('id', flat=True)
+        )
+        response = self.client.get(self.url, {'page_size': 2}, secure=True)
+        ids = []
+        while True:
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                break
+            cursor = parse_qs(urlsplit(response.data['next']).query)['cursor'][0]
+            # Pozitia e exacta, fara OFFSET peste randurile din aceeasi zi
+            self.assertNotIn('o', parse_qs(b64decode(cursor).decode()))
+            response = self.client.get(response.data['next'], secure=True)
+
+        self.assertEqual(ids, expected)
+
+    def test_agenda_follows_a_moved_slot(self):
+        first = Appointment.objects.get(schedule__start_time=time(9, 0))
+        claimed_schedule = Schedule.objects.create(
+            doctor=self.doctor, date=first.schedule.date, start_time=time(8, 0), end_time=time(8, 30),
+        )
+        claimed = Appointment.claim_slot(patient=self.patient, doctor=self.doctor, schedule=claimed_schedule)
+        self.assertEqual(claimed.slot_at, reminders.slot_start(claimed_schedule))
+
+        # Slotul de la 9:00 se muta la sfarsitul zilei
+        schedule = first.schedule
+        schedule.start_time, schedule.end_time = time(17, 0), time(17, 30)
+        schedule.save()
+        first.refresh_from_db()
+        self.assertEqual(timezone.localtime(first.slot_at).time(), time(17, 0))
+
+        self.client.force_authenticate(user=self.patient_user)
+        ids = self._walk(page_size=2)
+        self.assertEqual(ids[0], claimed.id)
+        self.assertEqual(ids[-1], first.id)
+
+    def test_list_without_cursor_is_not_paginated(self):
+        self.client.force_authenticate(user=self.doctor.user)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 5)
+
+
+class SparseFieldsetTest(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(
+            username='doc8', password='pass', first_name='Ana', last_name='Pop'
+        )
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+        self.patient_user = User.objects.create_user(username='pat8', password='pass')
+        self.patient = Patient.objects.create(user=self.patient_user)
+
+        day = _next_weekday()
+        for hour in (9, 10, 11):
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=day,
+                start_time=time(hour, 0), end_time=time(hour, 30),
+            )
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, schedule=schedule,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.patient_user)
+        self.url = reverse('appointment-list')
+
+    def test_default_representation_is_unchanged(self):
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(
+            set(response.data[0]),
+            {'id', 'patient', 'doctor', 'schedule', 'doctor_details', 'patient_details',
+             'schedule_details', 'status', 'created_at', 'updated_at', 'notes'},
+        )
+
+    def test_calendar_fields(self):
+        # Role lookups (profile, doctor) plus the appointments query
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                self.url, {'fields': 'id,status,date,start_time'}, secure=True
+            )
+        self.assertEqual(set(response.data[0]), {'id', 'status', 'date', 'start_time'})
+
+    def test_expand_keeps_flat_fields(self):
+        response = self.client.get(self.url, {'expand': 'schedule_details'}, secure=True)
+        item = response.data[0]
+        self.assertIn('schedule_details', item)
+        self.assertNotIn('doctor_details', item)
+        self.assertNotIn('patient_details', item)
+        self.assertEqual(item['doctor'], self.doctor.id)
+        self.assertEqual(item['schedule_details']['doctor_name'], 'Dr. Pop Ana')
+
+    def test_nested_details_do_not_query_per_row(self):
+        with self.assertNumQueries(3):
+            self.client.get(self.url, secure=True)
+
+
+class AdminStatsCountersTest(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(username='doc9', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user(username='pat9', password='pass')
+        )
+        self.admin = User.objects.create_user(username='admin9', password='pass', is_staff=True)
+        self.today = timezone.now().date()
+
+        self.appointments = []
+        for hour, day in ((9, self.today), (10, self.today), (11, _next_weekday())):
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=day,
+                start_time=time(hour, 0), end_time=time(hour, 30),
+            )
+            self.appointments.append(Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, schedule=schedule,
+            ))
+
+    def _stats(self):
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        response = client.get(reverse('appointment-admin-stats'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counters_follow_creates_and_status_changes(self):
+        appointment = Appointment.objects.get(pk=self.appointments[0].pk)
+        appointment.status = 'confirmed'
+        appointment.save()
+
+        data = self._stats()
+        self.assertEqual(data['total_appointments'], 3)
+        self.assertEqual(data['appointments_today'], 2)
+        self.assertEqual(data['appointments_by_status'], {'pending': 2, 'confirmed': 1})
+        self.assertEqual(data['total_doctors'], 1)
+        self.assertEqual(data['total_patients'], 1)
+        self.assertEqual(len(data['recent_appointments']), 3)
+
+    def test_delete_decrements_counters(self):
+        self.appointments[2].delete()
+
+        data = self._stats()
+        self.assertEqual(data['total_appointments'], 2)
+        self.assertEqual(data['appointments_by_status'], {'pending': 2})
+
+    def test_moving_a_booked_slot_moves_the_date_counter(self):
+        schedule = Schedule.objects.get(pk=self.appointments[0].schedule_id)
+        schedule.date = _next_weekday() + timedelta(days=7)
+        schedule.save()
+
+        self.assertEqual(self._stats()['appointments_today'], 1)
+        self.assertEqual(
+            StatCounter.objects.get(name=stats.date_counter(schedule.date)).value, 1
+        )
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_reconcile_corrects_drift(self):
+        # Bypasses the signals, like any queryset update would
+        Appointment.objects.filter(pk=self.appointments[0].pk).update(status='cancelled')
+        StatCounter.objects.filter(name=stats.TOTAL_DOCTORS).update(value=7)
+
+        drift = stats.reconcile()
+
+        self.assertEqual(drift[stats.TOTAL_DOCTORS], (7, 1))
+        self.assertEqual(drift[stats.status_counter('cancelled')], (0, 1))
+        self.assertEqual(stats.reconcile(), {})
+        self.assertEqual(
+            self._stats()['appointments_by_status'], {'pending': 2, 'cancelled': 1}
+        )
+
+
+class AppointmentQueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='budget_admin', password='pass', is_staff=True)
+        self.doctors = [
+            Doctor.objects.create(
+                user=User.objects.create_user(username=f'budget_doc{i}', password='pass'),
+                speciality='gen',
+            )
+            for i in range(2)
+        ]
+        self.patients = [
+            Patient.objects.create(
+                user=User.objects.create_user(username=f'budget_pat{i}', password='pass')
+            )
+            for i in range(2)
+        ]
+        self.day = _next_weekday()
+
+    def _authenticate(self, user):
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+
+    def _grow(self, size, doctor=None, patient=None):
+        def grow(size):
+            existing = Appointment.objects.count()
+            for n in range(existing, size):
+                owner = doctor or self.doctors[n % 2]
+                schedule = Schedule.objects.create(
+                    doctor=owner, date=self.day + timedelta(days=7 * n),
+                    start_time=time(9, 0), end_time=time(10, 0),
+                )
+                Appointment.objects.create(
+                    patient=patient or self.patients[n % 2], doctor=owner, schedule=schedule,
+                )
+        return grow
+
+    def _list(self):
+        return self.client.get(reverse('appointment-list'), secure=True)
+
+    def test_list_as_admin(self):
+        self._authenticate(self.admin)
+        self.assertQueryBudget(AppointmentViewSet, 'list', self._grow(None), self._list)
+
+    def test_list_as_doctor(self):
+        doctor = self.doctors[0]
+        self._authenticate(doctor.user)
+        self.assertQueryBudget(
+            AppointmentViewSet, 'list', self._grow(None, doctor=doctor), self._list
+        )
+
+    def test_list_as_patient(self):
+        patient = self.patients[0]
+        self._authenticate(patient.user)
+        self.assertQueryBudget(
+            AppointmentViewSet, 'list', self._grow(None, patient=patient), self._list
+        )
+
+
+    def test_create_as_patient(self):
+        patient = self.patients[0]
+        doctor = self.doctors[0]
+        self._authenticate(patient.user)
+        # Created by the first booking otherwise, one extra INSERT each
+        Appointment.objects.create(
+            patient=self.patients[1], doctor=doctor, schedule=Schedule.objects.create(
+                doctor=doctor, date=self.day, start_time=time(8, 0), end_time=time(8, 15),
+            ),
+        )
+        slots = []
+
+        def seed(size):
+            self._grow(size, doctor=doctor, patient=patient)(size)
+            slots.append(Schedule.objects.create(
+                doctor=doctor, date=self.day,
+                start_time=time(9 + len(slots), 0), end_time=time(9 + len(slots), 30),
+            ))
+
+        self.assertQueryBudget(
+            AppointmentViewSet, 'create', seed,
+            lambda: self.client.post(
+                reverse('appointment-list'),
+                {'patient': patient.id, 'doctor': doctor.id, 'schedule': slots[-1].id},
+                format='json', secure=True,
+            ),
+        )
+
+    def _book_day(self, doctor):
+        """Grow the doctor's active appointments on self.day to ``size``"""
+        def book(size):
+            for n in range(size):
+                taken = Schedule.objects.filter(doctor=doctor, date=self.day).count()
+                schedule = Schedule.objects.create(
+                    doctor=doctor, date=self.day,
+                    start_time=time(8 + taken // 4, 15 * (taken % 4)),
+                    end_time=time(9 + taken // 4, 15 * (taken % 4)),
+                )
+                Appointment.objects.create(
+                    patient=self.patients[n % 2], doctor=doctor, schedule=schedule,
+                    status='confirmed',
+                )
+        return book
+
+    def test_cancel_day_as_admin(self):
+        doctor = self.doctors[0]
+        # Created by the first cancellation otherwise, one extra INSERT
+        StatCounter.objects.create(name=stats.status_counter('cancelled'), value=0)
+        self._authenticate(self.admin)
+        self.assertQueryBudget(
+            AppointmentViewSet, 'cancel_day', self._book_day(doctor),
+            lambda: self.client.post(
+                reverse('appointment-cancel-day'),
+                {'doctor': doctor.id, 'date': self.day.isoformat()}, format='json', secure=True,
+            ),
+        )
+
+
+class CancelDayTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='day_admin', password='pass', is_staff=True)
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='day_doc', password='pass', last_name="O'Neil"),
+            speciality='gen',
+        )
+        self.other_doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='day_doc2', password='pass'), speciality='gen',
+        )
+        self.day = _next_weekday()
+        self.appointments = []
+        for n in range(3):
+            patient = Patient.objects.create(
+                user=User.objects.create_user(
+                    username=f'day_pat{n}', password='pass', email=f'day_pat{n}@example.com'
+                )
+            )
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=self.day,
+                start_time=time(9 + n, 0), end_time=time(10 + n, 0),
+            )
+            self.appointments.append(Appointment.objects.create(
+                patient=patient, doctor=self.doctor, schedule=schedule,
+                status='confirmed' if n else 'pending',
+            ))
+        other_schedule = Schedule.objects.create(
+            doctor=self.other_doctor, date=self.day, start_time=time(9, 0), end_time=time(10, 0),
+        )
+        self.untouched = Appointment.objects.create(
+            patient=self.appointments[0].patient, doctor=self.other_doctor, schedule=other_schedule,
+        )
+
+    def _cancel_day(self, user, **data):
+        self.client.force_authenticate(user=user)
+        return self.client.post(
+            reverse('appointment-cancel-day'),
+            {'date': self.day.isoformat(), **data}, format='json', secure=True,
+        )
+
+    def test_doctor_cancels_own_day(self):
+        response = self._cancel_day(self.doctor.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cancelled'], 3)
+        for appointment in self.appointments:
+            appointment.refresh_from_db()
+            self.assertEqual(appointment.status, 'cancelled')
+            self.assertTrue(appointment.schedule.is_available)
+        self.untouched.refresh_from_db()
+        self.assertEqual(self.untouched.status, 'pending')
+
+        notifications = Notification.objects.filter(type='email', template='appointment_cancelled')
+        self.assertEqual(notifications.count(), 3)
+        title, message = notifications.first().render()
+        self.assertEqual(title, 'Appointment Cancelled')
+        # Escaped once, when rendered
+        self.assertIn('Dr. O&#x27;Neil', message)
+        self.assertEqual(
+            OutboxMessage.objects.filter(notification__in=notifications).count(), 3
+        )
+        self.assertEqual(ReminderChange.objects.filter(
+            appointment_id__in=[a.id for a in self.appointments]
+        ).count(), 3 + 3)  # created + cancelled
+
+    def test_counters_follow_the_bulk_cancel(self):
+        self._cancel_day(self.doctor.user)
+        self.assertEqual(StatCounter.objects.get(name=stats.status_counter('cancelled')).value, 3)
+        self.assertEqual(StatCounter.objects.get(name=stats.status_counter('confirmed')).value, 0)
+        self.assertEqual(StatCounter.objects.get(name=stats.status_counter('pending')).value, 1)
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_freed_slots_return_to_the_slot_index(self):
+        index = get_slot_index()
+        index.invalidate()
+        self.addCleanup(index.invalidate)
+        self.assertEqual(index.search(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._cancel_day(self.doctor.user)
+
+        self.assertEqual(
+            [slot['id'] for slot in index.search()],
+            [appointment.schedule_id for appointment in self.appointments],
+        )
+
+    def test_admin_notifies_the_doctor_once(self):
+        response = self._cancel_day(self.admin, doctor=self.doctor.id)
+        self.assertEqual(response.data['cancelled'], 3)
+        self.assertEqual(
+            Notification.objects.filter(user=self.doctor.user, type='system').count(), 1
+        )
+
+    def test_admin_must_name_the_doctor(self):
+        self.assertEqual(self._cancel_day(self.admin).status_code, 400)
+
+    def test_patient_cannot_cancel_a_day(self):
+        response = self._cancel_day(self.appointments[0].patient.user)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Appointment.objects.filter(status='cancelled').exists())
+
+    def test_invalid_date(self):
+        self.client.force_authenticate(user=self.doctor.user)
+        response = self.client.post(
+            reverse('appointment-cancel-day'), {'date': '2024-02-30'}, format='json', secure=True,
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryCounterTest(TestCase):
+    def test_groups_statements_by_normalized_sql(self):
+        users = [User.objects.create_user(username=f'qc{i}', password='pass') for i in range(3)]
+        counter = QueryCounter()
+        with counter.count():
+            for user in users:
+                list(Patient.objects.filter(user_id=user.id))
+            Doctor.objects.count()
+        self.assertEqual(counter.total, 4)
+        duplicates = counter.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        self.assertIn('patients_patient', duplicates[0][0])
+        self.assertEqual(duplicates[0][1], 3)
+
+    @override_settings(QUERY_COUNT={'ENABLED': True, 'DUPLICATE_THRESHOLD': 2})
+    def test_middleware_warns_over_budget(self):
+        patient = Patient.objects.create(
+            user=User.objects.create_user(username='qc_pat', password='pass')
+        )
+        client = APIClient()
+        client.force_authenticate(user=patient.user)
+        with patch.dict(AppointmentViewSet.query_budgets, {'list': 0}), \
+                self.assertLogs('appointments', level='WARNING') as logs:
+            client.get(reverse('appointment-list'), secure=True)
+        self.assertTrue(any('AppointmentViewSet.list ran' in line for line in logs.output))
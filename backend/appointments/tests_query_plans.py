@@ -0,0 +1,358 @@
+"""
+EXPLAIN QUERY PLAN regression suite for the hot endpoints.
+
+Every SELECT issued by an endpoint is explained against the seeded test
+database. A test fails when a statement starts scanning a large table
+without an index or sorts through a temporary B-tree, and when a plan
+differs from the approved snapshot in ``query_plans/``.
+
+After an intended change, review the new plans and approve them with:
+
+    UPDATE_QUERY_PLANS=1 python manage.py test appointments.tests_query_plans
+"""
+
+import os
+import re
+from itertools import product
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import NotificationPreferences
+from doctors.models import Doctor, Schedule
+from notifications.models import Notification
+from notifications.outbox import claim
+from notifications.scheduler import dispatch_upcoming_appointment_reminders
+from patients.models import Patient
+from .models import Appointment
+from .querycount import normalize_sql
+
+SNAPSHOT_DIR = Path(__file__).resolve().parent / 'query_plans'
+UPDATE_SNAPSHOTS = os.environ.get('UPDATE_QUERY_PLANS') == '1'
+
+LARGE_TABLES = {
+    'appointments_appointment',
+    'doctors_schedule',
+    'notifications_notification',
+    'auth_user',
+}
+
+# Plans accepted although they match a forbidden pattern, with the reason.
+# Keys are (snapshot name, plan line).
+ACCEPTED_PLANS = {}
+
+
+def _next_weekday(start):
+    day = start
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def explain(sql):
+    """Return the plan of ``sql`` as indented lines."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        rows = cursor.fetchall()
+
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def _statement_label(sql):
+    match = re.search(r'\bFROM\s+"?(\w+)"?', sql)
+    return match.group(1) if match else sql.split()[0]
+
+
+class QueryPlanTestCase(TestCase):
+    """Seeds a small clinic and checks plans of the statements run by a block."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='plan_admin', password='pass', is_staff=True)
+
+        cls.doctors = []
+        for i in range(3):
+            user = User.objects.create_user(
+                username=f'plan_doc{i}', password='pass', last_name=f'Doc{i}'
+            )
+            cls.doctors.append(Doctor.objects.create(user=user, speciality='gen'))
+
+        cls.patients = []
+        for i in range(4):
+            user = User.objects.create_user(
+                username=f'plan_pat{i}', password='pass', email=f'pat{i}@example.com'
+            )
+            cls.patients.append(Patient.objects.create(user=user))
+            NotificationPreferences.objects.create(user=user)
+
+        first_day = _next_weekday(timezone.localdate() + timedelta(days=1))
+        cls.schedules = []
+        for doctor in cls.doctors:
+            day = first_day
+            for _ in range(3):
+                for hour in (9, 10, 11, 12):
+                    cls.schedules.append(Schedule.objects.create(
+                        doctor=doctor, date=day,
+                        start_time=time(hour, 0), end_time=time(hour, 30),
+                    ))
+                day = _next_weekday(day + timedelta(days=1))
+
+        cls.appointments = []
+        for i, schedule in enumerate(cls.schedules[:8:2]):
+            cls.appointments.append(Appointment.objects.create(
+                patient=cls.patients[i % len(cls.patients)],
+                doctor=schedule.doctor,
+                schedule=schedule,
+                status='confirmed' if i % 2 else 'pending',
+            ))
+
+        for patient in cls.patients:
+            for i in range(3):
+                Notification.objects.create(
+                    user=patient.user, type='system', title=f'N{i}', message='m',
+                )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertPlansIndexed(self, name, queries):
+        """
+        Fail when a statement of ``queries`` scans a large table or sorts
+        without an index; returns the plans as report lines
+        """
+        report = []
+        violations = []
+
+        # Each distinct statement once, in order of first execution; how
+        # often a statement repeats is the query budget's concern, not the plan's
+        selects = {}
+        for query in queries:
+            sql = query['sql']
+            if sql.lstrip().upper().startswith('SELECT'):
+                selects.setdefault(normalize_sql(sql), sql)
+
+        for number, sql in enumerate(selects.values(), start=1):
+            plan = explain(sql)
+            report.append(f'-- {number}: {_statement_label(sql)}')
+            report.extend(plan)
+
+            for line in plan:
+                detail = line.strip()
+                if (name, detail) in ACCEPTED_PLANS:
+                    continue
+                scan = re.match(r'SCAN (\w+)(.*)', detail)
+                if scan and scan.group(1) in LARGE_TABLES and 'INDEX' not in scan.group(2):
+                    violations.append(f'{detail}\n    in: {sql}')
+                if detail.startswith('USE TEMP B-TREE'):
+                    violations.append(f'{detail}\n    in: {sql}')
+
+        self.assertFalse(
+            violations,
+            f'{name}: statements scan large tables or sort without an index:\n'
+            + '\n'.join(violations)
+        )
+        return report
+
+    def assertPlansApproved(self, name, queries):
+        """Check the plans of ``queries`` and compare them with the snapshot."""
+        report = self.assertPlansIndexed(name, queries)
+
+        snapshot = SNAPSHOT_DIR / f'{name}.txt'
+        content = '\n'.join(report) + '\n'
+        if UPDATE_SNAPSHOTS or not snapshot.exists():
+            SNAPSHOT_DIR.mkdir(exist_ok=True)
+            snapshot.write_text(content)
+            if not UPDATE_SNAPSHOTS:
+                self.fail(f'{name}: no approved plan yet, wrote {snapshot}; review and commit it')
+            return
+        self.assertEqual(
+            content, snapshot.read_text(),
+            f'{name}: query plans changed, review and re-run with UPDATE_QUERY_PLANS=1 if intended'
+        )
+
+    def capture(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args, **kwargs)
+        return result, ctx.captured_queries
+
+
+class AppointmentQueryPlanTest(QueryPlanTestCase):
+    def _list(self, user):
+        self.client.force_authenticate(user=user)
+        response, queries = self.capture(
+            self.client.get, reverse('appointment-list'), {'page_size': 5}, secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_list_admin(self):
+        self.assertPlansApproved('appointments_list_admin', self._list(self.admin))
+
+    def test_list_doctor(self):
+        self.assertPlansApproved('appointments_list_doctor', self._list(self.doctors[0].user))
+
+    def test_list_patient(self):
+        self.assertPlansApproved('appointments_list_patient', self._list(self.patients[0].user))
+
+    def test_create(self):
+        schedule = self.schedules[1]
+        patient = self.patients[0]
+        self.client.force_authenticate(user=patient.user)
+        response, queries = self.capture(
+            self.client.post, reverse('appointment-list'),
+            {'patient': patient.id, 'doctor': schedule.doctor_id, 'schedule': schedule.id},
+            format='json', secure=True,
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertPlansApproved('appointments_create', queries)
+
+    def test_confirm(self):
+        appointment = self.appointments[0]
+        self.client.force_authenticate(user=appointment.doctor.user)
+        response, queries = self.capture(
+            self.client.post,
+            reverse('appointment-confirm', kwargs={'pk': appointment.pk}), secure=True,
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertPlansApproved('appointments_confirm', queries)
+
+    def test_cancel(self):
+        appointment = self.appointments[1]
+        self.client.force_authenticate(user=appointment.patient.user)
+        response, queries = self.capture(
+            self.client.post,
+            reverse('appointment-cancel', kwargs={'pk': appointment.pk}), secure=True,
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertPlansApproved('appointments_cancel', queries)
+
+
+class ScheduleAndDoctorQueryPlanTest(QueryPlanTestCase):
+    def _get(self, user, url):
+        self.client.force_authenticate(user=user)
+        response, queries = self.capture(self.client.get, url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_schedule_list_patient(self):
+        queries = self._get(self.patients[0].user, reverse('schedule-list'))
+        self.assertPlansApproved('schedules_list_patient', queries)
+
+    def test_schedule_list_doctor(self):
+        queries = self._get(self.doctors[0].user, reverse('schedule-list'))
+        self.assertPlansApproved('schedules_list_doctor', queries)
+
+    def test_schedule_list_filtered(self):
+        queries = self._get(self.admin, reverse('schedule-list') + (
+            f'?doctor={self.doctors[1].id}&time_from=10:00&ordering=-date'
+        ))
+        self.assertPlansApproved('schedules_list_filtered', queries)
+
+    def test_schedule_filters_use_indexes(self):
+        """Every combination of list filters, for every role, stays off full scans."""
+        day = self.schedules[0].date
+        filters = [
+            {'doctor': self.doctors[0].id},
+            {'speciality': 'gen'},
+            {'from': day.isoformat(), 'to': (day + timedelta(days=7)).isoformat()},
+            {'is_available': 'true'},
+            {'time_from': '10:00', 'time_to': '11:00'},
+            {'ordering': '-date'},
+        ]
+        users = {
+            'admin': self.admin, 'doctor': self.doctors[0].user, 'patient': self.patients[0].user,
+        }
+        for role, user in users.items():
+            self.client.force_authenticate(user=user)
+            for chosen in product((False, True), repeat=len(filters)):
+                params = {}
+                for use, extra in zip(chosen, filters):
+                    if use:
+                        params.update(extra)
+                with self.subTest(role=role, params=params):
+                    response, queries = self.capture(
+                        self.client.get, reverse('schedule-list'), params, secure=True
+                    )
+                    self.assertEqual(response.status_code, 200, response.data)
+                    self.assertPlansIndexed('schedules_list_filters', queries)
+
+    def test_doctor_list(self):
+        queries = self._get(self.patients[0].user, reverse('doctor-list'))
+        self.assertPlansApproved('doctors_list', queries)
+
+
+class NotificationQueryPlanTest(QueryPlanTestCase):
+    def test_notification_list(self):
+        self.client.force_authenticate(user=self.patients[0].user)
+        response, queries = self.capture(
+            self.client.get, reverse('notification-list'), secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertPlansApproved('notifications_list', queries)
+
+    def test_notification_page_and_unread_count(self):
+        self.client.force_authenticate(user=self.patients[0].user)
+        response, queries = self.capture(
+            self.client.get, reverse('notification-list'), {'page_size': 2}, secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertPlansApproved('notifications_page', queries)
+
+        # First read recounts from the partial unread index
+        response, queries = self.capture(
+            self.client.get, reverse('notification-unread-count'), secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertPlansApproved('notifications_unread_count', queries)
+
+    def test_notification_wait(self):
+        self.client.force_authenticate(user=self.patients[0].user)
+        response, queries = self.capture(
+            self.client.get, reverse('notification-wait'), {'after': 0}, secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertPlansApproved('notifications_wait', queries)
+
+    @patch('notifications.email_service.EmailService.send_notification_email', return_value=True)
+    def test_dispatch_reminders(self, mock_send):
+        # Run the day before the first confirmed appointment so the same
+        # statements execute whatever the current weekday
+        schedule = self.appointments[1].schedule
+        now = timezone.make_aware(
+            datetime.combine(schedule.date - timedelta(days=1), time(8, 0))
+        )
+        with patch('notifications.scheduler.timezone.now', return_value=now):
+            _, queries = self.capture(dispatch_upcoming_appointment_reminders)
+        self.assertPlansApproved('dispatch_reminders', queries)
+
+    def test_outbox_claim(self):
+        for patient in self.patients:
+            Notification.objects.create(user=patient.user, type='email', title='E', message='m')
+        messages, queries = self.capture(claim, 10)
+        self.assertEqual(len(messages), len(self.patients))
+        self.assertPlansApproved('outbox_claim', queries)
+
+
+class QueryPlanCheckerTest(QueryPlanTestCase):
+    def test_unindexed_filter_is_reported(self):
+        _, queries = self.capture(list, Schedule.objects.filter(end_time=time(9, 30)))
+        with self.assertRaisesMessage(AssertionError, 'SCAN doctors_schedule'):
+            self.assertPlansApproved('unindexed_probe', queries)
+
+    def test_temp_btree_sort_is_reported(self):
+        _, queries = self.capture(list, Notification.objects.order_by('title'))
+        with self.assertRaisesMessage(AssertionError, 'USE TEMP B-TREE'):
+            self.assertPlansApproved('unsorted_probe', queries)
@@ -5,13 +5,21 @@ from django.db import transaction, IntegrityError
 from django.core.exceptions import PermissionDenied, ValidationError
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from django.shortcuts import get_object_or_404
-from django.db.models import Count
 from django.utils import timezone
+from collections import Counter
 from datetime import datetime
-from .models import Appointment, Doctor, Patient
+from django.utils.dateparse import parse_date
+from .models import Appointment, SlotAlreadyBooked
 from .serializers import AppointmentSerializer
-from doctors.models import Schedule
-from notifications.models import Notification
+from .admission import SlotBusy, get_slot_admission
+from .idempotency import idempotent, transient
+from .reminders import slot_start
+from .stats import bump, dashboard_counters, status_change_deltas
+from .pagination import AppointmentCursorPagination, AgendaCursorPagination
+from doctors.models import Doctor, Schedule
+from doctors.slot_index import index_slots
+from notifications.messages import appointment_params
+from notifications.models import Notification, ReminderChange
 from authentication.permissions import IsAdminRole
 import logging
 
@@ -21,30 +29,92 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Token, role lookups and one joined query for the appointments;
+    # cancel_day runs a fixed set of bulk statements and savepoints
+    query_budgets = {'list': 5, 'retrieve': 5, 'create': 24, 'cancel_day': 16}
     
     def get_queryset(self):
         user = self.request.user
         
         # Admin vede toate appointment-urile
         if IsAdminRole().has_permission(self.request, self):
-            return Appointment.objects.all().select_related(
-                'doctor__user', 'patient__user', 'schedule'
-            ).order_by('-created_at')
-        
+            queryset = Appointment.objects.all().order_by('-created_at')
         # Doctor/pacient vede doar programarile proprii
-        if hasattr(user, 'doctor') and user.doctor:
-            return Appointment.objects.filter(doctor=user.doctor).select_related(
-                'doctor__user', 'patient__user', 'schedule'
-            )
+        elif hasattr(user, 'doctor') and user.doctor:
+            queryset = Appointment.objects.filter(doctor=user.doctor)
         elif hasattr(user, 'patient') and user.patient:
-            return Appointment.objects.filter(patient=user.patient).select_related(
-                'doctor__user', 'patient__user', 'schedule'
-            )
+            queryset = Appointment.objects.filter(patient=user.patient)
         elif user.is_staff or user.is_superuser:
-            return Appointment.objects.all()
+            queryset = Appointment.objects.all()
         else:
             return Appointment.objects.none()
+
+        return self._select_for_fields(queryset)
+
+    # Related rows and columns needed to render each serializer field
+    FIELD_RELATIONS = {
+        'doctor_details': ('doctor__user', [
+            'doctor__speciality', 'doctor__description', 'doctor__user__username',
+            'doctor__user__email', 'doctor__user__first_name', 'doctor__user__last_name',
+        ]),
+        'patient_details': ('patient__user', [
+            'patient__date_of_birth', 'patient__user__username', 'patient__user__email',
+            'patient__user__first_name', 'patient__user__last_name',
+        ]),
+        'schedule_details': ('schedule', [
+            'schedule__doctor', 'schedule__date', 'schedule__start_time',
+            'schedule__end_time', 'schedule__is_available',
+        ]),
+        'date': ('schedule', ['schedule__date']),
+        'start_time': ('schedule', ['schedule__start_time']),
+        'end_time': ('schedule', ['schedule__end_time']),
+    }
+    FLAT_COLUMNS = {
+        'patient': 'patient', 'doctor': 'doctor', 'schedule': 'schedule',
+        'status': 'status', 'updated_at': 'updated_at', 'notes': 'notes',
+    }
+
+    def _select_for_fields(self, queryset):
+        """
+        Join only the related rows the requested fields render and, for
+        sparse requests (?fields= / ?expand=), load only their columns
+        """
+        params = self.request.query_params
+        selected = AppointmentSerializer.selected_fields(params)
+
+        related = set()
+        columns = ['id', 'created_at']
+        for name in selected:
+            if name in self.FIELD_RELATIONS:
+                relation, relation_columns = self.FIELD_RELATIONS[name]
+                related.add(relation)
+                columns.extend(relation_columns)
+            elif name in self.FLAT_COLUMNS:
+                columns.append(self.FLAT_COLUMNS[name])
+        if 'schedule_details' in selected:
+            # ScheduleSerializer.doctor_name reads the doctor through the schedule
+            related.add('doctor__user')
+            columns.extend(self.FIELD_RELATIONS['doctor_details'][1])
+
+        if related:
+            queryset = queryset.select_related(*sorted(related))
+        if self.action == 'list' and ('fields' in params or 'expand' in params):
+            queryset = queryset.only(*columns)
+        return queryset
         
+    @property
+    def paginator(self):
+        """
+        Adminii pagineaza dupa (created_at, id), doctorii si pacientii
+        dupa data programarii
+        """
+        if not hasattr(self, '_paginator'):
+            if IsAdminRole().has_permission(self.request, self):
+                self._paginator = AppointmentCursorPagination()
+            else:
+                self._paginator = AgendaCursorPagination()
+        return self._paginator
+
     def get_object(self):
         """
         Returneaza appointment-ul doar daca utilizatorul are dreptul sa-l acceseze
@@ -67,10 +137,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         return obj
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         """
         SQLite-compatible appointment creation with proper transaction control
-        Demonstrates ACID properties and conflict resolution
+        The slot is claimed with a single conditional write; losers get 409
         """
         schedule_id = request.data.get('schedule')
         
@@ -86,39 +157,38 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         logger.info(f"Appointment booking attempt for schedule {schedule_id} by user {request.user.id}")
 
         try:
-            # Use the retry mechanism for SQLite transaction control
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
+            # Only the first claimant of a slot goes on to the database, concurrent
+            # requests for the same slot wait for its outcome or are turned away
+            with get_slot_admission().admit(schedule.id) as claim:
+                serializer = self.get_serializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
 
-            user = request.user
-            if not (
-                IsAdminRole().has_permission(request, self) or
-                (hasattr(user, 'patient') and serializer.validated_data['patient'] == user.patient)
-            ):
-                raise PermissionDenied("You can only book appointments for yourself.")
+                user = request.user
+                if not (
+                    IsAdminRole().has_permission(request, self) or
+                    (hasattr(user, 'patient') and serializer.validated_data['patient'] == user.patient)
+                ):
+                    raise PermissionDenied("You can only book appointments for yourself.")
 
-            # Extract data for appointment creation
-            appointment_data = {
-                'patient': serializer.validated_data['patient'],
-                'doctor': serializer.validated_data['doctor'],
-                'schedule': serializer.validated_data['schedule'],
-                'notes': serializer.validated_data.get('notes', ''),
-                'status': 'pending'
-            }
+                # Extract data for appointment creation
+                appointment_data = {
+                    'patient': serializer.validated_data['patient'],
+                    'doctor': serializer.validated_data['doctor'],
+                    'schedule': serializer.validated_data['schedule'],
+                    'notes': serializer.validated_data.get('notes', ''),
+                    'status': 'pending'
+                }
             
-            # Use the retry mechanism from the model
-            appointment = Appointment.create_with_retry(**appointment_data)
+                # Claim the slot and insert the appointment in one short transaction
+                appointment = Appointment.claim_slot(**appointment_data)
+                claim.booked = True
             
             # Create notification for doctor
-            from django.utils.html import escape
-            safe_first_name = escape(appointment.patient.user.first_name)
-            safe_last_name = escape(appointment.patient.user.last_name)
-
             Notification.objects.create(
                 user=appointment.doctor.user,
                 type='system',
-                title='New Appointment',
-                message=f'You have a new appointment with {safe_first_name} {safe_last_name} on {appointment.schedule.date} at {appointment.schedule.start_time}'
+                template='appointment_booked',
+                params=appointment_params(appointment),
             )
             
             # Log successful booking
@@ -130,6 +200,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
         except PermissionDenied:
             raise
+        except (SlotAlreadyBooked, SlotBusy) as e:
+            logger.info(f"Appointment booking lost the race for schedule {schedule_id}: {str(e)}")
+            response = Response(
+                {'error': str(e)},
+                status=status.HTTP_409_CONFLICT
+            )
+            # Slotul poate fi inca liber: un retry cu aceeasi cheie trebuie sa ruleze din nou
+            return transient(response) if getattr(e, 'transient', False) else response
         except (ValidationError, DRFValidationError) as e:
             logger.warning(f"Appointment booking failed for schedule {schedule_id}: {str(e)}")
             return Response(
@@ -150,6 +228,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=True, methods=['post'])
+    @idempotent
     @transaction.atomic
     def confirm(self, request, pk=None):
         appointment = self.get_object()
@@ -170,21 +249,19 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         appointment.status = 'confirmed'
         appointment.save()
         
-        from django.utils.html import escape
-        safe_doctor_name = escape(appointment.doctor.user.last_name)
-
         # Cream notificare pentru pacient
         Notification.objects.create(
             user=appointment.patient.user,
             type='email',
-            title='Appointment Confirmed',
-            message=f'Your appointment with Dr. {safe_doctor_name} on {appointment.schedule.date} at {appointment.schedule.start_time} has been confirmed.'
+            template='appointment_confirmed',
+            params=appointment_params(appointment),
         )
         
         logger.info(f"Appointment {appointment.id} confirmed by user {request.user.id}")
         return Response({'status': 'appointment confirmed'})
     
     @action(detail=True, methods=['post'])
+    @idempotent
     @transaction.atomic
     def cancel(self, request, pk=None):
         appointment = self.get_object()
@@ -215,71 +292,148 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         appointment.status = 'cancelled'
         appointment.save()  # This will handle schedule availability update
         
-        from django.utils.html import escape
-        
         # Pentru admin, notificam ambele parti
         if IsAdminRole().has_permission(request, self):
-            # Notifică pacientul
-            safe_doctor_name = escape(appointment.doctor.user.last_name)
-            Notification.objects.create(
-                user=appointment.patient.user,
-                type='email', 
-                title='Appointment Cancelled',
-                message=f'Your appointment with Dr. {safe_doctor_name} on {appointment.schedule.date} has been cancelled by the administration.'
-            )
-            
-            # Notifică doctorul
-            safe_first_name = escape(appointment.patient.user.first_name)
-            safe_last_name = escape(appointment.patient.user.last_name)
-            Notification.objects.create(
-                user=appointment.doctor.user,
-                type='system',
-                title='Appointment Cancelled',
-                message=f'The appointment with {safe_first_name} {safe_last_name} on {appointment.schedule.date} has been cancelled by the administration.'
-            )
+            # Notifică pacientul si doctorul
+            params = appointment_params(appointment, by_admin=True)
+            Notification.create_many([
+                Notification(
+                    user=appointment.patient.user,
+                    type='email',
+                    template='appointment_cancelled',
+                    params=params,
+                ),
+                Notification(
+                    user=appointment.doctor.user,
+                    type='system',
+                    template='appointment_cancelled_doctor',
+                    params=params,
+                ),
+            ])
         else:
             # Notificam celalalt participant
             if request.user == appointment.doctor.user:
                 # Medicul anuleaza
-                safe_doctor_name = escape(appointment.doctor.user.last_name)
                 Notification.objects.create(
                     user=appointment.patient.user,
                     type='email',
-                    title='Appointment Cancelled',
-                    message=f'Your appointment with Dr. {safe_doctor_name} on {appointment.schedule.date} has been cancelled.'
+                    template='appointment_cancelled',
+                    params=appointment_params(appointment),
                 )
             else:
                 # Pacientul anuleaza
-                safe_first_name = escape(appointment.patient.user.first_name)
-                safe_last_name = escape(appointment.patient.user.last_name)
                 Notification.objects.create(
                     user=appointment.doctor.user,
                     type='system',
-                    title='Appointment Cancelled',
-                    message=f'The appointment with {safe_first_name} {safe_last_name} on {appointment.schedule.date} has been cancelled.'
+                    template='appointment_cancelled_doctor',
+                    params=appointment_params(appointment),
                 )
         
         logger.info(f"Appointment {appointment.id} cancelled by user {request.user.id}")
         return Response({'status': 'appointment cancelled'})
     
+    @action(detail=False, methods=['post'])
+    @idempotent
+    @transaction.atomic
+    def cancel_day(self, request):
+        """
+        Anuleaza toate programarile viitoare ale unui doctor dintr-o zi
+
+        Body: ``date`` (YYYY-MM-DD) and, for admins, ``doctor``. The
+        appointments are cancelled, their slots freed and every patient
+        notified with a fixed number of statements, whatever the number of
+        appointments: these bulk writes skip the model signals, so the
+        dashboard counters, the reminder log and the slot index are updated
+        here.
+        """
+        user = request.user
+        is_admin = IsAdminRole().has_permission(request, self)
+        if is_admin:
+            doctor_id = request.data.get('doctor')
+            if not doctor_id:
+                return Response(
+                    {'error': 'doctor is required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            doctor = get_object_or_404(Doctor.objects.select_related('user'), pk=doctor_id)
+        elif hasattr(user, 'doctor') and user.doctor:
+            doctor = user.doctor
+        else:
+            raise PermissionDenied("Only doctors or admin can cancel a day of appointments.")
+
+        try:
+            day = parse_date(str(request.data.get('date', '')))
+        except ValueError:
+            day = None
+        if day is None:
+            return Response(
+                {'error': 'date must be a valid YYYY-MM-DD date'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        now = timezone.now()
+        # Programarile deja incepute raman neschimbate, ca la cancel
+        appointments = [
+            appointment for appointment in Appointment.objects.filter(
+                doctor=doctor, schedule__date=day, status__in=['pending', 'confirmed']
+            ).select_related('patient__user', 'doctor__user', 'schedule')
+            if slot_start(appointment.schedule) > now
+        ]
+        if not appointments:
+            return Response({'status': 'nothing to cancel', 'cancelled': 0})
+
+        Appointment.objects.filter(
+            id__in=[appointment.id for appointment in appointments]
+        ).update(status='cancelled', updated_at=now)
+        # Cel mult o programare activa pe slot, deci toate sloturile se elibereaza
+        Schedule.objects.filter(
+            id__in=[appointment.schedule_id for appointment in appointments]
+        ).update(is_available=True)
+        for appointment in appointments:
+            appointment.schedule.is_available = True
+        index_slots(appointment.schedule for appointment in appointments)
+
+        deltas = Counter()
+        for old_status, count in Counter(a.status for a in appointments).items():
+            deltas.update(status_change_deltas(old_status, 'cancelled', count))
+        bump(deltas)
+        ReminderChange.objects.bulk_create(
+            [ReminderChange(appointment_id=appointment.id) for appointment in appointments]
+        )
+
+        notifications = [
+            Notification(
+                user=appointment.patient.user,
+                type='email',
+                template='appointment_cancelled',
+                params=appointment_params(appointment, by_admin=is_admin),
+            )
+            for appointment in appointments
+        ]
+        if is_admin:
+            notifications.append(Notification(
+                user=doctor.user,
+                type='system',
+                template='day_cancelled',
+                params={'count': len(appointments), 'date': str(day)},
+            ))
+        Notification.create_many(notifications)
+
+        logger.info(
+            f"{len(appointments)} appointments of doctor {doctor.id} on {day} "
+            f"cancelled by user {request.user.id}"
+        )
+        return Response({'status': 'day cancelled', 'cancelled': len(appointments)})
+
     @action(detail=False, methods=['get'], permission_classes=[IsAdminRole])
     def admin_stats(self, request):
         """Admin-only endpoint pentru statistici dashboard"""
         today = timezone.now().date()
 
-        # Statistici de baza
+        # Statistici de baza, citite din contoarele mentinute incremental
+        counters = dashboard_counters(today)
         stats = {
-            'total_appointments': Appointment.objects.count(),
-            'appointments_today': Appointment.objects.filter(
-                schedule__date=today,
-            ).count(),
-            'appointments_by_status': dict(
-                Appointment.objects.values('status').annotate(
-                    count=Count('id')
-                ).values_list('status', 'count')
-            ),
-            'total_doctors': Doctor.objects.count(),
-            'total_patients': Patient.objects.count(),
+            **counters,
             'recent_appointments': AppointmentSerializer(
                 Appointment.objects.select_related(
                     'doctor__user', 'patient__user', 'schedule'
@@ -288,3 +442,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         }
 
         return Response(stats)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminRole])
+    def admission_stats(self, request):
+        """Contoarele cozii de admitere pentru rezervari concurente"""
+        return Response(get_slot_admission().stats())
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 11:27
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_remove_notificationpreferences_marketing_emails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationpreferences',
+            name='digest_window_minutes',
+            field=models.PositiveIntegerField(default=15, help_text='Minutes emails are held before a digest is sent', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(1440)]),
+        ),
+        migrations.AddField(
+            model_name='notificationpreferences',
+            name='email_digest',
+            field=models.BooleanField(default=False, help_text='Combine emails received within the digest window into one'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import check_password
+from django.core.validators import MaxValueValidator, MinValueValidator
 
 class UserProfile(models.Model):
     USER_ROLES = (
@@ -42,6 +43,12 @@ class NotificationPreferences(models.Model):
     appointment_confirmations = models.BooleanField(default=True, help_text="Email when appointments are confirmed")
     appointment_reminders = models.BooleanField(default=True, help_text="Email reminders before appointments")
     appointment_cancellations = models.BooleanField(default=True, help_text="Email when appointments are cancelled")
+    email_digest = models.BooleanField(default=False, help_text="Combine emails received within the digest window into one")
+    digest_window_minutes = models.PositiveIntegerField(
+        default=15,
+        validators=[MinValueValidator(1), MaxValueValidator(24 * 60)],
+        help_text="Minutes emails are held before a digest is sent",
+    )
     
     # System notifications
     system_notifications = models.BooleanField(default=True, help_text="Show in-app notifications")
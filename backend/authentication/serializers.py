@@ -115,6 +115,8 @@ class NotificationPreferencesSerializer(serializers.ModelSerializer):
             'appointment_confirmations', 
             'appointment_reminders',
             'appointment_cancellations',
+            'email_digest',
+            'digest_window_minutes',
             'system_notifications',
             'status_updates',
             'reminder_hours_before',
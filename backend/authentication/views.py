@@ -706,6 +706,8 @@ class UserViewSet(viewsets.ModelViewSet):
             preferences.appointment_confirmations = True
             preferences.appointment_reminders = True
             preferences.appointment_cancellations = True
+            preferences.email_digest = False
+            preferences.digest_window_minutes = 15
             preferences.system_notifications = True
             preferences.status_updates = True
             preferences.reminder_hours_before = 24
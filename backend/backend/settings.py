@@ -91,6 +91,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'appointments.middleware.TransactionMonitoringMiddleware',
+    'appointments.querycount.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -191,12 +192,23 @@ CONN_MAX_AGE = 600  # 10 minutes
 # Additional SQLite-specific settings for your thesis
 SQLITE_TRANSACTION_SETTINGS = {
     'ENABLE_WAL_MODE': True,
-    'MAX_RETRY_ATTEMPTS': 3,
-    'RETRY_DELAY_BASE': 0.1,  # 100ms base delay
     'ENABLE_TRANSACTION_LOGGING': DEBUG,
     'DEMONSTRATION_MODE': True, # for demonstrations
 }
 
+# In-process admission queue for concurrent bookings of the same slot
+# MODE: 'wait' (wait for the first claimant's outcome) or 'fail_fast'
+BOOKING_ADMISSION = {
+    'MODE': config('BOOKING_ADMISSION_MODE', default='wait'),
+    'WAIT_TIMEOUT': 2.0,  # seconds
+}
+
+# Query count per request, checked against the viewsets' query_budgets
+QUERY_COUNT = {
+    'ENABLED': DEBUG,
+    'DUPLICATE_THRESHOLD': 3,  # warn when a statement repeats this often
+}
+
 # Setare CORS
 CORS_ALLOW_ALL_ORIGINS = False
 CORS_ALLOWED_ORIGINS = [
@@ -219,6 +231,7 @@ CORS_ALLOWED_HEADERS = [
     'origin',
     'user-agent',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 REST_FRAMEWORK = {
@@ -235,6 +248,11 @@ REST_FRAMEWORK = {
 from datetime import timedelta
 TOKEN_EXPIRATION_TIME = timedelta(hours=1)
 
+# How long responses stored under an Idempotency-Key can be replayed
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# How long a key stays reserved by a request that never finished (crashed worker)
+IDEMPOTENCY_PENDING_TTL = timedelta(minutes=1)
+
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
@@ -247,6 +265,80 @@ DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='Medical Appointments
 # Email sending settings
 EMAIL_TIMEOUT = 30
 
+# `manage.py run_reminder_daemon`, the long-running alternative to the cron dispatcher
+REMINDER_DAEMON = {
+    'HORIZON': 6 * 3600,   # seconds of upcoming reminders kept in memory
+    'POLL_INTERVAL': 2,    # seconds between reads of the ReminderChange log
+    'LEASE_TTL': 30,       # seconds before a standby daemon may take over
+    'BATCH_SIZE': 100,
+}
+
+# Pool of open SMTP connections shared by EmailService and the outbox worker
+EMAIL_POOL = {
+    'SIZE': 2,
+    'BATCH_SIZE': 50,          # messages sent over one connection per batch
+    'ACQUIRE_TIMEOUT': 10,     # seconds to wait for a free connection
+    'MAX_IDLE': 60,            # reopen connections idle for longer than this
+    'FAILURE_THRESHOLD': 3,    # connection failures before the circuit opens
+    'RESET_TIMEOUT': 30,       # seconds before a trial send is allowed again
+}
+
+# Long-poll GET /api/notifications/notifications/wait/, see notifications.broker
+NOTIFICATION_WAIT = {
+    'TIMEOUT': 25,        # seconds a request is held at most
+    'MAX_WAITERS': 50,    # held requests per process, each holds a worker thread
+    'LIMIT': 50,          # notifications returned per response
+}
+
+# GET /api/doctors/schedules/ without from / to, see ScheduleViewSet.filter_queryset
+SCHEDULE_LIST = {
+    'WINDOW_DAYS': 30,    # today to +30 days
+    'MAX_DAYS': 366,      # longest from / to range
+}
+
+# Weekly schedule templates, see doctors.recurrence
+SCHEDULE_TEMPLATES = {
+    'HORIZON_DAYS': 14,   # days ahead `manage.py materialize_schedules` keeps as rows
+}
+
+# GET /api/doctors/schedules/next_available/, see doctors.slot_index
+SLOT_INDEX = {
+    'REFRESH': 60,        # seconds between rebuilds, picks up other processes' bookings
+    'NEAR_MINUTES': 60,   # distance from the requested time of day
+    'MAX_LIMIT': 50,      # slots returned per search
+}
+
+# `manage.py purge_notifications`, see notifications.retention
+NOTIFICATION_RETENTION = {
+    'CHUNK_SIZE': 500,    # rows deleted per transaction
+    'PAUSE': 0.05,        # seconds between chunks, lets bookings take the write lock
+    'POLICIES': {
+        'read_system': {'filter': {'type': 'system', 'read': True}, 'days': 90},
+        'sent_email': {'filter': {'type': 'email', 'read': True, 'email_sent': True}, 'days': 180},
+        # One read summary per user and month instead of every reminder
+        'reminders': {
+            'filter': [
+                {'template': 'appointment_reminder'},
+                # Stored as text before notification templates
+                {'template': '', 'title': 'Appointment Reminder'},
+            ],
+            'days': 30,
+            'summarize': True,
+        },
+    },
+    'OUTBOX_DAYS': 30,        # sent and dead outbox messages
+    'REMINDER_LOG_DAYS': 7,   # ReminderChange rows, normally pruned by the reminder daemon
+}
+
+# Notification emails are queued in the outbox and sent by `manage.py drain_outbox`
+NOTIFICATION_OUTBOX = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 30,   # seconds, doubled on every failed attempt
+    'BACKOFF_MAX': 3600,
+    'LEASE': 300,         # seconds a claimed message is hidden from other workers
+}
+
 # Enhanced logging configuration for transaction monitoring
 LOGGING = {
     'version': 1,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Doctor, Schedule
+from .models import Doctor, Schedule, ScheduleException, ScheduleTemplate
 
 @admin.register(Doctor)
 class DoctorAdmin(admin.ModelAdmin):
@@ -10,3 +10,13 @@ class DoctorAdmin(admin.ModelAdmin):
 class ScheduleAdmin(admin.ModelAdmin):
     list_display = ('doctor', 'date', 'start_time', 'end_time', 'is_available')
     list_filter = ('doctor', 'date', 'is_available')
+
+@admin.register(ScheduleTemplate)
+class ScheduleTemplateAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'weekday', 'start_time', 'end_time', 'slot_minutes', 'valid_from', 'valid_until')
+    list_filter = ('doctor', 'weekday')
+
+@admin.register(ScheduleException)
+class ScheduleExceptionAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'date', 'start_time', 'end_time', 'reason')
+    list_filter = ('doctor', 'date')
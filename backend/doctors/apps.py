@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DoctorsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'doctors'
+
+    def ready(self):
+        import doctors.signals # Keep the slot index in step with the tables
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from doctors.recurrence import materialize, recurrence_setting
+
+
+class Command(BaseCommand):
+    help = "Create the Schedule rows of template slots for the rolling horizon (run nightly via cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Days ahead to materialize (default SCHEDULE_TEMPLATES['HORIZON_DAYS'])",
+        )
+        parser.add_argument(
+            '--doctor', type=int, action='append', dest='doctors',
+            help="Only this doctor id; may be repeated",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        days = options['days'] or recurrence_setting('HORIZON_DAYS')
+        created = materialize(today, today + timedelta(days=days), options['doctors'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Materialized {len(created)} slots up to {today + timedelta(days=days)}."
+        ))
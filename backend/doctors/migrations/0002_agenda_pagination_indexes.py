@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['date', 'start_time'], name='sched_date_start_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0002_agenda_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['date', 'start_time'], name='sched_available_idx'),
+        ),
+    ]
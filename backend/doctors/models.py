@@ -1,3 +1,5 @@
+from datetime import date
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -10,15 +12,94 @@ class Doctor(models.Model):
     def __str__(self):
         return f"Dr. {self.user.last_name} {self.user.first_name}"
 
+class ScheduleTemplate(models.Model):
+    """
+    Weekly recurring availability of a doctor
+
+    Every ``weekday`` from ``valid_from`` to ``valid_until`` the hours from
+    ``start_time`` to ``end_time`` are cut into ``slot_minutes`` slots.
+    Schedule rows for them are materialized for a rolling horizon
+    (doctors.recurrence) instead of being created ahead by the doctor.
+    """
+    WEEKDAYS = (
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+    )
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='schedule_templates')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAYS)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+    valid_from = models.DateField(default=date.today)
+    valid_until = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return (
+            f"Dr. {self.doctor.user.last_name} every {self.get_weekday_display()} "
+            f"({self.start_time}-{self.end_time}, {self.slot_minutes} min)"
+        )
+
+
+class ScheduleException(models.Model):
+    """A day, or the part of it between start_time and end_time, the templates skip"""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='schedule_exceptions')
+    date = models.DateField()
+    # Both empty: the whole day
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    reason = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', 'date'], name='sched_exception_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"Dr. {self.doctor.user.last_name} off on {self.date}"
+
+    def covers(self, start_time, end_time):
+        """Whether the slot from ``start_time`` to ``end_time`` falls in the exception."""
+        if self.start_time is None:
+            return True
+        return start_time < self.end_time and end_time > self.start_time
+
+
 class Schedule(models.Model):
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='schedules')
     date = models.DateField()
     start_time = models.TimeField()
     end_time = models.TimeField()
     is_available = models.BooleanField(default=True)
+    # Set on rows materialized from a template, which may remove them again
+    template = models.ForeignKey(
+        ScheduleTemplate, on_delete=models.SET_NULL, null=True, blank=True, related_name='slots'
+    )
     
     class Meta:
         unique_together = ('doctor', 'date', 'start_time')
+        indexes = [
+            # Agenda pagination walks schedules in date order
+            models.Index(fields=['date', 'start_time'], name='sched_date_start_idx'),
+            # Free slots offered to patients, ScheduleViewSet.get_queryset
+            models.Index(
+                fields=['date', 'start_time'],
+                condition=models.Q(is_available=True),
+                name='sched_available_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Dr. {self.doctor.user.last_name} on {self.date} ({self.start_time}-{self.end_time})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored slot so moves can be detected on save
+        if 'date' in field_names and 'start_time' in field_names:
+            instance._loaded_slot = (instance.date, instance.start_time)
+        return instance
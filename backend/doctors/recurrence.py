@@ -0,0 +1,211 @@
+"""
+Schedule rows projected from weekly templates.
+
+A ScheduleTemplate describes the slots a doctor offers every week; only the
+slots of the next HORIZON_DAYS are materialized as Schedule rows, by the
+``materialize_schedules`` command run nightly, or one at a time when a
+patient books a projected slot further out (``materialize_slot``). Reads
+that ask for it (``?projected=true`` on the schedule list) merge the
+projection of the requested window with the rows.
+
+A projected slot is dropped when a ScheduleException covers it or when it
+overlaps a Schedule row of the same doctor, so rows created by hand always
+win over the template. Deleting a materialized row by hand records an
+exception for its slot (``forget``), so the next run does not bring it back.
+"""
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Schedule, ScheduleException, ScheduleTemplate
+from .slot_index import index_slots
+
+DEFAULTS = {
+    'HORIZON_DAYS': 14,   # days ahead kept materialized
+}
+
+
+def recurrence_setting(name):
+    return getattr(settings, 'SCHEDULE_TEMPLATES', {}).get(name, DEFAULTS[name])
+
+
+class ProjectedSlot:
+    """A slot a template offers on ``date``; saved as Schedule(template=...)."""
+
+    __slots__ = ('template', 'date', 'start_time', 'end_time')
+
+    def __init__(self, template, day, start_time, end_time):
+        self.template = template
+        self.date = day
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def doctor(self):
+        return self.template.doctor
+
+    @property
+    def doctor_id(self):
+        return self.template.doctor_id
+
+    def key(self):
+        return (self.date, self.start_time, self.doctor_id)
+
+    def to_schedule(self):
+        return Schedule(
+            doctor_id=self.doctor_id, template=self.template, date=self.date,
+            start_time=self.start_time, end_time=self.end_time,
+        )
+
+
+def template_times(template):
+    """(start, end) of each slot ``template`` cuts from its hours."""
+    step = timedelta(minutes=template.slot_minutes)
+    start = datetime.combine(datetime.min, template.start_time)
+    end = datetime.combine(datetime.min, template.end_time)
+    while start + step <= end:
+        yield start.time(), (start + step).time()
+        start += step
+
+
+def project(first_day, last_day, doctor_ids=None):
+    """
+    Slots the templates offer from ``first_day`` to ``last_day``, minus
+    slots already started, exceptions and slots overlapping existing rows or
+    a slot of an earlier template, ordered by date and time
+
+    At most three queries, whatever the length of the window.
+    """
+    templates = ScheduleTemplate.objects.filter(
+        Q(valid_until__isnull=True) | Q(valid_until__gte=first_day),
+        valid_from__lte=last_day,
+    ).select_related('doctor__user').order_by('start_time', 'id')
+    exceptions = ScheduleException.objects.filter(date__gte=first_day, date__lte=last_day)
+    rows = Schedule.objects.filter(date__gte=first_day, date__lte=last_day)
+    if doctor_ids is not None:
+        templates = templates.filter(doctor_id__in=doctor_ids)
+        exceptions = exceptions.filter(doctor_id__in=doctor_ids)
+        rows = rows.filter(doctor_id__in=doctor_ids)
+
+    by_weekday = {}
+    for template in templates:
+        by_weekday.setdefault(template.weekday, []).append(template)
+    if not by_weekday:
+        return []
+    skipped = {}
+    for exception in exceptions:
+        skipped.setdefault((exception.doctor_id, exception.date), []).append(exception)
+    taken = {}
+    for doctor_id, day, start_time, end_time in rows.values_list(
+        'doctor_id', 'date', 'start_time', 'end_time'
+    ):
+        taken.setdefault((doctor_id, day), []).append((start_time, end_time))
+
+    # Sloturile de azi deja incepute nu se mai ofera, ca in indexul de sloturi
+    now = timezone.localtime()
+    today, now_time = now.date(), now.time().replace(tzinfo=None)
+
+    slots = []
+    day = first_day
+    while day <= last_day:
+        for template in by_weekday.get(day.weekday(), ()):
+            if day < template.valid_from or (template.valid_until and day > template.valid_until):
+                continue
+            day_exceptions = skipped.get((template.doctor_id, day), ())
+            day_rows = taken.setdefault((template.doctor_id, day), [])
+            for start_time, end_time in template_times(template):
+                if day < today or (day == today and start_time <= now_time):
+                    continue
+                if any(exception.covers(start_time, end_time) for exception in day_exceptions):
+                    continue
+                if any(start_time < row_end and end_time > row_start for row_start, row_end in day_rows):
+                    continue
+                slots.append(ProjectedSlot(template, day, start_time, end_time))
+                # Template-urile urmatoare nu se suprapun peste slotul acceptat
+                day_rows.append((start_time, end_time))
+        day += timedelta(days=1)
+    slots.sort(key=ProjectedSlot.key)
+    return slots
+
+
+def materialize(first_day=None, last_day=None, doctor_ids=None):
+    """
+    Create the Schedule rows of the projected slots of the window (default
+    today to +HORIZON_DAYS); returns the rows created
+    """
+    first_day = first_day or timezone.localdate()
+    last_day = last_day or first_day + timedelta(days=recurrence_setting('HORIZON_DAYS'))
+    with transaction.atomic():
+        created = Schedule.objects.bulk_create(
+            [slot.to_schedule() for slot in project(first_day, last_day, doctor_ids)],
+            batch_size=500,
+        )
+        # bulk_create nu trimite post_save, indexul de sloturi se actualizeaza aici
+        index_slots(created)
+    return created
+
+
+def materialize_slot(doctor_id, day, start_time):
+    """
+    The Schedule row of the slot of ``doctor_id`` starting at ``start_time``
+    on ``day``, created from the doctor's templates when it is projected;
+    None when neither exists
+    """
+    with transaction.atomic():
+        existing = Schedule.objects.filter(doctor_id=doctor_id, date=day, start_time=start_time).first()
+        if existing is not None:
+            return existing
+        for slot in project(day, day, [doctor_id]):
+            if slot.start_time == start_time:
+                schedule = slot.to_schedule()
+                try:
+                    with transaction.atomic():
+                        schedule.save()
+                except IntegrityError:
+                    # Materialized by a concurrent request
+                    return Schedule.objects.get(doctor_id=doctor_id, date=day, start_time=start_time)
+                return schedule
+    return None
+
+
+def forget(schedules):
+    """
+    Record the future template rows of ``schedules``, deleted by hand, as
+    exceptions so the projection does not create them again
+    """
+    today = timezone.localdate()
+    exceptions = [
+        ScheduleException(
+            doctor_id=schedule.doctor_id, date=schedule.date, start_time=schedule.start_time,
+            end_time=schedule.end_time, reason='Slot removed from the schedule',
+        )
+        for schedule in schedules
+        if schedule.template_id is not None and schedule.date >= today
+    ]
+    if exceptions:
+        ScheduleException.objects.bulk_create(exceptions)
+    return exceptions
+
+
+def release(template_ids=None, exception=None):
+    """
+    Delete the free future rows materialized from ``template_ids``, or those
+    the new ``exception`` covers, so the projection can replace them
+    """
+    # Randurile cu istoric de programari (anulate) raman
+    rows = Schedule.objects.filter(
+        template__isnull=False, is_available=True, date__gte=timezone.localdate(),
+        appointments__isnull=True,
+    )
+    if template_ids is not None:
+        rows = rows.filter(template_id__in=template_ids)
+    if exception is not None:
+        rows = rows.filter(doctor_id=exception.doctor_id, date=exception.date)
+        if exception.start_time is not None:
+            rows = rows.filter(start_time__lt=exception.end_time, end_time__gt=exception.start_time)
+    # Prin colectorul ORM, post_delete scoate sloturile si din index
+    return rows.delete()[1].get(Schedule._meta.label, 0)
@@ -1,8 +1,19 @@
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+from django.db.models import Q
 from datetime import date, datetime, time, timedelta
-from .models import Doctor, Schedule
+from .models import Doctor, Schedule, ScheduleException, ScheduleTemplate
+from .slot_index import index_slots
+from authentication.permissions import IsAdminRole
 from authentication.serializers import UserSerializer
 
+# Cate sloturi intra intr-un INSERT la crearea in bloc
+BULK_BATCH_SIZE = 500
+# Cate sloturi poate crea o singura cerere bulk_create
+BULK_MAX_ITEMS = 1000
+# Cele mai multe zile pe care le poate rescrie o sincronizare de saptamana
+WEEK_SYNC_MAX_DAYS = 31
+
 class DoctorSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
@@ -11,6 +22,102 @@ class DoctorSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'speciality', 'description']
         read_only_fields = ['id', 'user']
 
+class ScheduleListSerializer(serializers.ListSerializer):
+    """
+    Validate and create many schedules as a set
+
+    The items are validated one by one without touching the database, then
+    the overlaps, with existing rows and between the items themselves, are
+    found with one query and a sweep over each doctor-day. ``create`` inserts
+    the rows with chunked bulk_create.
+
+    With a ``doctor`` in the context (bulk_create) every item is created for
+    that doctor and the ``doctor`` field of the items is ignored.
+    """
+
+    # Suprapunerile se cauta si printre randurile existente
+    check_existing = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', BULK_MAX_ITEMS)
+        super().__init__(*args, **kwargs)
+        if self.context.get('doctor') is not None and 'doctor' in self.child.fields:
+            # Altfel fiecare element ar cauta doctorul cu o interogare
+            self.child.fields['doctor'].read_only = True
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        errors = self.find_overlaps(items)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def find_overlaps(self, items):
+        """One error dict per item, empty for the items that overlap nothing."""
+        days = {}
+        for position, item in enumerate(items):
+            days.setdefault((self.doctor_id(item), item['date']), []).append(
+                (item['start_time'], item['end_time'], position)
+            )
+        if self.check_existing:
+            self._add_existing(days)
+
+        errors = [{} for _ in items]
+        for intervals in days.values():
+            intervals.sort(key=lambda interval: interval[:2])
+            # Intervalul care ajunge cel mai departe dintre cele vazute
+            reach = None
+            for interval in intervals:
+                if reach is not None and interval[0] < reach[1]:
+                    if interval[2] is not None:
+                        self._overlap(errors, interval[2], reach)
+                    elif reach[2] is not None:
+                        self._overlap(errors, reach[2], interval)
+                if reach is None or interval[1] > reach[1]:
+                    reach = interval
+        return errors
+
+    def doctor_id(self, item):
+        doctor = self.context.get('doctor')
+        return doctor.pk if doctor is not None else item['doctor'].pk
+
+    @staticmethod
+    def _add_existing(days):
+        existing = Schedule.objects.filter(
+            doctor_id__in={doctor_id for doctor_id, _ in days},
+            date__in={day for _, day in days},
+        ).values_list('doctor_id', 'date', 'start_time', 'end_time')
+        for doctor_id, day, start_time, end_time in existing:
+            if (doctor_id, day) in days:
+                days[(doctor_id, day)].append((start_time, end_time, None))
+
+    @staticmethod
+    def _overlap(errors, position, other):
+        if errors[position]:
+            return
+        start_time, end_time, other_position = other
+        if other_position is None:
+            message = (
+                f"This time slot overlaps with an existing schedule "
+                f"from {start_time} to {end_time}."
+            )
+        else:
+            message = (
+                f"This time slot overlaps with item {other_position} of the request "
+                f"from {start_time} to {end_time}."
+            )
+        errors[position] = {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+
+    def create(self, validated_data):
+        schedules = Schedule.objects.bulk_create(
+            [Schedule(**item) for item in validated_data],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        # bulk_create nu trimite post_save, indexul de sloturi se actualizeaza aici
+        index_slots(schedules)
+        return schedules
+
+
 class ScheduleSerializer(serializers.ModelSerializer):
     doctor_name = serializers.SerializerMethodField()
     
@@ -18,6 +125,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
         model = Schedule
         fields = ['id', 'doctor', 'doctor_name', 'date', 'start_time', 'end_time', 'is_available']
         read_only_fields = ['id']
+        list_serializer_class = ScheduleListSerializer
     
     def get_doctor_name(self, obj):
         return f"Dr. {obj.doctor.user.last_name} {obj.doctor.user.first_name}"
@@ -88,6 +196,10 @@ class ScheduleSerializer(serializers.ModelSerializer):
             if duration.total_seconds() > 14400:  # 4 ore = 14400 secunde
                 raise serializers.ValidationError("Appointment slots cannot be longer than 4 hours.")
         
+        # In bloc, suprapunerile le verifica ScheduleListSerializer pentru toate odata
+        if isinstance(self.parent, ScheduleListSerializer):
+            return data
+
         # Verifica overlap cu alte schedule-uri ale aceluiasi doctor
         doctor = data.get('doctor')
         schedule_date = data.get('date')
@@ -107,3 +219,127 @@ class ScheduleSerializer(serializers.ModelSerializer):
                     )
         
         return data
+
+
+class WeekSlotListSerializer(ScheduleListSerializer):
+    """Desired slots of one doctor; they replace the rows, so only overlaps among them count."""
+    check_existing = False
+
+    def doctor_id(self, item):
+        return None
+
+
+class WeekSlotSerializer(ScheduleSerializer):
+    """One desired slot of a week sync; the doctor is the one being synced."""
+
+    class Meta:
+        model = Schedule
+        fields = ['date', 'start_time', 'end_time', 'is_available']
+        list_serializer_class = WeekSlotListSerializer
+
+
+class WeekSyncSerializer(serializers.Serializer):
+    """
+    Body of PUT schedules/week/: the slots ``doctor`` (admins only) should
+    have from ``date_from`` to ``date_to``, replacing whatever is there
+    """
+    doctor = serializers.PrimaryKeyRelatedField(
+        queryset=Doctor.objects.select_related('user'), required=False
+    )
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    slots = WeekSlotSerializer(many=True, allow_empty=True)
+
+    def validate(self, data):
+        date_from, date_to = data['date_from'], data['date_to']
+        if date_from < date.today():
+            raise serializers.ValidationError({'date_from': "Past schedules cannot be changed."})
+        if date_to < date_from:
+            raise serializers.ValidationError({'date_to': "date_to must not be before date_from."})
+        if (date_to - date_from).days >= WEEK_SYNC_MAX_DAYS:
+            raise serializers.ValidationError(
+                {'date_to': f"At most {WEEK_SYNC_MAX_DAYS} days can be synced at once."}
+            )
+        if any(not date_from <= slot['date'] <= date_to for slot in data['slots']):
+            raise serializers.ValidationError({'slots': "Every slot must fall between date_from and date_to."})
+        return data
+
+
+class ScheduleTemplateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScheduleTemplate
+        fields = [
+            'id', 'doctor', 'weekday', 'start_time', 'end_time', 'slot_minutes',
+            'valid_from', 'valid_until',
+        ]
+        read_only_fields = ['id']
+        extra_kwargs = {'doctor': {'required': False}}
+
+    def validate(self, data):
+        """
+        Aceleasi reguli ca la Schedule: ore de program si sloturi intre 30
+        de minute si 4 ore
+        """
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        slot_minutes = data.get('slot_minutes', getattr(self.instance, 'slot_minutes', 30))
+        valid_from = data.get('valid_from', getattr(self.instance, 'valid_from', None))
+        valid_until = data.get('valid_until', getattr(self.instance, 'valid_until', None))
+
+        if start_time < time(8, 0) or end_time > time(18, 0):
+            raise serializers.ValidationError("Templates must stay within business hours (8:00 AM - 6:00 PM).")
+        if start_time >= end_time:
+            raise serializers.ValidationError("Start time must be before end time.")
+        if not 30 <= slot_minutes <= 240:
+            raise serializers.ValidationError("Slots must be between 30 minutes and 4 hours long.")
+        duration = datetime.combine(date.today(), end_time) - datetime.combine(date.today(), start_time)
+        if duration < timedelta(minutes=slot_minutes):
+            raise serializers.ValidationError("The hours must fit at least one slot.")
+        if valid_from and valid_until and valid_until < valid_from:
+            raise serializers.ValidationError("valid_until must not be before valid_from.")
+
+        # Doua template-uri suprapuse ar proiecta sloturi suprapuse
+        doctor = self._doctor(data)
+        if doctor is not None:
+            weekday = data.get('weekday', getattr(self.instance, 'weekday', None))
+            valid_from = valid_from or date.today()
+            others = ScheduleTemplate.objects.filter(
+                Q(valid_until__isnull=True) | Q(valid_until__gte=valid_from),
+                doctor=doctor, weekday=weekday,
+                start_time__lt=end_time, end_time__gt=start_time,
+            ).exclude(pk=getattr(self.instance, 'pk', None))
+            if valid_until:
+                others = others.filter(valid_from__lte=valid_until)
+            other = others.first()
+            if other is not None:
+                raise serializers.ValidationError(
+                    f"These hours overlap the template from {other.start_time} to "
+                    f"{other.end_time} on the same weekday."
+                )
+        return data
+
+    def _doctor(self, data):
+        """The doctor the view saves the template for (see DoctorOwnedViewSet)."""
+        request = self.context.get('request')
+        if request is not None and not IsAdminRole().has_permission(request, None):
+            if self.instance is not None:
+                return self.instance.doctor
+            return getattr(request.user, 'doctor', None)
+        return data.get('doctor', getattr(self.instance, 'doctor', None))
+
+
+class ScheduleExceptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScheduleException
+        fields = ['id', 'doctor', 'date', 'start_time', 'end_time', 'reason']
+        read_only_fields = ['id']
+        extra_kwargs = {'doctor': {'required': False}}
+
+    def validate(self, data):
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        if (start_time is None) != (end_time is None):
+            raise serializers.ValidationError("Give both start and end time, or neither for the whole day.")
+        if start_time is not None and start_time >= end_time:
+            raise serializers.ValidationError("Start time must be before end time.")
+        return data
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Doctor, Schedule
+from .slot_index import get_slot_index, index_slots, unindex_slots
+
+
+@receiver(post_save, sender=Schedule)
+def index_schedule(sender, instance, **kwargs):
+    """Keep the next-available index in step with created, moved and booked slots"""
+    index_slots([instance])
+
+
+@receiver(post_delete, sender=Schedule)
+def unindex_schedule(sender, instance, **kwargs):
+    unindex_slots([instance.pk])
+
+
+@receiver(post_save, sender=Doctor)
+def index_doctor(sender, instance, **kwargs):
+    name = f"Dr. {instance.user.last_name} {instance.user.first_name}"
+    transaction.on_commit(
+        lambda: get_slot_index().put_doctor(instance.pk, instance.speciality, name)
+    )
+
+
+@receiver(post_delete, sender=Doctor)
+def unindex_doctor(sender, instance, **kwargs):
+    doctor_id = instance.pk
+    transaction.on_commit(lambda: get_slot_index().discard_doctor(doctor_id))
@@ -0,0 +1,279 @@
+"""
+In-memory index of free schedule slots for the next-available search.
+
+The index keeps, per doctor, the free future slots sorted by (date,
+start_time), plus each doctor's speciality and display name. A search for
+the earliest slots of a speciality bisects to the start of the range in
+every matching doctor's list and merges the lists lazily, so it reads only
+the slots it returns and runs no queries.
+
+It is built with two queries on first use and kept current by the writes
+that flip ``is_available``: Schedule and Doctor signals (doctors.signals)
+and the bulk UPDATEs of appointment booking and cancellation, which call
+``index_slots`` and ``unindex_slots``. Updates are applied on commit, so a
+rolled back booking leaves the index alone.
+
+Like the notification broker, the index only sees the writes of its own
+process. It is rebuilt every REFRESH seconds to pick up the others; in
+between a search may offer a slot booked elsewhere, which the booking
+itself then refuses, the database stays the source of truth.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import date, time as dt_time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Doctor, Schedule
+
+DEFAULTS = {
+    'REFRESH': 60,         # seconds between rebuilds from the database
+    'NEAR_MINUTES': 60,    # how far from the requested time of day a slot may start
+    'MAX_LIMIT': 50,       # slots returned per search at most
+}
+
+
+def slot_index_setting(name):
+    return getattr(settings, 'SLOT_INDEX', {}).get(name, DEFAULTS[name])
+
+
+def _minutes(moment):
+    return moment.hour * 60 + moment.minute
+
+
+class SlotIndex:
+    """Per-doctor sorted lists of free slots."""
+
+    def __init__(self, refresh=60, near_minutes=60):
+        self.refresh = refresh
+        self.near_minutes = near_minutes
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # doctor id -> sorted [(date, start_time, schedule id)]
+        self._slots = {}
+        # schedule id -> (doctor id, date, start_time, end_time)
+        self._entries = {}
+        # doctor id -> (speciality, name)
+        self._doctors = {}
+        # casefolded speciality -> doctor ids
+        self._specialities = {}
+        self._counters = {'searches': 0, 'loads': 0}
+
+    # Building
+
+    def load(self):
+        """Rebuild from the database; the old index serves searches meanwhile."""
+        today = timezone.localdate()
+        doctors = {
+            doctor_id: (speciality, f"Dr. {last_name} {first_name}")
+            for doctor_id, speciality, first_name, last_name in Doctor.objects.values_list(
+                'id', 'speciality', 'user__first_name', 'user__last_name'
+            )
+        }
+        specialities = {}
+        for doctor_id, (speciality, _) in doctors.items():
+            specialities.setdefault(speciality.casefold(), set()).add(doctor_id)
+        slots = {}
+        entries = {}
+        rows = Schedule.objects.filter(is_available=True, date__gte=today).values_list(
+            'id', 'doctor_id', 'date', 'start_time', 'end_time'
+        )
+        for schedule_id, doctor_id, day, start_time, end_time in rows:
+            slots.setdefault(doctor_id, []).append((day, start_time, schedule_id))
+            entries[schedule_id] = (doctor_id, day, start_time, end_time)
+        for doctor_slots in slots.values():
+            doctor_slots.sort()
+
+        with self._lock:
+            self._doctors = doctors
+            self._specialities = specialities
+            self._slots = slots
+            self._entries = entries
+            self._loaded_at = time.monotonic()
+            self._counters['loads'] += 1
+
+    def ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= self.refresh:
+            self.load()
+
+    def invalidate(self):
+        """Drop everything, the next search rebuilds."""
+        with self._lock:
+            self._loaded_at = None
+            self._slots = {}
+            self._entries = {}
+            self._doctors = {}
+            self._specialities = {}
+
+    # Incremental updates
+
+    def put(self, slots):
+        """
+        Add or move (id, doctor id, date, start_time, end_time, is_available)
+        ``slots``; booked ones are removed
+        """
+        today = timezone.localdate()
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for schedule_id, doctor_id, day, start_time, end_time, is_available in slots:
+                self._remove(schedule_id)
+                if is_available and day >= today:
+                    insort(self._slots.setdefault(doctor_id, []), (day, start_time, schedule_id))
+                    self._entries[schedule_id] = (doctor_id, day, start_time, end_time)
+
+    def discard(self, schedule_ids):
+        with self._lock:
+            for schedule_id in schedule_ids:
+                self._remove(schedule_id)
+
+    def _remove(self, schedule_id):
+        entry = self._entries.pop(schedule_id, None)
+        if entry is None:
+            return
+        doctor_id, day, start_time, _ = entry
+        doctor_slots = self._slots[doctor_id]
+        position = bisect_left(doctor_slots, (day, start_time, schedule_id))
+        del doctor_slots[position]
+
+    def put_doctor(self, doctor_id, speciality, name):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._forget_doctor(doctor_id)
+                self._doctors[doctor_id] = (speciality, name)
+                self._specialities.setdefault(speciality.casefold(), set()).add(doctor_id)
+
+    def discard_doctor(self, doctor_id):
+        with self._lock:
+            self._forget_doctor(doctor_id)
+            for _, _, schedule_id in self._slots.pop(doctor_id, []):
+                self._entries.pop(schedule_id, None)
+
+    def _forget_doctor(self, doctor_id):
+        known = self._doctors.pop(doctor_id, None)
+        if known is not None:
+            self._specialities.get(known[0].casefold(), set()).discard(doctor_id)
+
+    # Search
+
+    def search(self, speciality=None, start=None, end=None, near=None, limit=10):
+        """
+        Earliest free slots starting after ``start`` (default now) and on or
+        before the date ``end``
+
+        With ``near`` (a time of day) only slots starting within
+        NEAR_MINUTES of it are returned, closest first within each day.
+        """
+        self.ensure_loaded()
+        start = timezone.localtime(start or timezone.now())
+        bound = (start.date(), start.time().replace(tzinfo=None))
+        wanted = speciality.casefold() if speciality else None
+
+        with self._lock:
+            self._counters['searches'] += 1
+            doctor_ids = self._specialities.get(wanted, ()) if wanted else self._slots
+            streams = []
+            for doctor_id in doctor_ids:
+                doctor_slots = self._slots.get(doctor_id, [])
+                position = bisect_left(doctor_slots, bound)
+                if position < len(doctor_slots):
+                    streams.append(self._walk(doctor_slots, position))
+
+            found = []
+            day_slots = []
+            for slot in heapq.merge(*streams):
+                if end is not None and slot[0] > end:
+                    break
+                if near is None:
+                    found.append(slot)
+                    if len(found) >= limit:
+                        break
+                    continue
+                # Zilele se completeaza intregi, apoi se ordoneaza dupa apropiere
+                if day_slots and day_slots[0][0] != slot[0]:
+                    found.extend(self._closest(day_slots, near))
+                    day_slots = []
+                    if len(found) >= limit:
+                        break
+                day_slots.append(slot)
+            if day_slots:
+                found.extend(self._closest(day_slots, near))
+
+            return [self._describe(schedule_id) for _, _, schedule_id in found[:limit]]
+
+    @staticmethod
+    def _walk(doctor_slots, position):
+        for index in range(position, len(doctor_slots)):
+            yield doctor_slots[index]
+
+    def _closest(self, day_slots, near):
+        target = _minutes(near)
+        close = [
+            slot for slot in day_slots
+            if abs(_minutes(slot[1]) - target) <= self.near_minutes
+        ]
+        return sorted(close, key=lambda slot: (abs(_minutes(slot[1]) - target), slot[1]))
+
+    def _describe(self, schedule_id):
+        doctor_id, day, start_time, end_time = self._entries[schedule_id]
+        speciality, name = self._doctors.get(doctor_id, ('', ''))
+        return {
+            'id': schedule_id,
+            'doctor': doctor_id,
+            'doctor_name': name,
+            'speciality': speciality,
+            'date': day.isoformat(),
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+            'is_available': True,
+        }
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, slots=len(self._entries), doctors=len(self._doctors))
+
+
+_slot_index = None
+_slot_index_lock = threading.Lock()
+
+
+def get_slot_index():
+    """Return the process-wide index configured from settings.SLOT_INDEX."""
+    global _slot_index
+    if _slot_index is None:
+        with _slot_index_lock:
+            if _slot_index is None:
+                _slot_index = SlotIndex(
+                    refresh=slot_index_setting('REFRESH'),
+                    near_minutes=slot_index_setting('NEAR_MINUTES'),
+                )
+    return _slot_index
+
+
+def index_slots(schedules):
+    """Put ``schedules`` in the index once the current transaction commits."""
+    # Starea de acum, instantele se pot schimba pana la commit
+    slots = [
+        (s.pk, s.doctor_id, s.date, s.start_time, s.end_time, s.is_available)
+        for s in schedules
+    ]
+    if not slots:
+        return
+    if any(not isinstance(slot[2], date) or not isinstance(slot[3], dt_time) for slot in slots):
+        # Saved from raw strings, let the next search reload them
+        transaction.on_commit(get_slot_index().invalidate)
+    else:
+        transaction.on_commit(lambda: get_slot_index().put(slots))
+
+
+def unindex_slots(schedule_ids):
+    """Remove the booked ``schedule_ids`` once the current transaction commits."""
+    schedule_ids = list(schedule_ids)
+    if schedule_ids:
+        transaction.on_commit(lambda: get_slot_index().discard(schedule_ids))
@@ -1,10 +1,25 @@
-from django.test import TestCase
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
-from datetime import date, time, timedelta
+from datetime import date, datetime, time, timedelta
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
-from .models import Doctor, Schedule
+from appointments.querycount import QueryBudgetTestMixin
+from patients.models import Patient
+from appointments.models import Appointment
+from .models import Doctor, Schedule, ScheduleException, ScheduleTemplate
+from .recurrence import materialize, project, release
+from .serializers import BULK_MAX_ITEMS
+from .slot_index import get_slot_index
+from .views import DoctorViewSet, ScheduleViewSet
 
 
 def next_weekday(d: date) -> date:
@@ -76,6 +91,263 @@ class ScheduleViewsetQuerysetTest(TestCase):
         self.assertEqual(len(response.data), 2)
 
 
+class ScheduleListFilterTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cardio = Doctor.objects.create(
+            user=User.objects.create_user(username='f_c', password='pass'), speciality='Cardiology'
+        )
+        self.derm = Doctor.objects.create(
+            user=User.objects.create_user(username='f_d', password='pass'), speciality='Dermatology'
+        )
+        self.staff = User.objects.create_user(username='f_staff', password='pass', is_staff=True)
+        self.today = date.today()
+        self.past = self._slot(self.cardio, self.today - timedelta(days=3), 9)
+        self.soon = self._slot(self.cardio, self.today + timedelta(days=2), 14)
+        self.soon_derm = self._slot(self.derm, self.today + timedelta(days=2), 9, is_available=False)
+        self.later = self._slot(self.derm, self.today + timedelta(days=45), 10)
+
+    def _slot(self, doctor, day, hour, **kwargs):
+        return Schedule.objects.create(
+            doctor=doctor, date=day, start_time=time(hour, 0), end_time=time(hour + 1, 0), **kwargs
+        )
+
+    def _ids(self, user, **params):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('schedule-list'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [schedule['id'] for schedule in response.data]
+
+    def test_default_window_is_today_to_30_days(self):
+        self.assertEqual(self._ids(self.staff), [self.soon_derm.id, self.soon.id])
+
+    def test_explicit_range_and_ordering(self):
+        ids = self._ids(
+            self.staff, ordering='-date',
+            **{'from': (self.today - timedelta(days=7)).isoformat(),
+               'to': (self.today + timedelta(days=60)).isoformat()},
+        )
+        self.assertEqual(ids, [self.later.id, self.soon.id, self.soon_derm.id, self.past.id])
+
+    def test_filters(self):
+        self.assertEqual(self._ids(self.staff, doctor=self.cardio.id), [self.soon.id])
+        self.assertEqual(self._ids(self.staff, speciality='dermatology'), [self.soon_derm.id])
+        self.assertEqual(self._ids(self.staff, is_available='false'), [self.soon_derm.id])
+        self.assertEqual(self._ids(self.staff, time_from='10:00'), [self.soon.id])
+        self.assertEqual(self._ids(self.staff, time_to='10:00'), [self.soon_derm.id])
+
+    def test_patients_never_see_past_or_booked_slots(self):
+        patient = Patient.objects.create(
+            user=User.objects.create_user(username='f_pat', password='pass')
+        ).user
+        ids = self._ids(patient, **{'from': (self.today - timedelta(days=7)).isoformat()})
+        self.assertEqual(ids, [self.soon.id])
+
+    def test_invalid_parameters(self):
+        self.client.force_authenticate(user=self.staff)
+        for params in ({'from': '2030-13-01'}, {'doctor': 'x'}, {'is_available': 'maybe'},
+                       {'time_from': '25:00'}, {'ordering': 'doctor'},
+                       {'from': '2030-01-01', 'to': '2032-01-01'}):
+            response = self.client.get(reverse('schedule-list'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(SCHEDULE_TEMPLATES={'HORIZON_DAYS': 20})
+class ScheduleTemplateTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='t_doc', password='pass', last_name='Tem'),
+            speciality='gen',
+        )
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user(username='t_pat', password='pass')
+        )
+        self.monday = date.today() + timedelta(days=7 - date.today().weekday())
+
+    def _template(self, **kwargs):
+        return ScheduleTemplate.objects.create(**{
+            'doctor': self.doctor, 'weekday': 0, 'start_time': time(9, 0),
+            'end_time': time(11, 0), 'valid_from': date.today(), **kwargs,
+        })
+
+    def _starts(self, slots):
+        return [(slot.date, slot.start_time) for slot in slots]
+
+    def test_projection_skips_exceptions_and_existing_rows(self):
+        self._template()
+        ScheduleException.objects.create(doctor=self.doctor, date=self.monday)
+        second, third = self.monday + timedelta(days=7), self.monday + timedelta(days=14)
+        Schedule.objects.create(doctor=self.doctor, date=second, start_time=time(10, 0), end_time=time(11, 0))
+        ScheduleException.objects.create(
+            doctor=self.doctor, date=third, start_time=time(9, 30), end_time=time(10, 0)
+        )
+
+        slots = project(self.monday, third)
+
+        self.assertEqual(self._starts(slots), [
+            (second, time(9, 0)), (second, time(9, 30)),
+            (third, time(9, 0)), (third, time(10, 0)), (third, time(10, 30)),
+        ])
+        self.assertEqual(slots[0].end_time, time(9, 30))
+
+    def test_projection_skips_slots_already_started_today(self):
+        self._template(end_time=time(12, 0))
+        now = timezone.make_aware(datetime.combine(self.monday, time(10, 15)))
+
+        with patch('doctors.recurrence.timezone.localtime', return_value=now):
+            slots = project(self.monday, self.monday + timedelta(days=7))
+
+        next_monday = self.monday + timedelta(days=7)
+        self.assertEqual(self._starts(slots), [
+            (self.monday, time(10, 30)), (self.monday, time(11, 0)), (self.monday, time(11, 30)),
+            (next_monday, time(9, 0)), (next_monday, time(9, 30)), (next_monday, time(10, 0)),
+            (next_monday, time(10, 30)), (next_monday, time(11, 0)), (next_monday, time(11, 30)),
+        ])
+
+    def test_creating_a_template_materializes_the_horizon(self):
+        self.client.force_authenticate(user=self.doctor.user)
+        response = self.client.post(reverse('scheduletemplate-list'), {
+            'weekday': 0, 'start_time': '09:00', 'end_time': '10:00', 'slot_minutes': 30,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        rows = Schedule.objects.filter(template_id=response.data['id'])
+        mondays = len({day for day in rows.values_list('date', flat=True)})
+        # Three weeks from today hold three Mondays
+        self.assertEqual((mondays, rows.count()), (3, 6))
+        # Running the job again creates nothing new
+        self.assertEqual(materialize(), [])
+
+    def test_exception_releases_free_materialized_rows(self):
+        materialize(date.today(), self.monday, [self._template().doctor_id])
+        booked = Schedule.objects.get(date=self.monday, start_time=time(9, 0))
+        Appointment.claim_slot(patient=self.patient, doctor=self.doctor, schedule=booked)
+
+        self.client.force_authenticate(user=self.doctor.user)
+        response = self.client.post(reverse('scheduleexception-list'), {
+            'date': self.monday.isoformat(), 'reason': 'Conference',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(list(Schedule.objects.filter(date=self.monday)), [booked])
+
+    def test_list_merges_projected_slots(self):
+        self._template(end_time=time(10, 0))
+        manual = Schedule.objects.create(
+            doctor=self.doctor, date=self.monday, start_time=time(8, 0), end_time=time(9, 0)
+        )
+        self.client.force_authenticate(user=self.patient.user)
+
+        response = self.client.get(reverse('schedule-list'), {
+            'projected': 'true', 'to': self.monday.isoformat(),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(slot['id'], slot['start_time'], slot['projected']) for slot in response.data],
+            [(manual.id, '08:00:00', False), (None, '09:00:00', True), (None, '09:30:00', True)],
+        )
+        self.assertEqual(response.data[1]['doctor_name'], 'Dr. Tem ')
+
+    def test_projected_slot_is_materialized_for_booking(self):
+        self._template()
+        self.client.force_authenticate(user=self.patient.user)
+        url = reverse('schedule-materialize')
+        data = {'doctor': self.doctor.id, 'date': self.monday.isoformat(), 'start_time': '09:30'}
+
+        first = self.client.post(url, data, format='json')
+        again = self.client.post(url, data, format='json')
+
+        self.assertEqual(first.status_code, 200, first.data)
+        self.assertEqual(first.data['id'], again.data['id'])
+        self.assertEqual(Schedule.objects.get(id=first.data['id']).template.weekday, 0)
+        response = self.client.post(url, dict(data, start_time='11:00'), format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_materialize_command(self):
+        self._template()
+        out = StringIO()
+        call_command('materialize_schedules', '--days', '6', stdout=out)
+        self.assertIn('Materialized 4 slots', out.getvalue())
+
+    def test_template_validation(self):
+        self.client.force_authenticate(user=self.doctor.user)
+        for data in ({'weekday': 5, 'start_time': '09:00', 'end_time': '10:00'},
+                     {'weekday': 0, 'start_time': '07:00', 'end_time': '10:00'},
+                     {'weekday': 0, 'start_time': '09:00', 'end_time': '09:20'}):
+            response = self.client.post(reverse('scheduletemplate-list'), data, format='json')
+            self.assertEqual(response.status_code, 400, data)
+
+    def test_overlapping_templates_are_refused(self):
+        self._template(end_time=time(12, 0))
+        self.client.force_authenticate(user=self.doctor.user)
+        url = reverse('scheduletemplate-list')
+
+        response = self.client.post(url, {
+            'weekday': 0, 'start_time': '11:00', 'end_time': '13:00', 'slot_minutes': 60,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('overlap', str(response.data['non_field_errors'][0]))
+
+        # Another weekday, or validity ranges that do not meet, are fine
+        for data in ({'weekday': 1, 'start_time': '09:00', 'end_time': '10:00'},
+                     {'weekday': 0, 'start_time': '12:00', 'end_time': '13:00'}):
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+        later = self.monday + timedelta(days=70)
+        ScheduleTemplate.objects.filter(weekday=0).update(valid_until=later - timedelta(days=1))
+        response = self.client.post(url, {
+            'weekday': 0, 'start_time': '09:00', 'end_time': '10:00', 'valid_from': later.isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_overlapping_templates_project_no_overlapping_slots(self):
+        # Sabloane suprapuse create inainte de validare
+        self._template(end_time=time(12, 0))
+        self._template(end_time=time(10, 0), slot_minutes=60)
+
+        slots = project(self.monday, self.monday)
+
+        self.assertEqual(
+            [(slot.start_time, slot.end_time) for slot in slots],
+            [(time(9, 0), time(9, 30)), (time(9, 30), time(10, 0)), (time(10, 0), time(10, 30)),
+             (time(10, 30), time(11, 0)), (time(11, 0), time(11, 30)), (time(11, 30), time(12, 0))],
+        )
+        self.assertEqual(len(materialize(self.monday, self.monday)), 6)
+
+    def test_deleted_template_rows_stay_deleted(self):
+        materialize(self.monday, self.monday, [self._template().doctor_id])
+        removed = Schedule.objects.get(date=self.monday, start_time=time(9, 0))
+        self.client.force_authenticate(user=self.doctor.user)
+
+        response = self.client.delete(reverse('schedule-detail', args=[removed.id]))
+        self.assertEqual(response.status_code, 204)
+        # Si prin sincronizarea saptamanii
+        response = self.client.put(reverse('schedule-week'), {
+            'date_from': self.monday.isoformat(), 'date_to': self.monday.isoformat(),
+            'slots': [{'date': self.monday.isoformat(), 'start_time': '10:00', 'end_time': '10:30'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['deleted'], 2)
+
+        self.assertEqual(materialize(self.monday, self.monday), [])
+        self.assertEqual(
+            list(Schedule.objects.filter(date=self.monday).values_list('start_time', flat=True)),
+            [time(10, 0)],
+        )
+        # Changing the template releases and materializes again, the slots stay gone
+        ScheduleTemplate.objects.update(slot_minutes=30)
+        release(template_ids=list(ScheduleTemplate.objects.values_list('id', flat=True)))
+        materialize(self.monday, self.monday)
+        self.assertEqual(Schedule.objects.filter(date=self.monday).count(), 1)
+
+    def test_patients_cannot_read_templates(self):
+        self._template()
+        self.client.force_authenticate(user=self.patient.user)
+        self.assertEqual(self.client.get(reverse('scheduletemplate-list')).data, [])
+
+
 class ScheduleViewsetCreateTest(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -119,3 +391,431 @@ class ScheduleViewsetCreateTest(TestCase):
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, 403)
 
+
+
+class ScheduleBulkCreateTest(TestCase):
+    def setUp(self):
+        get_slot_index().invalidate()
+        self.addCleanup(get_slot_index().invalidate)
+        self.client = APIClient()
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='bulk_doc', password='pass'), speciality='gen'
+        )
+        self.client.force_authenticate(user=self.doctor.user)
+        self.url = reverse('schedule-bulk-create')
+        self.day = next_weekday(date.today() + timedelta(days=1))
+
+    def _slot(self, day, hour, minute=0, minutes=30):
+        start = datetime.combine(day, time(hour, minute))
+        return {
+            'date': day.isoformat(),
+            'start_time': start.time().isoformat(),
+            'end_time': (start + timedelta(minutes=minutes)).time().isoformat(),
+        }
+
+    def _week_payload(self, count):
+        # 20 half-hour slots per weekday, 8:00 - 18:00
+        payload = []
+        day = self.day
+        while len(payload) < count:
+            for n in range(20):
+                payload.append(self._slot(day, 8 + n // 2, 30 * (n % 2)))
+            day = next_weekday(day + timedelta(days=1))
+        return payload[:count]
+
+    def test_creates_500_slots_in_a_few_queries(self):
+        payload = self._week_payload(500)
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 500)
+        self.assertEqual(Schedule.objects.filter(doctor=self.doctor).count(), 500)
+        self.assertLessEqual(len(queries), ScheduleViewSet.query_budgets['bulk_create'])
+        # bulk_create ocoleste semnalele, indexul e actualizat explicit
+        found = get_slot_index().search(start=timezone.make_aware(datetime.combine(self.day, time(0, 0))), limit=1)
+        self.assertEqual(found[0]['id'], response.data[0]['id'])
+
+    def test_items_are_created_for_the_requesting_doctor(self):
+        other = Doctor.objects.create(
+            user=User.objects.create_user(username='bulk_other', password='pass'), speciality='gen'
+        )
+        payload = [dict(self._slot(self.day, 9), doctor=other.id), self._slot(self.day, 10)]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([item['doctor'] for item in response.data], [self.doctor.id] * 2)
+
+    def test_overlaps_within_the_payload_are_refused(self):
+        payload = [
+            self._slot(self.day, 9),
+            self._slot(self.day, 10),
+            self._slot(self.day, 9, 15, minutes=60),
+        ]
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('item 0 of the request', str(response.data[2]['non_field_errors'][0]))
+        self.assertFalse(Schedule.objects.exists())
+
+    def test_overlaps_with_existing_schedules_are_refused(self):
+        Schedule.objects.create(doctor=self.doctor, date=self.day, start_time=time(9, 0), end_time=time(10, 0))
+        # Another doctor's row on the same day does not count
+        other = Doctor.objects.create(
+            user=User.objects.create_user(username='bulk_other2', password='pass'), speciality='gen'
+        )
+        Schedule.objects.create(doctor=other, date=self.day, start_time=time(11, 0), end_time=time(12, 0))
+
+        payload = [self._slot(self.day, 8), self._slot(self.day, 9, 30), self._slot(self.day, 11)]
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(
+            str(response.data[1]['non_field_errors'][0]),
+            'This time slot overlaps with an existing schedule from 09:00:00 to 10:00:00.',
+        )
+        self.assertEqual(response.data[2], {})
+        self.assertEqual(Schedule.objects.count(), 2)
+
+    def test_item_rules_still_apply(self):
+        payload = [self._slot(self.day, 9), self._slot(self.day, 9, minutes=15)]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('at least 30 minutes', str(response.data[1]['non_field_errors'][0]))
+
+    def test_payload_size_is_capped(self):
+        response = self.client.post(self.url, self._week_payload(BULK_MAX_ITEMS + 1), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Schedule.objects.exists())
+
+    def test_patients_cannot_bulk_create(self):
+        patient = Patient.objects.create(user=User.objects.create_user(username='bulk_pat', password='pass'))
+        self.client.force_authenticate(user=patient.user)
+        response = self.client.post(self.url, [self._slot(self.day, 9)], format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ScheduleWeekSyncTest(TestCase):
+    def setUp(self):
+        get_slot_index().invalidate()
+        self.addCleanup(get_slot_index().invalidate)
+        self.client = APIClient()
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='week_doc', password='pass'), speciality='gen'
+        )
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user(username='week_pat', password='pass')
+        )
+        self.client.force_authenticate(user=self.doctor.user)
+        self.url = reverse('schedule-week')
+        self.day = next_weekday(date.today() + timedelta(days=1))
+        self.next_day = next_weekday(self.day + timedelta(days=1))
+
+    def _row(self, day, hour, minutes=60, **kwargs):
+        return Schedule.objects.create(
+            doctor=self.doctor, date=day, start_time=time(hour, 0),
+            end_time=(datetime.combine(day, time(hour, 0)) + timedelta(minutes=minutes)).time(),
+            **kwargs
+        )
+
+    def _slot(self, day, hour, minutes=60, **kwargs):
+        end = datetime.combine(day, time(hour, 0)) + timedelta(minutes=minutes)
+        return {'date': day.isoformat(), 'start_time': f'{hour:02d}:00', 'end_time': end.time().isoformat(), **kwargs}
+
+    def _sync(self, slots, **body):
+        body = {'date_from': self.day.isoformat(), 'date_to': self.next_day.isoformat(), 'slots': slots, **body}
+        return self.client.put(self.url, body, format='json')
+
+    def test_applies_the_minimal_diff(self):
+        kept = self._row(self.day, 9)
+        shortened = self._row(self.day, 10)
+        removed = self._row(self.day, 11)
+        outside = self._row(next_weekday(self.next_day + timedelta(days=1)), 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._sync([
+                self._slot(self.day, 9),
+                self._slot(self.day, 10, minutes=30),
+                self._slot(self.next_day, 14),
+            ])
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'deleted', 'unchanged')},
+            {'created': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1},
+        )
+        self.assertEqual(
+            [item['start_time'] for item in response.data['schedules']], ['09:00:00', '10:00:00', '14:00:00']
+        )
+        # Randurile potrivite isi pastreaza id-ul
+        self.assertEqual(response.data['schedules'][0]['id'], kept.id)
+        self.assertEqual(response.data['schedules'][1]['id'], shortened.id)
+        shortened.refresh_from_db()
+        self.assertEqual(shortened.end_time, time(10, 30))
+        self.assertFalse(Schedule.objects.filter(id=removed.id).exists())
+        self.assertTrue(Schedule.objects.filter(id=outside.id).exists())
+
+        found = get_slot_index().search(start=timezone.make_aware(datetime.combine(self.next_day, time(0, 0))), end=self.next_day)
+        self.assertEqual([slot['id'] for slot in found], [response.data['schedules'][2]['id']])
+
+    def test_runs_a_fixed_number_of_queries(self):
+        def sync_changing(count):
+            Schedule.objects.all().delete()
+            hours = range(8, 8 + count)
+            for hour in hours:
+                self._row(self.day, hour)
+                self._row(self.next_day, hour)
+            # Fiecare rand se scurteaza sau dispare, fiecare slot nou se insereaza
+            slots = [self._slot(self.day, hour, minutes=30) for hour in hours]
+            slots += [self._slot(self.day, hour) for hour in range(8 + count, 8 + 2 * count)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self._sync(slots)
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(
+                [response.data[key] for key in ('created', 'updated', 'deleted')], [count] * 3
+            )
+            return len(queries)
+
+        sync_changing(1)  # the user's profile is cached from here on
+        small, large = sync_changing(2), sync_changing(5)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, ScheduleViewSet.query_budgets['week'])
+
+    def test_refuses_to_touch_active_appointments(self):
+        booked = self._row(self.day, 9)
+        free = self._row(self.day, 10)
+        Appointment.claim_slot(patient=self.patient, doctor=self.doctor, schedule=booked)
+
+        response = self._sync([self._slot(self.day, 10, minutes=30)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['schedules'], [booked.id])
+        self.assertTrue(Schedule.objects.filter(id=booked.id).exists())
+        free.refresh_from_db()
+        self.assertEqual(free.end_time, time(11, 0))
+
+    def test_booked_slots_can_be_kept(self):
+        booked = self._row(self.day, 9)
+        Appointment.claim_slot(patient=self.patient, doctor=self.doctor, schedule=booked)
+        # Fara is_available slotul rezervat ramane neschimbat
+        response = self._sync([self._slot(self.day, 9), self._slot(self.day, 10)])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['unchanged'], 1)
+        self.assertEqual(response.data['created'], 1)
+
+    def test_slots_with_past_appointments_are_retired_not_deleted(self):
+        slot = self._row(self.day, 9)
+        free = self._row(self.day, 10)
+        appointment = Appointment.claim_slot(patient=self.patient, doctor=self.doctor, schedule=slot)
+        Appointment.objects.filter(id=appointment.id).update(status='cancelled')
+        Schedule.objects.filter(id=slot.id).update(is_available=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._sync([])
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['deleted'], response.data['retired']), (1, 1))
+        # Istoricul pacientului ramane, slotul nu mai poate fi rezervat
+        self.assertTrue(Appointment.objects.filter(id=appointment.id, status='cancelled').exists())
+        slot.refresh_from_db()
+        self.assertFalse(slot.is_available)
+        self.assertFalse(Schedule.objects.filter(id=free.id).exists())
+        found = get_slot_index().search(start=timezone.make_aware(datetime.combine(self.day, time(0, 0))), end=self.day)
+        self.assertEqual(found, [])
+
+    def test_overlapping_slots_are_refused(self):
+        response = self._sync([self._slot(self.day, 9, minutes=90), self._slot(self.day, 10)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('item 0 of the request', str(response.data['slots'][1]['non_field_errors'][0]))
+        self.assertFalse(Schedule.objects.exists())
+
+    def test_slots_outside_the_range_are_refused(self):
+        later = next_weekday(self.next_day + timedelta(days=1))
+        response = self._sync([self._slot(later, 9)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('slots', response.data)
+
+    def test_range_is_capped(self):
+        response = self._sync([], date_to=(self.day + timedelta(days=40)).isoformat())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_to', response.data)
+
+    def test_admin_names_the_doctor(self):
+        staff = User.objects.create_user(username='week_staff', password='pass', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        self.assertEqual(self._sync([self._slot(self.day, 9)]).status_code, 400)
+
+        response = self._sync([self._slot(self.day, 9)], doctor=self.doctor.id)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Schedule.objects.get().doctor, self.doctor)
+
+    def test_doctors_only_sync_their_own_week(self):
+        other = Doctor.objects.create(
+            user=User.objects.create_user(username='week_other', password='pass'), speciality='gen'
+        )
+        theirs = Schedule.objects.create(doctor=other, date=self.day, start_time=time(9, 0), end_time=time(10, 0))
+        response = self._sync([self._slot(self.day, 11)], doctor=other.id)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertTrue(Schedule.objects.filter(id=theirs.id).exists())
+        self.assertEqual(Schedule.objects.get(start_time=time(11, 0)).doctor, self.doctor)
+
+    def test_patients_cannot_sync(self):
+        self.client.force_authenticate(user=self.patient.user)
+        self.assertEqual(self._sync([]).status_code, 403)
+
+
+class NextAvailableTest(TestCase):
+    def setUp(self):
+        get_slot_index().invalidate()
+        self.addCleanup(get_slot_index().invalidate)
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user(username='na_pat', password='pass')
+        )
+        self.client.force_authenticate(user=self.patient.user)
+        self.cardio1 = self._doctor('na_c1', 'Cardiology')
+        self.cardio2 = self._doctor('na_c2', 'Cardiology')
+        self.derm = self._doctor('na_d', 'Dermatology')
+        self.day = next_weekday(date.today() + timedelta(days=1))
+        self.url = reverse('schedule-next-available')
+
+    def _doctor(self, username, speciality):
+        user = User.objects.create_user(username=username, password='pass', last_name=username)
+        return Doctor.objects.create(user=user, speciality=speciality)
+
+    def _slot(self, doctor, day, hour, **kwargs):
+        return Schedule.objects.create(
+            doctor=doctor, date=day, start_time=time(hour, 0), end_time=time(hour + 1, 0), **kwargs
+        )
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return [slot['id'] for slot in response.data]
+
+    def test_earliest_slots_across_doctors_of_a_speciality(self):
+        later = next_weekday(self.day + timedelta(days=1))
+        a = self._slot(self.cardio1, later, 9)
+        b = self._slot(self.cardio2, self.day, 14)
+        c = self._slot(self.cardio1, self.day, 10)
+        self._slot(self.cardio2, self.day, 8, is_available=False)
+        self._slot(self.derm, self.day, 8)
+        self._slot(self.cardio1, date.today() - timedelta(days=1), 9)
+
+        response = self.client.get(self.url, {'speciality': 'cardiology', 'limit': 3})
+
+        self.assertEqual(self._ids(response), [c.id, b.id, a.id])
+        self.assertEqual(response.data[0]['doctor_name'], 'Dr. na_c1 ')
+        self.assertEqual(response.data[0]['start_time'], '10:00:00')
+        # Limited to the requested range
+        response = self.client.get(self.url, {'speciality': 'Cardiology', 'to': self.day.isoformat()})
+        self.assertEqual(self._ids(response), [c.id, b.id])
+        response = self.client.get(self.url, {'from': later.isoformat()})
+        self.assertEqual(self._ids(response), [a.id])
+
+    def test_near_keeps_close_slots_closest_first(self):
+        ten = self._slot(self.cardio1, self.day, 10)
+        eleven = self._slot(self.cardio2, self.day, 11)
+        self._slot(self.cardio1, self.day, 15)
+
+        response = self.client.get(self.url, {'near': '10:40'})
+
+        self.assertEqual(self._ids(response), [eleven.id, ten.id])
+
+    def test_index_follows_bookings_without_reloading(self):
+        slot = self._slot(self.cardio1, self.day, 9)
+        self.assertEqual(self._ids(self.client.get(self.url)), [slot.id])
+        loads = get_slot_index().stats()['loads']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.claim_slot(patient=self.patient, doctor=self.cardio1, schedule=slot)
+        self.assertEqual(self._ids(self.client.get(self.url)), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            slot.is_available = True
+            slot.save()
+            other = self._slot(self.derm, self.day, 8)
+        self.assertEqual(self._ids(self.client.get(self.url)), [other.id, slot.id])
+        self.assertEqual(get_slot_index().stats()['loads'], loads)
+
+    def test_invalid_parameters(self):
+        for params in ({'from': '2030-02-30'}, {'near': 'noon'}, {'limit': 0}, {'limit': 'x'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class DoctorScheduleQueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patient_user = User.objects.create_user(username='budget_pat', password='pass')
+        self.patient = Patient.objects.create(user=patient_user)
+        doctor_user = User.objects.create_user(username='budget_doc', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+        self.day = next_weekday(date.today() + timedelta(days=1))
+
+    def _authenticate(self, user):
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+
+    def _grow_doctors(self, size):
+        while Doctor.objects.count() < size:
+            n = Doctor.objects.count()
+            user = User.objects.create_user(username=f'budget_doc{n}', password='pass')
+            Doctor.objects.create(user=user, speciality='gen')
+
+    def _grow_schedules(self, size):
+        # Spread over several doctors so a per-row doctor lookup would show up
+        self._grow_doctors(3)
+        doctors = list(Doctor.objects.all())
+        while Schedule.objects.count() < size:
+            n = Schedule.objects.count()
+            Schedule.objects.create(
+                doctor=doctors[n % len(doctors)], date=self.day + timedelta(days=7 * (n // 3)),
+                start_time=time(9, 0), end_time=time(10, 0),
+            )
+
+    def test_doctor_list_as_patient(self):
+        self._authenticate(self.patient.user)
+        self.assertQueryBudget(
+            DoctorViewSet, 'list', self._grow_doctors,
+            lambda: self.client.get(reverse('doctor-list')),
+        )
+
+    def test_schedule_list_as_patient(self):
+        self._authenticate(self.patient.user)
+        self.assertQueryBudget(
+            ScheduleViewSet, 'list', self._grow_schedules,
+            lambda: self.client.get(reverse('schedule-list')),
+        )
+
+    def test_schedule_list_as_doctor(self):
+        self._authenticate(self.doctor.user)
+
+        def grow_own_schedules(size):
+            while Schedule.objects.filter(doctor=self.doctor).count() < size:
+                n = Schedule.objects.filter(doctor=self.doctor).count()
+                Schedule.objects.create(
+                    doctor=self.doctor, date=self.day + timedelta(days=7 * n),
+                    start_time=time(9, 0), end_time=time(10, 0),
+                )
+
+        self.assertQueryBudget(
+            ScheduleViewSet, 'list', grow_own_schedules,
+            lambda: self.client.get(reverse('schedule-list')),
+        )
+
+    def test_next_available_as_patient(self):
+        self._authenticate(self.patient.user)
+
+        def grow_and_rebuild(size):
+            self._grow_schedules(size)
+            # Each request pays for the rebuild, the worst case
+            get_slot_index().invalidate()
+
+        self.addCleanup(get_slot_index().invalidate)
+        self.assertQueryBudget(
+            ScheduleViewSet, 'next_available', grow_and_rebuild,
+            lambda: self.client.get(reverse('schedule-next-available'), {'limit': 50}),
+        )
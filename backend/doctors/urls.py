@@ -5,6 +5,8 @@ from . import views
 router = DefaultRouter()
 router.register(r'doctors', views.DoctorViewSet)
 router.register(r'schedules', views.ScheduleViewSet)
+router.register(r'schedule-templates', views.ScheduleTemplateViewSet)
+router.register(r'schedule-exceptions', views.ScheduleExceptionViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
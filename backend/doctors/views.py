@@ -1,21 +1,63 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from django.core.exceptions import PermissionDenied
-from .models import Doctor, Schedule
-from .serializers import DoctorSerializer, ScheduleSerializer
+from .models import Doctor, Schedule, ScheduleException, ScheduleTemplate
+from .serializers import (
+    DoctorSerializer, ScheduleExceptionSerializer, ScheduleSerializer, ScheduleTemplateSerializer,
+    WeekSyncSerializer,
+)
+from .recurrence import forget, materialize, materialize_slot, project, release
+from .week_sync import WeekConflict, sync_week
+from .slot_index import get_slot_index, slot_index_setting
+from datetime import datetime, time, timedelta
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from authentication.permissions import IsAdminRole
+import heapq
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _parse_param(value, parser):
+    """Parsed query parameter, None when absent; ValueError when malformed."""
+    if not value:
+        return None
+    parsed = parser(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def _parse_bool(value):
+    value = value.lower()
+    if value not in ('true', 'false', '1', '0'):
+        raise ValueError(value)
+    return value in ('true', '1')
+
+
+SCHEDULE_LIST_DEFAULTS = {
+    'WINDOW_DAYS': 30,    # default span of a schedule list without from / to
+    'MAX_DAYS': 366,      # longest span a single request may ask for
+}
+
+
+def schedule_list_setting(name):
+    return getattr(settings, 'SCHEDULE_LIST', {}).get(name, SCHEDULE_LIST_DEFAULTS[name])
+
+
 class DoctorViewSet(viewsets.ModelViewSet):
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Token, role lookups and the doctors joined with their users
+    query_budgets = {'list': 5, 'retrieve': 5}
 
     def get_queryset(self):
         user = self.request.user
@@ -26,11 +68,11 @@ class DoctorViewSet(viewsets.ModelViewSet):
         
         # Doctors can see all doctors (but can only edit their own profile)
         if hasattr(user, "doctor"):
-            return Doctor.objects.all()
+            return Doctor.objects.all().select_related('user')
         
         # Patients can see all doctors (read-only) for booking appointments
         if hasattr(user, "patient"):
-            return Doctor.objects.all()
+            return Doctor.objects.all().select_related('user')
         
         # Fallback: no access for users without roles
         return Doctor.objects.none()
@@ -75,6 +117,19 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     queryset = Schedule.objects.all()
     serializer_class = ScheduleSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Token, role lookups and the schedules joined with doctor and user;
+    # next_available reads the token and, when it (re)builds the slot index,
+    # the doctors and the free schedules
+    # projected=true adds the templates, exceptions and rows of the window
+    # bulk_create: one INSERT per chunk, for at most BULK_MAX_ITEMS slots;
+    # week: the rows of the range, the delete cascade and one write of each kind
+    query_budgets = {'list': 8, 'retrieve': 5, 'next_available': 3, 'bulk_create': 12, 'week': 12}
+    # Patients only see free slots, from today on
+    bookable_only = False
+    # Doctors only see their own schedules
+    own_doctor_id = None
+    # Window and filters of a list request with projected=true
+    projection = None
 
     def get_queryset(self):
         user = self.request.user
@@ -85,18 +140,262 @@ class ScheduleViewSet(viewsets.ModelViewSet):
         
         # Doctors can see their own schedules
         if hasattr(user, "doctor"):
-            return Schedule.objects.filter(doctor=user.doctor)
+            self.own_doctor_id = user.doctor.id
+            return Schedule.objects.filter(doctor=user.doctor).select_related('doctor__user')
         
         # Patients can see all available schedules for booking
         if hasattr(user, "patient"):
-            return Schedule.objects.filter(is_available=True)
+            self.bookable_only = True
+            return Schedule.objects.filter(is_available=True).select_related('doctor__user')
         
         # Fallback: no access
         return Schedule.objects.none()
     
     # @method_decorator(cache_page(60*5))  # Cache for 5 minutes, disabled for now
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        response = super().list(request, *args, **kwargs)
+        if self.projection is not None:
+            response.data = self._merge_projection(response.data)
+        return response
+
+    def _merge_projection(self, rows):
+        """``rows`` and the template slots of the window not materialized yet."""
+        options = self.projection
+        doctor_ids = None
+        if self.own_doctor_id is not None:
+            doctor_ids = [self.own_doctor_id]
+        if options['doctor'] is not None:
+            doctor_ids = [d for d in (doctor_ids or [options['doctor']]) if d == options['doctor']]
+        speciality = (options['speciality'] or '').casefold()
+
+        slots = []
+        for slot in project(options['first_day'], options['last_day'], doctor_ids):
+            doctor = slot.template.doctor
+            if speciality and doctor.speciality.casefold() != speciality:
+                continue
+            if options['time_from'] is not None and slot.start_time < options['time_from']:
+                continue
+            if options['time_to'] is not None and slot.start_time > options['time_to']:
+                continue
+            slots.append({
+                'id': None,
+                'doctor': doctor.id,
+                'doctor_name': f"Dr. {doctor.user.last_name} {doctor.user.first_name}",
+                'date': slot.date.isoformat(),
+                'start_time': slot.start_time.isoformat(),
+                'end_time': slot.end_time.isoformat(),
+                'is_available': True,
+                'projected': True,
+            })
+        rows = [dict(row, projected=False) for row in rows]
+        descending = options['ordering'] == '-date'
+        if descending:
+            slots.reverse()
+        # Ambele liste sunt deja ordonate, ISO se compara corect ca text
+        return list(heapq.merge(
+            rows, slots, key=lambda slot: (slot['date'], slot['start_time']), reverse=descending,
+        ))
+
+    # List filters and the index serving each of them, checked by
+    # appointments.tests_query_plans for every role:
+    #   from / to             sched_date_start_idx, sched_available_idx (patients)
+    #   doctor                the (doctor, date, start_time) unique index
+    #   speciality, is_available, time_from / time_to
+    #                         checked on the rows of the date range
+    ORDERINGS = {
+        'date': ('date', 'start_time', 'id'),
+        '-date': ('-date', '-start_time', '-id'),
+    }
+
+    def filter_queryset(self, queryset):
+        """
+        Filtrele listei: ``doctor``, ``speciality``, ``from`` / ``to``
+        (YYYY-MM-DD, default today to +SCHEDULE_LIST['WINDOW_DAYS']),
+        ``is_available``, ``time_from`` / ``time_to`` (HH:MM, start time) and
+        ``ordering`` (``date`` or ``-date``)
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action != 'list':
+            return queryset
+
+        params = self.request.query_params
+        errors = {}
+
+        def parsed(name, parser, message):
+            try:
+                return _parse_param(params.get(name), parser)
+            except ValueError:
+                errors[name] = message
+
+        first_day = parsed('from', parse_date, 'Must be a YYYY-MM-DD date.')
+        last_day = parsed('to', parse_date, 'Must be a YYYY-MM-DD date.')
+        time_from = parsed('time_from', parse_time, 'Must be a HH:MM time.')
+        time_to = parsed('time_to', parse_time, 'Must be a HH:MM time.')
+        doctor = parsed('doctor', int, 'Must be a doctor id.')
+        is_available = parsed('is_available', _parse_bool, 'Must be true or false.')
+        projected = parsed('projected', _parse_bool, 'Must be true or false.')
+        ordering = params.get('ordering', 'date')
+        if ordering not in self.ORDERINGS:
+            errors['ordering'] = f"Must be one of: {', '.join(self.ORDERINGS)}."
+        if errors:
+            raise ValidationError(errors)
+
+        window = timedelta(days=schedule_list_setting('WINDOW_DAYS'))
+        today = timezone.localdate()
+        if first_day is None:
+            first_day = today if last_day is None else last_day - window
+        if self.bookable_only and first_day < today:
+            # Sloturile trecute nu mai pot fi rezervate
+            first_day = today
+        if last_day is None:
+            last_day = first_day + window
+        if (last_day - first_day).days > schedule_list_setting('MAX_DAYS'):
+            raise ValidationError(
+                {'to': f"The range is limited to {schedule_list_setting('MAX_DAYS')} days."}
+            )
+
+        if projected and is_available is not False:
+            self.projection = {
+                'first_day': first_day, 'last_day': last_day, 'doctor': doctor,
+                'speciality': params.get('speciality'), 'time_from': time_from,
+                'time_to': time_to, 'ordering': ordering,
+            }
+
+        queryset = queryset.filter(date__gte=first_day, date__lte=last_day)
+        if doctor is not None:
+            queryset = queryset.filter(doctor_id=doctor)
+        if params.get('speciality'):
+            queryset = queryset.filter(doctor__speciality__iexact=params['speciality'])
+        if is_available is not None:
+            queryset = queryset.filter(is_available=is_available)
+        if time_from is not None:
+            queryset = queryset.filter(start_time__gte=time_from)
+        if time_to is not None:
+            queryset = queryset.filter(start_time__lte=time_to)
+        return queryset.order_by(*self.ORDERINGS[ordering])
+
+    @action(detail=False, methods=['post'])
+    def materialize(self, request):
+        """
+        Creeaza randul unui slot proiectat dintr-un template, pentru rezervare
+
+        Body: ``doctor``, ``date`` (YYYY-MM-DD) and ``start_time`` (HH:MM) of
+        a slot listed with ``projected: true``. Returns the schedule to book,
+        which already exists when the slot was materialized before.
+        """
+        try:
+            doctor_id = _parse_param(str(request.data.get('doctor', '')), int)
+            day = _parse_param(str(request.data.get('date', '')), parse_date)
+            start_time = _parse_param(str(request.data.get('start_time', '')), parse_time)
+        except ValueError:
+            doctor_id = day = start_time = None
+        if None in (doctor_id, day, start_time):
+            return Response(
+                {'error': 'doctor, date (YYYY-MM-DD) and start_time (HH:MM) are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if day < timezone.localdate():
+            return Response(
+                {'error': 'Past slots cannot be booked'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        schedule = materialize_slot(doctor_id, day, start_time)
+        if schedule is None:
+            return Response(
+                {'error': 'No such slot in the doctor\'s schedule'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(self.get_serializer(schedule).data)
+
+    @action(detail=False, methods=['put'])
+    def week(self, request):
+        """
+        Inlocuieste sloturile unui doctor dintr-un interval cu cele trimise
+
+        Body: ``date_from``, ``date_to``, ``slots`` (date, start_time,
+        end_time and optionally is_available) and, for admins, ``doctor``.
+        The minimal insert/update/delete diff is applied in one transaction
+        (doctors.week_sync); nothing is applied when it would change a slot
+        with an active appointment.
+        """
+        user = request.user
+        is_admin = IsAdminRole().has_permission(request, self)
+        if not is_admin and not hasattr(user, 'doctor'):
+            raise PermissionDenied("Only doctors can manage their schedule.")
+        serializer = WeekSyncSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        if is_admin:
+            doctor = serializer.validated_data.get('doctor')
+            if doctor is None:
+                raise ValidationError({'doctor': 'Doctor ID is required for admin requests.'})
+        else:
+            # Un doctor isi sincronizeaza doar propriul program
+            doctor = user.doctor
+
+        try:
+            diff = sync_week(
+                doctor, serializer.validated_data['date_from'],
+                serializer.validated_data['date_to'], serializer.validated_data['slots'],
+            )
+        except WeekConflict as conflict:
+            return Response(
+                {
+                    'error': 'Cannot change or delete schedules with active appointments.',
+                    'schedules': conflict.schedule_ids,
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info(f"Week of doctor {doctor.id} synced by user {user.id}: {diff.counts()}")
+        schedules = sorted(
+            diff.create + diff.update + diff.unchanged, key=lambda s: (s.date, s.start_time)
+        )
+        for schedule in schedules:
+            schedule.doctor = doctor
+        return Response({
+            **diff.counts(),
+            'schedules': self.get_serializer(schedules, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def next_available(self, request):
+        """
+        Cauta primele sloturi libere, pentru toti doctorii
+
+        Query: ``speciality``, ``from`` and ``to`` (YYYY-MM-DD), ``near``
+        (HH:MM, slots within SLOT_INDEX['NEAR_MINUTES'] of it) and ``limit``.
+        Answered from the in-memory slot index (doctors.slot_index) without
+        reading the schedules table.
+        """
+        params = request.query_params
+        try:
+            first_day = _parse_param(params.get('from'), parse_date)
+            last_day = _parse_param(params.get('to'), parse_date)
+            near = _parse_param(params.get('near'), parse_time)
+        except ValueError:
+            return Response(
+                {'error': 'from and to must be YYYY-MM-DD dates and near a HH:MM time'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = int(params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        max_limit = slot_index_setting('MAX_LIMIT')
+        if not 1 <= limit <= max_limit:
+            return Response(
+                {'error': f'limit must be between 1 and {max_limit}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        start = timezone.now()
+        if first_day is not None:
+            start = max(start, timezone.make_aware(datetime.combine(first_day, time.min)))
+        slots = get_slot_index().search(
+            speciality=params.get('speciality'), start=start, end=last_day, near=near, limit=limit,
+        )
+        return Response(slots)
     
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -161,7 +460,14 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     @transaction.atomic
     def bulk_create(self, request, *args, **kwargs):
         """Create multiple schedules in a single transaction"""
-        serializer = self.get_serializer(data=request.data, many=True)
+        user = request.user
+        if not hasattr(user, "doctor"):
+            raise PermissionDenied("Only doctors can create schedules.")
+        # Validarea in bloc verifica suprapunerile pentru doctorul care creeaza
+        serializer = self.get_serializer(
+            data=request.data, many=True,
+            context={**self.get_serializer_context(), 'doctor': user.doctor},
+        )
         serializer.is_valid(raise_exception=True)
         self.perform_bulk_create(serializer)
         headers = self.get_success_headers(serializer.data)
@@ -210,9 +516,11 @@ class ScheduleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Sterge schedule
+        # Sterge schedule; un slot dintr-un template nu mai e proiectat din nou
         schedule_id = schedule.id
-        schedule.delete()
+        with transaction.atomic():
+            forget([schedule])
+            schedule.delete()
         
         logger.info(f"Schedule {schedule_id} deleted by user {request.user.id}")
         
@@ -220,3 +528,83 @@ class ScheduleViewSet(viewsets.ModelViewSet):
             {'message': f'Schedule {schedule_id} deleted successfully'},
             status=status.HTTP_204_NO_CONTENT
         )
+
+
+class DoctorOwnedViewSet(viewsets.ModelViewSet):
+    """
+    Rows a doctor manages for themselves; admins manage everyone's and
+    name the doctor in the request body, patients have no access
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        model = self.get_serializer_class().Meta.model
+        if IsAdminRole().has_permission(self.request, self):
+            return model.objects.all().select_related('doctor__user')
+        if hasattr(self.request.user, "doctor"):
+            return model.objects.filter(doctor=self.request.user.doctor).select_related('doctor__user')
+        return model.objects.none()
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        if IsAdminRole().has_permission(self.request, self):
+            if not serializer.validated_data.get('doctor'):
+                raise ValidationError({'doctor': 'Doctor ID is required for admin requests.'})
+            return serializer.save()
+        if not hasattr(user, "doctor"):
+            raise PermissionDenied("Only doctors can manage their schedule.")
+        return serializer.save(doctor=user.doctor)
+
+    def perform_update(self, serializer):
+        # Un doctor nu poate muta randul la alt doctor
+        if not IsAdminRole().has_permission(self.request, self):
+            return serializer.save(doctor=serializer.instance.doctor)
+        return serializer.save()
+
+
+class ScheduleTemplateViewSet(DoctorOwnedViewSet):
+    """
+    Weekly recurring availability; changes are materialized right away for
+    the rolling horizon (doctors.recurrence)
+    """
+    queryset = ScheduleTemplate.objects.all()
+    serializer_class = ScheduleTemplateSerializer
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        template = super().perform_create(serializer)
+        materialize(doctor_ids=[template.doctor_id])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        template = super().perform_update(serializer)
+        # Sloturile libere vechi se refac dupa noul program
+        release(template_ids=[template.id])
+        materialize(doctor_ids=[template.doctor_id])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        release(template_ids=[instance.id])
+        instance.delete()
+
+
+class ScheduleExceptionViewSet(DoctorOwnedViewSet):
+    """Days off; free slots already materialized for them are removed"""
+    queryset = ScheduleException.objects.all()
+    serializer_class = ScheduleExceptionSerializer
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        release(exception=super().perform_create(serializer))
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        exception = super().perform_update(serializer)
+        release(exception=exception)
+        materialize(doctor_ids=[exception.doctor_id])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        doctor_id = instance.doctor_id
+        instance.delete()
+        materialize(doctor_ids=[doctor_id])
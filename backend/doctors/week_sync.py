@@ -0,0 +1,134 @@
+"""
+Replace a doctor's schedules of a date range with a desired set of slots.
+
+The desired slots are matched with the existing rows of the range by date
+and start time. Matched rows whose end time or availability differ are
+updated, the other rows are deleted and the other slots inserted, so a row
+keeps its id while its start stays put. A slot that leaves ``is_available``
+out keeps the value of its row.
+
+Rows with an active appointment are never updated or deleted: when the
+diff would touch one, nothing is applied and WeekConflict names them. Rows
+left out that hold past (cancelled, completed) appointments are retired,
+marked unavailable instead of deleted, so the cascade does not take the
+patients' history with them, as in recurrence.release.
+
+Deleted rows that came from a template are recorded as exceptions
+(recurrence.forget), so the nightly materialization does not recreate them.
+
+The diff is applied in one transaction with a fixed number of statements.
+bulk_update and bulk_create skip post_save, so the slot index is updated
+here; deletes go through the ORM collector, whose post_delete signals
+unindex the rows.
+"""
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Schedule
+from .recurrence import forget
+from .slot_index import index_slots
+
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+# Acelasi plafon ca la crearea in bloc
+BATCH_SIZE = 500
+
+
+class WeekConflict(Exception):
+    """The diff would change or delete rows with active appointments."""
+
+    def __init__(self, schedule_ids):
+        super().__init__(f"Schedules with active appointments: {schedule_ids}")
+        self.schedule_ids = schedule_ids
+
+
+class WeekDiff:
+    """Rows to insert, update and delete to reach the desired slots."""
+
+    def __init__(self):
+        self.create = []
+        self.update = []
+        self.delete = []
+        self.retire = []
+        self.unchanged = []
+        self.conflicts = []
+
+    def counts(self):
+        return {
+            'created': len(self.create),
+            'updated': len(self.update),
+            'deleted': len(self.delete),
+            'retired': len(self.retire),
+            'unchanged': len(self.unchanged),
+        }
+
+
+def diff_week(doctor, first_day, last_day, slots):
+    """
+    The WeekDiff turning ``doctor``'s rows from ``first_day`` to ``last_day``
+    into ``slots`` (dicts with date, start_time, end_time and optionally
+    is_available); one query
+    """
+    rows = Schedule.objects.filter(
+        doctor=doctor, date__gte=first_day, date__lte=last_day,
+    ).annotate(
+        active=Count('appointments', filter=Q(appointments__status__in=ACTIVE_STATUSES)),
+        booked=Count('appointments'),
+    )
+    existing = {(row.date, row.start_time): row for row in rows}
+
+    diff = WeekDiff()
+    for slot in slots:
+        row = existing.pop((slot['date'], slot['start_time']), None)
+        if row is None:
+            diff.create.append(Schedule(
+                doctor=doctor, date=slot['date'], start_time=slot['start_time'],
+                end_time=slot['end_time'], is_available=slot.get('is_available', True),
+            ))
+            continue
+        is_available = slot.get('is_available', row.is_available)
+        if row.end_time == slot['end_time'] and row.is_available == is_available:
+            diff.unchanged.append(row)
+            continue
+        if row.active:
+            diff.conflicts.append(row.id)
+            continue
+        row.end_time = slot['end_time']
+        row.is_available = is_available
+        diff.update.append(row)
+
+    for row in existing.values():
+        if row.active:
+            diff.conflicts.append(row.id)
+        elif row.booked:
+            # Randurile cu istoric de programari (anulate) raman, doar inchise
+            row.is_available = False
+            diff.retire.append(row)
+        else:
+            diff.delete.append(row)
+    diff.conflicts.sort()
+    return diff
+
+
+def sync_week(doctor, first_day, last_day, slots):
+    """
+    Apply the diff of ``diff_week`` in one transaction; returns the WeekDiff
+    or raises WeekConflict without writing anything
+    """
+    with transaction.atomic():
+        diff = diff_week(doctor, first_day, last_day, slots)
+        if diff.conflicts:
+            raise WeekConflict(diff.conflicts)
+        if diff.delete:
+            forget(diff.delete)
+            Schedule.objects.filter(id__in=[row.id for row in diff.delete]).delete()
+        if diff.update or diff.retire:
+            Schedule.objects.bulk_update(
+                diff.update + diff.retire, ['end_time', 'is_available'], batch_size=BATCH_SIZE
+            )
+        if diff.create:
+            Schedule.objects.bulk_create(diff.create, batch_size=BATCH_SIZE)
+        # bulk_update si bulk_create nu trimit post_save
+        index_slots(diff.update + diff.retire + diff.create)
+    return diff
@@ -0,0 +1,106 @@
+"""
+In-process wake-ups for long-polling notification clients.
+
+A request to NotificationViewSet.wait subscribes for its user before it
+looks for new rows, then sleeps on the subscription until a notification for
+that user is committed or the timeout expires. Notification creation
+publishes the user ids on commit, so an idle client costs a sleeping thread
+and no queries.
+
+The broker only coordinates threads of one process. A client served by
+another process is not woken early: its wait times out and the next request
+reads the rows from the database, which stays the source of truth.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'TIMEOUT': 25,        # seconds a wait request is held at most
+    'MAX_WAITERS': 50,    # held requests per process, each one holds a worker thread
+    'LIMIT': 50,          # notifications returned per response
+}
+
+
+def wait_setting(name):
+    return getattr(settings, 'NOTIFICATION_WAIT', {}).get(name, DEFAULTS[name])
+
+
+class BrokerBusy(Exception):
+    """Raised when MAX_WAITERS requests are already waiting."""
+
+
+class Subscription:
+    """Woken when a notification for ``user_id`` is committed."""
+
+    __slots__ = ('user_id', 'event')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        """Returns whether a notification was published before ``timeout``."""
+        return self.event.wait(timeout)
+
+
+class NotificationBroker:
+    """Per-user subscriptions with published/woken/rejected counters."""
+
+    def __init__(self, max_waiters=50):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._waiting = 0
+        self._counters = {'published': 0, 'woken': 0, 'rejected': 0}
+
+    @contextmanager
+    def subscribe(self, user_id):
+        """Subscribe for the duration of the block; raises BrokerBusy when full."""
+        subscription = Subscription(user_id)
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                self._counters['rejected'] += 1
+                raise BrokerBusy('Too many clients are waiting for notifications.')
+            self._waiting += 1
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                subscriptions = self._subscriptions[user_id]
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[user_id]
+
+    def publish(self, user_ids):
+        """Wake every subscription of ``user_ids``."""
+        with self._lock:
+            self._counters['published'] += 1
+            for user_id in user_ids:
+                for subscription in self._subscriptions.get(user_id, ()):
+                    subscription.event.set()
+                    self._counters['woken'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, waiting=self._waiting)
+
+
+_notification_broker = None
+_notification_broker_lock = threading.Lock()
+
+
+def get_notification_broker():
+    """Return the process-wide broker configured from settings.NOTIFICATION_WAIT."""
+    global _notification_broker
+    if _notification_broker is None:
+        with _notification_broker_lock:
+            if _notification_broker is None:
+                _notification_broker = NotificationBroker(
+                    max_waiters=wait_setting('MAX_WAITERS'),
+                )
+    return _notification_broker
@@ -0,0 +1,82 @@
+"""
+Email bodies for notifications.
+
+Both parts of an email come from templates in
+templates/notifications/email/: an HTML body wrapped in the invariant head
+(styles, banner) and foot, and a separately written plain-text body, so no
+HTML has to be stripped. The body templates are compiled and the head and
+foot rendered once per process; each email then renders only its body and
+concatenates the fragments. A digest (digest.html, digest.txt) lists the
+titles and messages of several notifications in one body between the same
+head and foot.
+"""
+
+import threading
+from html import unescape
+
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+TEMPLATE_DIR = 'notifications/email'
+
+
+class EmailRenderer:
+    """Render (subject, text, html) for batches of notification emails."""
+
+    def __init__(self):
+        self.head_html = render_to_string(f'{TEMPLATE_DIR}/head.html')
+        self.foot_html = render_to_string(f'{TEMPLATE_DIR}/foot.html')
+        self.foot_text = render_to_string(f'{TEMPLATE_DIR}/foot.txt')
+        self.body_html = get_template(f'{TEMPLATE_DIR}/body.html')
+        self.body_text = get_template(f'{TEMPLATE_DIR}/body.txt')
+        self.digest_html = get_template(f'{TEMPLATE_DIR}/digest.html')
+        self.digest_text = get_template(f'{TEMPLATE_DIR}/digest.txt')
+
+    def render(self, name, title, message):
+        """
+        Parts of one email; ``title`` and ``message`` are notification content,
+        which is HTML-escaped already (see notifications.messages)
+        """
+        html = ''.join((
+            self.head_html,
+            self.body_html.render({'name': name, 'title': mark_safe(title), 'message': mark_safe(message)}),
+            self.foot_html,
+        ))
+        subject = unescape(title)
+        text = self.body_text.render({'name': name, 'title': subject, 'message': unescape(message)})
+        return subject, text + self.foot_text, html
+
+    def render_many(self, items):
+        """``render`` for each (name, title, message) of ``items``."""
+        return [self.render(name, title, message) for name, title, message in items]
+
+    def render_digest(self, name, items):
+        """Parts of one email combining the (title, message) pairs of ``items``."""
+        html = ''.join((
+            self.head_html,
+            self.digest_html.render({
+                'name': name,
+                'items': [(mark_safe(title), mark_safe(message)) for title, message in items],
+            }),
+            self.foot_html,
+        ))
+        subject = f'{len(items)} new notifications'
+        text = self.digest_text.render({
+            'name': name,
+            'items': [(unescape(title), unescape(message)) for title, message in items],
+        })
+        return subject, text + self.foot_text, html
+
+
+_email_renderer = None
+_email_renderer_lock = threading.Lock()
+
+
+def get_email_renderer():
+    """Return the process-wide renderer."""
+    global _email_renderer
+    if _email_renderer is None:
+        with _email_renderer_lock:
+            if _email_renderer is None:
+                _email_renderer = EmailRenderer()
+    return _email_renderer
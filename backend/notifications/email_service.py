@@ -1,9 +1,12 @@
 import logging
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags, escape
+from django.core.mail import EmailMultiAlternatives
+from django.utils.html import escape
 from django.conf import settings
 
+from .email_rendering import get_email_renderer
+from .messages import render_notification
+from .smtp_pool import get_email_sender
+
 logger = logging.getLogger(__name__)
 
 class EmailService:
@@ -12,55 +15,127 @@ class EmailService:
     """
     
     @staticmethod
-    def send_notification_email(notification):
+    def build_notification_email(notification):
         """
-        Send email for a notification object
+        Build the email message for a notification object
         
         Args:
             notification: Notification instance with type='email'
             
         Returns:
-            bool: True if email was sent successfully, False otherwise
-        """
-        try:
-            # Validate notification
-            if notification.type != 'email':
-                logger.warning(f"Attempted to send email for non-email notification {notification.id}")
-                return False
+            EmailMultiAlternatives: message with plain text and HTML bodies
             
-            if not notification.user.email:
-                logger.warning(f"User {notification.user.username} has no email address")
-                return False
+        Raises:
+            ValueError: if the notification cannot be delivered by email
+        """
+        email = EmailService.build_notification_emails([notification])[0]
+        if isinstance(email, ValueError):
+            raise email
+        return email
+
+    @staticmethod
+    def build_notification_emails(notifications):
+        """
+        Build the email messages for a batch of notifications
+        
+        Args:
+            notifications: Notification instances with type='email'
             
-            # Prepare email content
-            context = {
-                'user': notification.user,
-                'notification': notification,
-                'title': notification.title,
-                'message': notification.message,
-            }
+        Returns:
+            list: one entry per notification, the EmailMultiAlternatives or
+            the ValueError that prevents sending it
+        """
+        results = [None] * len(notifications)
+        deliverable = []
+        for position, notification in enumerate(notifications):
+            if notification.type != 'email':
+                results[position] = ValueError(
+                    f"Notification {notification.id} is not an email notification"
+                )
+            elif not notification.user.email:
+                results[position] = ValueError(
+                    f"User {notification.user.username} has no email address"
+                )
+            else:
+                deliverable.append(position)
+
+        items = []
+        for position in deliverable:
+            notification = notifications[position]
+            title, message = render_notification(notification)
+            items.append((notification.user.first_name or notification.user.username, title, message))
+        rendered = get_email_renderer().render_many(items)
+
+        for position, (subject, text, html) in zip(deliverable, rendered):
+            email = EmailMultiAlternatives(
+                subject=subject,
+                body=text,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[notifications[position].user.email],
+            )
+            email.attach_alternative(html, 'text/html')
+            results[position] = email
+        return results
+    
+    @staticmethod
+    def build_digest_email(notifications):
+        """
+        Build one email combining several notifications of the same user
+        
+        Args:
+            notifications: Notification instances with type='email', oldest first
             
-            # Generate HTML content
-            html_content = EmailService._generate_html_content(context)
+        Returns:
+            EmailMultiAlternatives: message listing every notification
             
-            # Generate plain text content (fallback)
-            plain_content = strip_tags(html_content)
+        Raises:
+            ValueError: if the notifications cannot be delivered by email
+        """
+        user = notifications[0].user
+        if any(notification.type != 'email' for notification in notifications):
+            raise ValueError("Digest contains notifications that are not email notifications")
+        if not user.email:
+            raise ValueError(f"User {user.username} has no email address")
+
+        subject, text, html = get_email_renderer().render_digest(
+            user.first_name or user.username,
+            [render_notification(notification) for notification in notifications],
+        )
+        email = EmailMultiAlternatives(
+            subject=subject,
+            body=text,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+        email.attach_alternative(html, 'text/html')
+        return email
+    
+    @staticmethod
+    def send_notification_email(notification):
+        """
+        Send email for a notification object
+        
+        Args:
+            notification: Notification instance with type='email'
             
-            # Send email
-            success = send_mail(
-                subject=notification.title,
-                message=plain_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[notification.user.email],
-                html_message=html_content,
-                fail_silently=False
-            )
+        Returns:
+            bool: True if email was sent successfully, False otherwise
+        """
+        try:
+            email = EmailService.build_notification_email(notification)
+        except ValueError as e:
+            logger.warning(str(e))
+            return False
+        
+        try:
+            # Reuses an open connection from the pool instead of a new handshake
+            error = get_email_sender().send_batch([email])[0]
             
-            if success:
+            if error is None:
                 logger.info(f"Email sent successfully to {notification.user.email} for notification {notification.id}")
                 return True
             else:
-                logger.error(f"Failed to send email to {notification.user.email} for notification {notification.id}")
+                logger.error(f"Failed to send email to {notification.user.email} for notification {notification.id}: {str(error)}")
                 return False
                 
         except Exception as e:
@@ -95,101 +170,6 @@ class EmailService:
             )
             return False
     
-    @staticmethod
-    def _generate_html_content(context):
-        """
-        Generate HTML content for email
-        
-        Args:
-            context: Dictionary with email context data
-            
-        Returns:
-            str: HTML content for email
-        """
-        user = context['user']
-        notification = context['notification']
-        
-        # Simple HTML template
-        html_template = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{notification.title}</title>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 600px;
-                    margin: 0 auto;
-                    padding: 20px;
-                }}
-                .header {{
-                    background-color: #007bff;
-                    color: white;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 5px 5px 0 0;
-                }}
-                .content {{
-                    background-color: #f8f9fa;
-                    padding: 30px;
-                    border-radius: 0 0 5px 5px;
-                }}
-                .message {{
-                    background-color: white;
-                    padding: 20px;
-                    border-radius: 5px;
-                    margin: 20px 0;
-                    border-left: 4px solid #007bff;
-                }}
-                .footer {{
-                    text-align: center;
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 1px solid #dee2e6;
-                    color: #6c757d;
-                    font-size: 14px;
-                }}
-                .btn {{
-                    display: inline-block;
-                    padding: 12px 24px;
-                    background-color: #007bff;
-                    color: white;
-                    text-decoration: none;
-                    border-radius: 5px;
-                    margin: 10px 0;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>Medical Appointments System</h1>
-            </div>
-            
-            <div class="content">
-                <h2>Hello, {user.first_name or user.username}!</h2>
-                
-                <div class="message">
-                    <h3>{notification.title}</h3>
-                    <p>{notification.message}</p>
-                </div>
-                
-                <p>If you have any questions, please contact your healthcare provider or our support team.</p>
-                
-                <div class="footer">
-                    <p>This email was sent automatically by the Medical Appointments System.</p>
-                    <p>Please do not reply to this email.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return html_template
-    
     @staticmethod
     def send_test_email(recipient_email, subject="Test Email", message="This is a test email"):
         """
@@ -204,30 +184,19 @@ class EmailService:
             bool: True if email was sent successfully, False otherwise
         """
         try:
-            # Create a simple object-like structure for consistency with _generate_html_content
-            class MockObject:
-                def __init__(self, **kwargs):
-                    for key, value in kwargs.items():
-                        setattr(self, key, value)
-            
-            context = {
-                'user': MockObject(first_name='Test User', username='testuser'),
-                'notification': MockObject(title=subject, message=message)
-            }
-            
-            html_content = EmailService._generate_html_content(context)
-            plain_content = strip_tags(html_content)
-            
-            success = send_mail(
+            subject, text, html = get_email_renderer().render(
+                'Test User', escape(subject), escape(message)
+            )
+            email = EmailMultiAlternatives(
                 subject=subject,
-                message=plain_content,
+                body=text,
                 from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[recipient_email],
-                html_message=html_content,
-                fail_silently=False
+                to=[recipient_email],
             )
+            email.attach_alternative(html, 'text/html')
+            error = get_email_sender().send_batch([email])[0]
             
-            if success:
+            if error is None:
                 logger.info(f"Test email sent successfully to {recipient_email}")
                 return True
             else:
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import drain
+
+
+class Command(BaseCommand):
+    help = "Deliver queued notification emails from the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Messages claimed per batch (default NOTIFICATION_OUTBOX['BATCH_SIZE'])",
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep running and poll the outbox instead of exiting when it is empty",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help="Seconds to sleep between polls with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            totals = drain(batch_size=options['batch_size'])
+            if any(totals.values()):
+                self.stdout.write(
+                    f"Outbox drained: {totals['sent']} sent, "
+                    f"{totals['retried']} to retry, {totals['dead']} dead."
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Outbox drained."))
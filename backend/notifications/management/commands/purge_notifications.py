@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from notifications.retention import freelist_bytes, purge, vacuum
+
+
+class Command(BaseCommand):
+    help = "Apply NOTIFICATION_RETENTION: delete or summarize old notifications in small chunks (run nightly via cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help="Rows deleted per transaction (default NOTIFICATION_RETENTION['CHUNK_SIZE'])",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only count the rows the policies would remove",
+        )
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help="VACUUM the SQLite file afterwards to shrink it (locks the database while it runs)",
+        )
+
+    def handle(self, *args, **options):
+        report = purge(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        verb = "would remove" if options['dry_run'] else "removed"
+
+        for name, result in report['policies'].items():
+            line = f"{name}: {verb} {result['deleted']} notifications"
+            if 'summaries' in result:
+                line += f" into {result['summaries']} monthly summaries"
+            self.stdout.write(line)
+        self.stdout.write(f"outbox: {verb} {report['outbox']} sent or dead messages")
+        self.stdout.write(f"reminder log: {verb} {report['reminder_log']} rows")
+
+        if report['bytes'] is not None and not options['dry_run']:
+            self.stdout.write(f"Freed {report['bytes']} bytes inside the database file.")
+        if options['vacuum'] and not options['dry_run']:
+            free = freelist_bytes()
+            vacuum()
+            if free is not None:
+                self.stdout.write(f"Vacuum returned {free} bytes to the filesystem.")
+        self.stdout.write(self.style.SUCCESS("Notification retention applied."))
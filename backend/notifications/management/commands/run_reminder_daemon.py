@@ -0,0 +1,28 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from notifications.reminder_daemon import ReminderDaemon
+
+
+class Command(BaseCommand):
+    help = "Run the reminder daemon: send appointment reminders as they fall due"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--holder', default=None,
+            help="Lease holder name (default host:pid)",
+        )
+
+    def handle(self, *args, **options):
+        daemon = ReminderDaemon(holder=options['holder'])
+
+        def shutdown(signum, frame):
+            daemon.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        self.stdout.write(f"Reminder daemon {daemon.holder} running, Ctrl+C to stop.")
+        daemon.run()
+        self.stdout.write(self.style.SUCCESS("Reminder daemon stopped."))
@@ -0,0 +1,91 @@
+"""
+Message templates of generated notifications.
+
+Notifications created by the application store a template key and a small
+JSON parameter set instead of their rendered text; ``title`` and ``message``
+stay empty and are rendered on read by Notification.render. Templates are
+compiled once per process. Rendering escapes the parameters, so the output
+is safe to insert in HTML as is.
+
+Free-form notifications (created through the API) keep storing their text.
+"""
+
+from functools import lru_cache
+
+from django.template import Context, Engine
+
+MESSAGE_TEMPLATES = {
+    'appointment_booked': (
+        'New Appointment',
+        'You have a new appointment with {{ patient }} on {{ date }} at {{ time }}',
+    ),
+    'appointment_confirmed': (
+        'Appointment Confirmed',
+        'Your appointment with Dr. {{ doctor }} on {{ date }} at {{ time }} has been confirmed.',
+    ),
+    'appointment_cancelled': (
+        'Appointment Cancelled',
+        'Your appointment with Dr. {{ doctor }} on {{ date }} has been cancelled'
+        '{% if by_admin %} by the administration{% endif %}.',
+    ),
+    'appointment_cancelled_doctor': (
+        'Appointment Cancelled',
+        'The appointment with {{ patient }} on {{ date }} has been cancelled'
+        '{% if by_admin %} by the administration{% endif %}.',
+    ),
+    'day_cancelled': (
+        'Appointments Cancelled',
+        'Your {{ count }} appointments on {{ date }} have been cancelled by the administration.',
+    ),
+    'appointment_reminder': (
+        'Appointment Reminder',
+        'You have an appointment with Dr. {{ doctor }} on {{ date }} at {{ time }}.',
+    ),
+    'reminder_summary': (
+        'Appointment reminders, {{ month }}',
+        '{{ count }} appointment reminders were sent in {{ month }}.',
+    ),
+}
+
+# Emailed as soon as they are created, even to users in digest mode
+TIME_CRITICAL = frozenset({
+    'appointment_reminder',
+    'appointment_cancelled',
+    'day_cancelled',
+})
+
+_engine = Engine(autoescape=True)
+
+
+@lru_cache(maxsize=None)
+def compiled(template):
+    """Compiled (title, message) templates for the key ``template``."""
+    title, message = MESSAGE_TEMPLATES[template]
+    return _engine.from_string(title), _engine.from_string(message)
+
+
+def render_message(template, params):
+    """Render the (title, message) of ``template`` with ``params``."""
+    title, message = compiled(template)
+    context = Context(params or {})
+    return title.render(context), message.render(context)
+
+
+def render_notification(notification):
+    """(title, message) of any notification-like object."""
+    if getattr(notification, 'template', ''):
+        return notification.render()
+    return notification.title, notification.message
+
+
+def appointment_params(appointment, **extra):
+    """Parameters shared by the appointment templates."""
+    patient = appointment.patient.user
+    return {
+        'appointment': appointment.id,
+        'doctor': appointment.doctor.user.last_name,
+        'patient': f'{patient.first_name} {patient.last_name}',
+        'date': str(appointment.schedule.date),
+        'time': str(appointment.schedule.start_time),
+        **extra,
+    }
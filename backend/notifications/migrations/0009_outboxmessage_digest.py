@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_notification_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='digest',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,10 +1,19 @@
 import logging
-from django.db import models
+from collections import Counter
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Case, F, Min, Value, When
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.html import escape
 
+from authentication.models import NotificationPreferences
+from .broker import get_notification_broker
+from .messages import TIME_CRITICAL, appointment_params, render_message
+
 logger = logging.getLogger(__name__)
 
 class Notification(models.Model):
@@ -15,8 +24,12 @@ class Notification(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     type = models.CharField(max_length=10, choices=TYPE_CHOICES)
-    title = models.CharField(max_length=100)
-    message = models.TextField()
+    title = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    # Generated notifications: template key and parameters, rendered on read
+    # (see notifications.messages); title and message stay empty
+    template = models.CharField(max_length=50, blank=True)
+    params = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
     
@@ -26,74 +39,323 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Inbox, NotificationViewSet.get_queryset newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_idx'),
+            # Unread notifications of a user, mark_all_as_read and the unread badge
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(read=False),
+                name='notif_user_unread_idx'
+            ),
+            # Oldest first across users, notifications.retention
+            models.Index(fields=['created_at', 'id'], name='notif_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.title} to {self.user.username}"
+        return f"{self.render()[0]} to {self.user.username}"
+
+    def render(self):
+        """(title, message) of the notification, HTML-escaped."""
+        if not self.template:
+            return self.title, self.message
+        if getattr(self, '_rendered', None) is None:
+            self._rendered = render_message(self.template, self.params)
+        return self._rendered
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored flag so the unread counter follows read changes
+        if 'read' in field_names:
+            instance._loaded_read = instance.read
+        return instance
+
+    @classmethod
+    def appointment_reminder(cls, appointment):
+        """Unsaved email notification reminding the patient of ``appointment``."""
+        return cls(
+            user=appointment.patient.user,
+            type='email',
+            template='appointment_reminder',
+            params=appointment_params(appointment),
+        )
 
     @classmethod
     def send_appointment_reminder(cls, appointment):
         """Create an email notification for an upcoming appointment.
 
-        The email is sent immediately via :class:`EmailService` and the
-        resulting notification record is stored with the appropriate
-        ``email_sent`` metadata so the post-save signal does not attempt to
-        resend it.
+        The email itself is queued in the outbox by the post-save signal and
+        delivered by the ``drain_outbox`` worker.
+        """
+        notification = cls.appointment_reminder(appointment)
+        notification.save()
+        return notification
+
+    @classmethod
+    def send_appointment_reminders(cls, appointments):
+        """Create the reminder notifications of a batch of appointments."""
+        return cls.create_many([cls.appointment_reminder(a) for a in appointments])
+
+    @classmethod
+    def create_many(cls, notifications):
+        """
+        Insert unsaved ``notifications`` with a single INSERT
+
+        The fan-out counterpart of ``objects.create``: post_save does not run,
+        so email content is escaped here, the unread counters are adjusted
+        with one UPDATE and all the emails are queued in the outbox with one
+        more INSERT (see OutboxMessage.queue). Returns the saved notifications.
+        """
+        for notification in notifications:
+            _escape_email_content(notification)
+        created = cls.objects.bulk_create(notifications)
+        UnreadCounter.bump(Counter(
+            notification.user_id for notification in created if not notification.read
+        ))
+        _publish_on_commit({notification.user_id for notification in created})
+        OutboxMessage.queue(created)
+        return created
+
+
+def _publish_on_commit(user_ids):
+    # Trezeste clientii in long-poll abia dupa commit, cand randurile sunt vizibile
+    if user_ids:
+        transaction.on_commit(lambda: get_notification_broker().publish(user_ids))
+
+
+def _escape_email_content(notification):
+    # asiguram continutul impotriva XSS; templated notifications are escaped when rendered
+    if notification.type == 'email' and not notification.email_sent:
+        notification.title = escape(notification.title)
+        notification.message = escape(notification.message)
+
+
+class OutboxMessage(models.Model):
+    """
+    E-mail waiting to be delivered for a Notification
+
+    Rows are written in the same transaction as their notification, so the
+    request never waits on SMTP; notifications.outbox delivers them after
+    commit, retrying with backoff and dead-lettering after MAX_ATTEMPTS.
+
+    Messages of users in digest mode are ``digest`` rows held for the user's
+    digest window; the outbox sends the held messages of a user as one email.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    )
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name='outbox_messages'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Next delivery attempt; pushed forward while a worker holds the message
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Coalesced with the user's other digest messages claimed in the same batch
+    digest = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Due messages, notifications.outbox.claim
+            models.Index(
+                fields=['available_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='outbox_due_idx'
+            ),
+            # Delivered and dead-lettered messages, notifications.retention
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=models.Q(status__in=['sent', 'dead']),
+                name='outbox_done_idx'
+            ),
+        ]
+
+    @classmethod
+    def queue(cls, notifications):
+        """
+        Queue the unsent email ``notifications`` with one INSERT
+
+        Users with NotificationPreferences.email_digest get their messages
+        held until the end of their digest window, which starts with the
+        first message still held; TIME_CRITICAL templates are never held.
         """
-        from django.utils import timezone
-        from .email_service import EmailService
-
-        user = appointment.patient.user
-        title = "Appointment Reminder"
-        doctor_name = escape(appointment.doctor.user.last_name)
-        message = (
-            f"You have an appointment with Dr. {doctor_name} "
-            f"on {appointment.schedule.date} at {appointment.schedule.start_time}."
+        emails = [n for n in notifications if n.type == 'email' and not n.email_sent]
+        if not emails:
+            return []
+        now = timezone.now()
+        release = cls._digest_release(
+            {n.user_id for n in emails if n.template not in TIME_CRITICAL}, now
         )
+        messages = []
+        for notification in emails:
+            available_at = None
+            if notification.template not in TIME_CRITICAL:
+                available_at = release.get(notification.user_id)
+            messages.append(cls(
+                notification=notification,
+                digest=available_at is not None,
+                available_at=available_at or now,
+            ))
+        return cls.objects.bulk_create(messages)
 
-        email_success = EmailService.send_appointment_reminder(user, appointment)
+    @classmethod
+    def _digest_release(cls, user_ids, now):
+        """{user id: release time} for the digest users among ``user_ids``."""
+        if not user_ids:
+            return {}
+        windows = dict(
+            NotificationPreferences.objects.filter(user_id__in=user_ids, email_digest=True)
+            .values_list('user_id', 'digest_window_minutes')
+        )
+        if not windows:
+            return {}
+        # Mesajele noi se alatura celor deja retinute, fereastra nu se prelungeste
+        held = dict(
+            cls.objects.filter(
+                status=cls.PENDING, digest=True, attempts=0,
+                notification__user_id__in=windows,
+            )
+            .values('notification__user_id')
+            .annotate(release=Min('available_at'))
+            .values_list('notification__user_id', 'release')
+        )
+        return {
+            user_id: held.get(user_id, now + timedelta(minutes=minutes))
+            for user_id, minutes in windows.items()
+        }
 
-        return cls.objects.create(
-            user=user,
-            type='email',
-            title=title,
-            message=message,
-            email_sent=email_success,
-            email_sent_at=timezone.now() if email_success else None,
+    def __str__(self):
+        return f"Outbox {self.id} ({self.status}) for notification {self.notification_id}"
+
+
+class ReminderChange(models.Model):
+    """
+    Append-only log of appointments whose reminder may have changed
+
+    The reminder daemon reads it past its last seen id to update its
+    in-memory queue without rescanning the appointments table.
+    """
+    appointment_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Reminder change {self.id} for appointment {self.appointment_id}"
+
+
+class SchedulerLease(models.Model):
+    """Row held by the one active reminder daemon, see notifications.reminder_daemon"""
+    name = models.CharField(max_length=50, unique=True)
+    holder = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of unread notifications of a user, for the inbox badge
+
+    Adjusted with single UPDATEs wherever notifications are created, read or
+    deleted. A missing row means the count is unknown: ``for_user`` counts
+    the unread notifications once and stores the result, so adjustments made
+    while the row is missing are simply skipped.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter'
+    )
+    value = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.value} unread for user {self.user_id}"
+
+    @classmethod
+    def for_user(cls, user_id):
+        try:
+            return cls.objects.get(user_id=user_id).value
+        except cls.DoesNotExist:
+            pass
+        with transaction.atomic():
+            cls.objects.get_or_create(user_id=user_id)
+            value = Notification.objects.filter(user_id=user_id, read=False).count()
+            cls.objects.filter(user_id=user_id).update(value=value)
+        return value
+
+    @classmethod
+    def bump(cls, deltas):
+        """Apply ``{user id: delta}`` to the existing counters with one UPDATE."""
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        if len(deltas) == 1:
+            change = Value(next(iter(deltas.values())))
+        else:
+            change = Case(
+                *(When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()),
+                default=Value(0),
+            )
+        cls.objects.filter(user_id__in=deltas).update(
+            value=F('value') + change, updated_at=timezone.now()
         )
 
+    @classmethod
+    def reset(cls, user_id):
+        cls.objects.filter(user_id=user_id).update(value=0, updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=Notification)
+def escape_email_notification(sender, instance, **kwargs):
+    """
+    Escape the content of new email notifications before they are stored
+    """
+    if instance._state.adding:
+        _escape_email_content(instance)
+
+
 @receiver(post_save, sender=Notification)
 def send_email_notification(sender, instance, created, **kwargs):
     """
-    Signal to automatically send email when a notification with type='email' is created
+    Queue an email when a notification with type='email' is created
     """
     # Only process newly created notifications with type='email' that haven't been sent yet
     if created and instance.type == 'email' and not instance.email_sent:
-        # Import here to avoid circular imports
-        from .email_service import EmailService
-        from django.utils import timezone
-        
-        logger.info(f"Attempting to send email for notification {instance.id} to {instance.user.email}")
-        
-        # asiguram continutul impotriva XSS
-        instance.title = escape(instance.title)
-        instance.message = escape(instance.message)
-        
-        # Attempt to send email
-        email_success = EmailService.send_notification_email(instance)
-        
-        # Update the notification record with email status
-        if email_success:
-            instance.email_sent = True
-            instance.email_sent_at = timezone.now()
-            logger.info(f"Email sent successfully for notification {instance.id}")
-        else:
-            instance.email_sent = False
-            logger.error(f"Failed to send email for notification {instance.id}")
-        
-        # Save the updated status (use update to avoid triggering the signal again)
-        Notification.objects.filter(id=instance.id).update(
-            email_sent=instance.email_sent,
-            email_sent_at=instance.email_sent_at,
-            title=instance.title,      # salvam versiunea sigura
-            message=instance.message   # salvam versiunea sigura
-        )
+        # Delivered by the drain_outbox worker once this transaction commits
+        OutboxMessage.queue([instance])
+        logger.info(f"Queued email for notification {instance.id}")
+
+
+@receiver(post_save, sender=Notification)
+def count_unread_on_save(sender, instance, created, **kwargs):
+    """Keep the unread counter in step with new notifications and read changes"""
+    if created:
+        if not instance.read:
+            UnreadCounter.bump({instance.user_id: 1})
+    else:
+        loaded_read = getattr(instance, '_loaded_read', None)
+        if loaded_read is not None and loaded_read != instance.read:
+            UnreadCounter.bump({instance.user_id: -1 if instance.read else 1})
+    instance._loaded_read = instance.read
+
+
+@receiver(post_save, sender=Notification)
+def publish_new_notification(sender, instance, created, **kwargs):
+    """Wake the user's long-poll requests, see notifications.broker"""
+    if created:
+        _publish_on_commit({instance.user_id})
+
+
+@receiver(post_delete, sender=Notification)
+def count_unread_on_delete(sender, instance, **kwargs):
+    if not getattr(instance, '_loaded_read', instance.read):
+        UnreadCounter.bump({instance.user_id: -1})
@@ -0,0 +1,209 @@
+"""
+Delivery of queued notification e-mails.
+
+Notifications with type='email' get an OutboxMessage row in the transaction
+that creates them. ``drain`` runs outside any request: it claims a batch of
+due messages in one short write transaction, sends them over a pooled SMTP
+connection (notifications.smtp_pool) with no database transaction open, then
+records the outcomes in another short transaction.
+
+A claimed message is hidden from other workers for LEASE seconds, so a
+worker that dies mid-batch only delays its messages. Failed deliveries are
+retried with exponential backoff and dead-lettered after MAX_ATTEMPTS.
+Messages not sent because the circuit breaker is open or the pool has no
+free connection were never tried: they wait for the circuit to reset and
+get their attempt back, so an SMTP outage cannot dead-letter them.
+
+Messages of users in digest mode are queued with ``available_at`` at the end
+of the user's digest window (see OutboxMessage.queue), so they come due
+together and ``deliver`` sends them as a single email.
+"""
+
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .email_service import EmailService
+from .models import Notification, OutboxMessage
+from .smtp_pool import CircuitOpen, PoolExhausted, get_email_sender
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 30,   # seconds before the first retry, doubled on each attempt
+    'BACKOFF_MAX': 3600,
+    'LEASE': 300,         # seconds a claimed message stays hidden from other workers
+}
+
+
+def outbox_setting(name):
+    return getattr(settings, 'NOTIFICATION_OUTBOX', {}).get(name, DEFAULTS[name])
+
+
+def backoff(attempts):
+    """Delay before retrying a message that has failed ``attempts`` times."""
+    delay = outbox_setting('BACKOFF_BASE') * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, outbox_setting('BACKOFF_MAX')))
+
+
+def claim(batch_size, now=None):
+    """Lease up to ``batch_size`` due messages to the caller."""
+    now = now or timezone.now()
+    due = list(
+        OutboxMessage.objects.filter(status=OutboxMessage.PENDING, available_at__lte=now)
+        .order_by('available_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not due:
+        return []
+
+    lease_until = now + timedelta(seconds=outbox_setting('LEASE'))
+    claimed = []
+    with transaction.atomic():
+        for message_id in due:
+            # Another worker may have claimed the message since it was read
+            if OutboxMessage.objects.filter(
+                id=message_id, status=OutboxMessage.PENDING, available_at__lte=now
+            ).update(available_at=lease_until, attempts=F('attempts') + 1):
+                claimed.append(message_id)
+
+    return list(
+        OutboxMessage.objects.filter(id__in=claimed)
+        .select_related('notification__user')
+        .order_by('id')
+    )
+
+
+def deliver(messages):
+    """
+    Send ``messages`` through the pooled SMTP sender
+
+    Digest messages of the same user are sent as one email and share its
+    outcome. Returns ``{message id: None}`` for delivered messages and
+    ``{message id: (error, retry)}`` for failed ones; messages that can never
+    be delivered (e.g. no recipient address) are not retried (``retry`` is
+    False). When the mail server was not tried at all ``retry`` is the
+    timedelta to wait before the message is due again.
+    """
+    outcomes = {}
+    # tuple of message ids -> the email carrying them
+    emails = {}
+    single = []
+    digests = {}
+    for message in messages:
+        if message.digest:
+            digests.setdefault(message.notification.user_id, []).append(message)
+        else:
+            single.append(message)
+    for group in digests.values():
+        if len(group) == 1:
+            single.extend(group)
+            continue
+        ids = tuple(message.id for message in group)
+        try:
+            emails[ids] = EmailService.build_digest_email([message.notification for message in group])
+        except ValueError as e:
+            outcomes.update((message_id, (str(e), False)) for message_id in ids)
+
+    built = EmailService.build_notification_emails([message.notification for message in single])
+    for message, email in zip(single, built):
+        if isinstance(email, ValueError):
+            outcomes[message.id] = (str(email), False)
+        else:
+            emails[(message.id,)] = email
+    if not emails:
+        return outcomes
+
+    sender = get_email_sender()
+    try:
+        results = sender.send(list(emails.values()))
+    except (CircuitOpen, PoolExhausted) as e:
+        logger.error(f"Mail server unavailable, batch postponed: {str(e)}")
+        results = [e] * len(emails)
+
+    for ids, error in zip(emails, results):
+        if error is None:
+            outcome = None
+        elif isinstance(error, (CircuitOpen, PoolExhausted)):
+            # Netrimis: asteapta resetarea circuitului, incercarea nu se numara
+            outcome = (str(error), timedelta(seconds=sender.breaker.retry_after() + 1))
+        else:
+            # A refused recipient will be refused again
+            retry = not isinstance(error, smtplib.SMTPRecipientsRefused)
+            outcome = (str(error) or error.__class__.__name__, retry)
+        outcomes.update((message_id, outcome) for message_id in ids)
+    return outcomes
+
+
+def record(messages, outcomes, now=None):
+    """Store delivery outcomes; returns counts of sent, retried and dead messages."""
+    now = now or timezone.now()
+    max_attempts = outbox_setting('MAX_ATTEMPTS')
+    counts = {'sent': 0, 'retried': 0, 'dead': 0}
+
+    with transaction.atomic():
+        for message in messages:
+            outcome = outcomes.get(message.id)
+            if outcome is None:
+                OutboxMessage.objects.filter(id=message.id).update(
+                    status=OutboxMessage.SENT, sent_at=now, last_error=''
+                )
+                Notification.objects.filter(id=message.notification_id).update(
+                    email_sent=True, email_sent_at=now
+                )
+                counts['sent'] += 1
+                continue
+
+            error, retry = outcome
+            if isinstance(retry, timedelta):
+                # claim() counted an attempt that never reached the mail server
+                OutboxMessage.objects.filter(id=message.id).update(
+                    available_at=now + retry, attempts=F('attempts') - 1, last_error=error
+                )
+                logger.warning(f"Outbox message {message.id} postponed: {error}")
+                counts['retried'] += 1
+                continue
+            if not retry or message.attempts >= max_attempts:
+                OutboxMessage.objects.filter(id=message.id).update(
+                    status=OutboxMessage.DEAD, last_error=error
+                )
+                logger.error(
+                    f"Outbox message {message.id} dead after {message.attempts} attempts: {error}"
+                )
+                counts['dead'] += 1
+            else:
+                OutboxMessage.objects.filter(id=message.id).update(
+                    available_at=now + backoff(message.attempts), last_error=error
+                )
+                logger.warning(f"Outbox message {message.id} failed, will retry: {error}")
+                counts['retried'] += 1
+    return counts
+
+
+def drain(batch_size=None, max_batches=None):
+    """
+    Deliver due messages until none are left or ``max_batches`` ran
+
+    Returns the number of sent, retried and dead messages.
+    """
+    batch_size = batch_size or outbox_setting('BATCH_SIZE')
+    totals = {'sent': 0, 'retried': 0, 'dead': 0}
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        messages = claim(batch_size)
+        if not messages:
+            break
+        outcomes = deliver(messages)
+        for name, count in record(messages, outcomes).items():
+            totals[name] += count
+        batches += 1
+
+    return totals
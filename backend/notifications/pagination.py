@@ -0,0 +1,6 @@
+from appointments.pagination import OptionalCursorPagination
+
+
+class NotificationCursorPagination(OptionalCursorPagination):
+    """Inbox pages, newest first, keyed on (created_at, id)."""
+    ordering = ('-created_at', '-id')
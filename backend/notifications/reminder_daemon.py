@@ -0,0 +1,225 @@
+"""
+Long-running reminder dispatcher.
+
+Instead of querying the appointments table every minute from cron, the
+daemon keeps the reminder deadlines of the next HORIZON seconds in a heap
+and sleeps until the earliest one, so reminders go out within a second of
+``reminder_due_at``. It learns about new, moved and cancelled appointments
+by reading the ReminderChange log past the last id it has seen, which is a
+primary key range read every POLL_INTERVAL seconds. Deadlines further out
+are picked up by a refill of the horizon every HORIZON / 2 seconds.
+
+Only the daemon holding the SchedulerLease row sends reminders; others wait
+in standby and take over when the lease expires.
+"""
+
+import heapq
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from appointments.models import Appointment
+from .models import ReminderChange, SchedulerLease
+from .scheduler import due_reminders, send_due_reminders
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'reminders'
+
+DEFAULTS = {
+    'HORIZON': 6 * 3600,    # seconds of upcoming deadlines kept in memory
+    'POLL_INTERVAL': 2,     # seconds between reads of the change log
+    'LEASE_TTL': 30,        # seconds a lease stays valid without renewal
+    'BATCH_SIZE': 100,      # reminders sent per batch
+}
+
+
+def daemon_setting(name):
+    return getattr(settings, 'REMINDER_DAEMON', {}).get(name, DEFAULTS[name])
+
+
+def default_holder():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class ReminderDaemon:
+    """Heap of upcoming reminder deadlines fed by the ReminderChange log."""
+
+    def __init__(self, holder=None, horizon=None, poll_interval=None, lease_ttl=None,
+                 batch_size=None, clock=timezone.now):
+        self.holder = holder or default_holder()
+        self.horizon = timedelta(seconds=horizon or daemon_setting('HORIZON'))
+        self.poll_interval = timedelta(seconds=poll_interval or daemon_setting('POLL_INTERVAL'))
+        self.lease_ttl = timedelta(seconds=lease_ttl or daemon_setting('LEASE_TTL'))
+        self.batch_size = batch_size or daemon_setting('BATCH_SIZE')
+        self.clock = clock
+        self._stop = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self._heap = []
+        # appointment id -> deadline currently scheduled; heap entries that
+        # do not match it are stale and skipped when popped
+        self._deadlines = {}
+        self._cursor = None
+        self._next_poll = None
+        self._next_refill = None
+        self._lease_until = None
+
+    # Lease
+
+    def acquire_lease(self, now):
+        """Take or renew the lease; returns whether this daemon holds it."""
+        expires_at = now + self.lease_ttl
+        renewed = SchedulerLease.objects.filter(
+            Q(holder=self.holder) | Q(expires_at__lte=now), name=LEASE_NAME
+        ).update(holder=self.holder, expires_at=expires_at)
+        if not renewed:
+            try:
+                with transaction.atomic():
+                    SchedulerLease.objects.create(
+                        name=LEASE_NAME, holder=self.holder, expires_at=expires_at
+                    )
+            except IntegrityError:
+                # Held by another daemon
+                return False
+        self._lease_until = expires_at
+        return True
+
+    def release_lease(self):
+        SchedulerLease.objects.filter(name=LEASE_NAME, holder=self.holder).delete()
+        self._lease_until = None
+
+    # Deadlines
+
+    def load(self, now):
+        """(Re)load every deadline inside the horizon."""
+        # Read the cursor first so changes made while loading are replayed
+        cursor = ReminderChange.objects.aggregate(last=Max('id'))['last'] or 0
+        self._heap = []
+        self._deadlines = {}
+        rows = Appointment.objects.filter(
+            status='confirmed', reminder_sent=False,
+            reminder_due_at__lte=now + self.horizon,
+        ).values_list('id', 'reminder_due_at')
+        for appointment_id, due_at in rows:
+            self._schedule(appointment_id, due_at)
+        if self._cursor is None:
+            self._cursor = cursor
+            # Logged while no daemon was active, already covered by this load
+            ReminderChange.objects.filter(id__lte=cursor).delete()
+        self._next_refill = now + self.horizon / 2
+        self._next_poll = now + self.poll_interval
+        logger.info(f"Reminder daemon loaded {len(self._deadlines)} deadlines")
+
+    def poll_changes(self, now):
+        """Apply logged changes past the cursor; returns how many were read."""
+        changes = list(
+            ReminderChange.objects.filter(id__gt=self._cursor)
+            .order_by('id').values_list('id', 'appointment_id')[:1000]
+        )
+        self._next_poll = now + self.poll_interval
+        if not changes:
+            return 0
+
+        changed_ids = {appointment_id for _, appointment_id in changes}
+        current = dict(
+            Appointment.objects.filter(
+                id__in=changed_ids, status='confirmed', reminder_sent=False,
+                reminder_due_at__lte=now + self.horizon,
+            ).values_list('id', 'reminder_due_at')
+        )
+        for appointment_id in changed_ids:
+            due_at = current.get(appointment_id)
+            if due_at is None:
+                # Cancelled, reminded, moved past the horizon or turned off
+                self._deadlines.pop(appointment_id, None)
+            else:
+                self._schedule(appointment_id, due_at)
+
+        self._cursor = changes[-1][0]
+        # Only the lease holder reads the log, processed rows can go
+        ReminderChange.objects.filter(id__lte=self._cursor).delete()
+        return len(changes)
+
+    def _schedule(self, appointment_id, due_at):
+        if self._deadlines.get(appointment_id) == due_at:
+            return
+        self._deadlines[appointment_id] = due_at
+        heapq.heappush(self._heap, (due_at, appointment_id))
+
+    def next_deadline(self):
+        while self._heap:
+            due_at, appointment_id = self._heap[0]
+            if self._deadlines.get(appointment_id) == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    def fire(self, now):
+        """Send every reminder due by ``now``; returns the ids reminded."""
+        due = []
+        while self.next_deadline() is not None and self._heap[0][0] <= now:
+            _, appointment_id = heapq.heappop(self._heap)
+            del self._deadlines[appointment_id]
+            due.append(appointment_id)
+
+        sent = []
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            # Re-checked against the database, memory may lag behind the log
+            appointments = due_reminders(now).filter(id__in=batch).order_by('reminder_due_at')
+            sent.extend(send_due_reminders(appointments, now))
+        if due:
+            logger.info(f"Reminder daemon fired {len(sent)} of {len(due)} due reminders")
+        return sent
+
+    # Loop
+
+    def step(self, now=None):
+        """
+        Run one iteration; returns the number of seconds to sleep before the
+        next one
+        """
+        now = now or self.clock()
+        if self._lease_until is None or now >= self._lease_until - self.lease_ttl / 2:
+            if not self.acquire_lease(now):
+                if self._lease_until is not None:
+                    logger.warning("Reminder daemon lost its lease, going to standby")
+                self._reset()
+                return self.lease_ttl.total_seconds() / 2
+
+        if self._next_refill is None or now >= self._next_refill:
+            self.load(now)
+        elif now >= self._next_poll:
+            self.poll_changes(now)
+
+        self.fire(now)
+
+        wake_at = min(
+            self._next_poll, self._next_refill, self._lease_until - self.lease_ttl / 2
+        )
+        next_deadline = self.next_deadline()
+        if next_deadline is not None:
+            wake_at = min(wake_at, next_deadline)
+        return max((wake_at - now).total_seconds(), 0)
+
+    def run(self):
+        logger.info(f"Reminder daemon {self.holder} started")
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(self.step())
+        finally:
+            if self._lease_until is not None:
+                self.release_lease()
+            logger.info(f"Reminder daemon {self.holder} stopped")
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,206 @@
+"""
+Retention of notifications and their bookkeeping rows.
+
+Notifications share the SQLite file, and its single write lock, with
+bookings. The purge therefore deletes in chunks of CHUNK_SIZE rows, each in
+its own short transaction, and sleeps PAUSE seconds between chunks so
+booking writes can get in.
+
+NOTIFICATION_RETENTION['POLICIES'] maps a policy name to the notifications
+it covers (``filter``, keyword arguments for Notification.objects.filter,
+or a list of them to match any) and their age in ``days``. Matching
+notifications are deleted. With ``summarize`` they are first collapsed into
+one read system notification per user and calendar month, so only whole
+months are summarized.
+
+Sent and dead outbox rows and the ReminderChange log are purged after
+OUTBOX_DAYS and REMINDER_LOG_DAYS. Deleted rows do not shrink the SQLite
+file, the pages go to its freelist; the report includes the bytes freed
+and ``vacuum`` gives them back to the filesystem.
+"""
+
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Notification, OutboxMessage, ReminderChange, UnreadCounter
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    'PAUSE': 0.05,            # seconds between chunks, lets bookings take the write lock
+    'POLICIES': {},
+    'OUTBOX_DAYS': 30,
+    'REMINDER_LOG_DAYS': 7,
+}
+
+
+def retention_setting(name):
+    return getattr(settings, 'NOTIFICATION_RETENTION', {}).get(name, DEFAULTS[name])
+
+
+def month_start(moment):
+    """Local midnight of the first day of ``moment``'s month."""
+    return timezone.localtime(moment).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start):
+    return month_start(start + timedelta(days=32))
+
+
+def freelist_bytes():
+    """Bytes of free pages in the SQLite file, None on other databases."""
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA freelist_count')
+        pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return pages * cursor.fetchone()[0]
+
+
+class Purge:
+    """One retention run; ``run`` returns the rows removed per policy and table."""
+
+    def __init__(self, chunk_size=None, pause=None, dry_run=False, now=None):
+        self.chunk_size = chunk_size or retention_setting('CHUNK_SIZE')
+        self.pause = retention_setting('PAUSE') if pause is None else pause
+        self.dry_run = dry_run
+        self.now = now or timezone.now()
+
+    def run(self):
+        free_before = freelist_bytes()
+        report = {'policies': {}}
+        for name, policy in retention_setting('POLICIES').items():
+            report['policies'][name] = self.apply_policy(policy)
+
+        report['outbox'] = self._purge(
+            OutboxMessage.objects.filter(
+                status__in=[OutboxMessage.SENT, OutboxMessage.DEAD],
+                created_at__lt=self.now - timedelta(days=retention_setting('OUTBOX_DAYS')),
+            ),
+            order_by=('created_at', 'id'),
+        )
+        report['reminder_log'] = self._purge(
+            ReminderChange.objects.filter(
+                created_at__lt=self.now - timedelta(days=retention_setting('REMINDER_LOG_DAYS')),
+            ),
+            order_by=('id',),
+        )
+
+        free_after = freelist_bytes()
+        report['bytes'] = None if free_before is None else max(free_after - free_before, 0)
+        return report
+
+    def apply_policy(self, policy):
+        cutoff = self.now - timedelta(days=policy['days'])
+        filters = policy.get('filter', {})
+        if isinstance(filters, dict):
+            filters = [filters]
+        queryset = Notification.objects.filter(reduce(or_, (Q(**f) for f in filters)))
+        if policy.get('summarize'):
+            return self._summarize(queryset.filter(created_at__lt=month_start(cutoff)))
+        return {'deleted': self._purge(
+            queryset.filter(created_at__lt=cutoff),
+            order_by=('created_at', 'id'),
+            delete=self._delete_notifications,
+        )}
+
+    def _purge(self, queryset, order_by, delete=None):
+        """Delete ``queryset`` a chunk at a time; returns the rows deleted."""
+        if self.dry_run:
+            return queryset.count()
+        model = queryset.model
+        deleted = 0
+        while True:
+            ids = list(queryset.order_by(*order_by).values_list('id', flat=True)[:self.chunk_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                if delete:
+                    delete(ids)
+                else:
+                    model.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+            if len(ids) < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return deleted
+
+    def _summarize(self, queryset):
+        """Replace ``queryset`` with one summary per user and month."""
+        groups = list(
+            queryset.annotate(month=TruncMonth('created_at'))
+            .values('user_id', 'month')
+            .annotate(count=Count('id'))
+            .order_by('month', 'user_id')
+        )
+        if self.dry_run:
+            return {'deleted': sum(g['count'] for g in groups), 'summaries': len(groups)}
+
+        deleted = 0
+        chunk = []
+        for position, group in enumerate(groups, 1):
+            chunk.append(group)
+            if sum(g['count'] for g in chunk) < self.chunk_size and position < len(groups):
+                continue
+            with transaction.atomic():
+                deleted += self._summarize_chunk(queryset, chunk)
+            chunk = []
+            if position < len(groups):
+                time.sleep(self.pause)
+        return {'deleted': deleted, 'summaries': len(groups)}
+
+    def _summarize_chunk(self, queryset, groups):
+        matches = Q()
+        summaries = []
+        for group in groups:
+            start = month_start(group['month'])
+            matches |= Q(user_id=group['user_id'], created_at__gte=start,
+                         created_at__lt=next_month(start))
+            summaries.append(Notification(
+                user_id=group['user_id'],
+                type='system',
+                template='reminder_summary',
+                params={'count': group['count'], 'month': f'{start:%B %Y}'},
+                read=True,
+            ))
+        ids = list(queryset.filter(matches).values_list('id', flat=True))
+        self._delete_notifications(ids)
+        Notification.create_many(summaries)
+        return len(ids)
+
+    @staticmethod
+    def _delete_notifications(ids):
+        # Citite inainte de stergere: post_delete nu mai ajusteaza contorul rand cu rand
+        unread = Counter(
+            Notification.objects.filter(id__in=ids, read=False).values_list('user_id', flat=True)
+        )
+        if unread:
+            Notification.objects.filter(id__in=ids, read=False).update(read=True)
+            UnreadCounter.bump({user_id: -count for user_id, count in unread.items()})
+        Notification.objects.filter(id__in=ids).delete()
+
+
+def purge(**kwargs):
+    """Apply the retention settings; see Purge."""
+    report = Purge(**kwargs).run()
+    logger.info(f"Notification retention: {report}")
+    return report
+
+
+def vacuum():
+    """Give free SQLite pages back to the filesystem; takes the write lock."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM')
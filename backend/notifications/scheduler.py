@@ -1,59 +1,69 @@
 import logging
-from datetime import datetime, timedelta
 
+from django.db import transaction
 from django.utils import timezone
 
 from appointments.models import Appointment
-from authentication.models import NotificationPreferences
+from appointments.reminders import slot_start
 from .models import Notification
 
 logger = logging.getLogger(__name__)
 
+# Reminders created per transaction
+REMINDER_BATCH_SIZE = 100
+
+
+def due_reminders(now):
+    """Confirmed appointments whose reminder is due and not yet sent."""
+    return Appointment.objects.filter(
+        status="confirmed",
+        reminder_sent=False,
+        reminder_due_at__lte=now,
+    ).select_related("patient__user", "doctor__user", "schedule")
+
 
 def dispatch_upcoming_appointment_reminders():
-    """Send reminder emails for appointments based on user preferences.
+    """Send reminder emails for appointments whose reminder is due.
 
     This function can be executed periodically (e.g. via ``cron`` or
     ``django-crontab``) to deliver reminders without requiring Celery.
-    For each confirmed appointment the user's :class:`NotificationPreferences`
-    are checked and, if appropriate, an email reminder is sent.
+    ``Appointment.reminder_due_at`` already reflects each patient's
+    :class:`NotificationPreferences`, so a single indexed query returns the
+    confirmed appointments due for a reminder. A late or skipped run sends
+    the reminders on the next one; appointments that have already started
+    are dropped instead. ``manage.py run_reminder_daemon`` is the
+    long-running alternative to calling this from cron.
     """
     now = timezone.now()
-    window_end = now + timedelta(days=2)
-    appointments = (
-        Appointment.objects.filter(
-            status="confirmed",
-            reminder_sent=False,
-            schedule__date__range=(now.date(), window_end.date()),
-        ).select_related("patient__user", "doctor__user", "schedule")
-    )
+    appointments = due_reminders(now).order_by("reminder_due_at")
+    return send_due_reminders(appointments, now)
+
 
+def send_due_reminders(appointments, now):
+    """Send the reminders of ``appointments``; returns the ids reminded."""
+    due = []
+    past = []
     for appointment in appointments:
-        user = appointment.patient.user
-
-        try:
-            prefs = NotificationPreferences.objects.get(user=user)
-        except NotificationPreferences.DoesNotExist:
-            continue
-
-        # Skip if email notifications are disabled or reminders are turned off
-        if not (prefs.email_enabled and prefs.appointment_reminders):
-            continue
-
-        schedule_dt = datetime.combine(
-            appointment.schedule.date, appointment.schedule.start_time
-        )
-        schedule_dt = timezone.make_aware(schedule_dt, timezone.get_current_timezone())
-        reminder_time = schedule_dt - timedelta(hours=prefs.reminder_hours_before)
-
-        # Send the reminder if we are within the target minute
-        if reminder_time <= now < reminder_time + timedelta(minutes=1):
-            Notification.send_appointment_reminder(appointment)
-            appointment.reminder_sent = True
-            appointment.save(update_fields=["reminder_sent"])
+        # Too late to remind, take it out of the due set
+        (past if slot_start(appointment.schedule) <= now else due).append(appointment)
+
+    if past:
+        Appointment.objects.filter(pk__in=[a.pk for a in past]).update(reminder_due_at=None)
+        logger.info("Skipped reminders for %s past appointments", len(past))
+
+    sent = []
+    for start in range(0, len(due), REMINDER_BATCH_SIZE):
+        batch = due[start:start + REMINDER_BATCH_SIZE]
+        ids = [appointment.pk for appointment in batch]
+        # The notifications (and their queued emails) and the flags commit together
+        with transaction.atomic():
+            Notification.send_appointment_reminders(batch)
+            Appointment.objects.filter(pk__in=ids).update(reminder_sent=True)
+        sent.extend(ids)
+        for appointment in batch:
             logger.info(
                 "Dispatched reminder for appointment %s to %s",
                 appointment.id,
-                user.email,
+                appointment.patient.user.email,
             )
-
+    return sent
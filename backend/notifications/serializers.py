@@ -14,5 +14,15 @@ class NotificationSerializer(serializers.ModelSerializer):
             'read',
             'email_sent',
             'email_sent_at',
+            'template',
+            'params',
         ]
-        read_only_fields = ['id', 'created_at', 'user', 'email_sent', 'email_sent_at']
+        read_only_fields = [
+            'id', 'created_at', 'user', 'email_sent', 'email_sent_at', 'template', 'params',
+        ]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.template:
+            data['title'], data['message'] = instance.render()
+        return data
@@ -0,0 +1,350 @@
+"""
+Pooled SMTP sender.
+
+Opening an SMTP connection costs a TCP connect, a TLS handshake and a
+login, which dominates the cost of a short notification email. The sender
+keeps up to EMAIL_POOL['SIZE'] authenticated connections open and sends
+every batch of messages over one of them.
+
+A connection that drops is reopened once and the failed message retried on
+it. Repeated connection failures open a circuit breaker: for RESET_TIMEOUT
+seconds callers get CircuitOpen immediately instead of waiting on a dead
+host, then a single trial batch decides whether the circuit closes again.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZE': 2,
+    'BATCH_SIZE': 50,
+    'ACQUIRE_TIMEOUT': 10,    # seconds to wait for a free connection
+    'MAX_IDLE': 60,           # seconds before an idle connection is reopened
+    'FAILURE_THRESHOLD': 3,   # consecutive connection failures that open the circuit
+    'RESET_TIMEOUT': 30,      # seconds the circuit stays open
+}
+
+# Errors that concern one message; the connection stays usable
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+    smtplib.SMTPNotSupportedError,
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending while the SMTP host is considered down."""
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection frees up within ACQUIRE_TIMEOUT."""
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` failures -> half-open after ``reset_timeout``."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self):
+        """Seconds until the open circuit lets a trial batch through, 0 otherwise."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(self.reset_timeout - (self._clock() - self._opened_at), 0)
+
+    def allow(self):
+        """Raise CircuitOpen unless the caller may talk to the SMTP host."""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_running:
+                # Let one caller probe the host
+                self._trial_running = True
+                return
+        raise CircuitOpen('SMTP host unavailable, not sending until the circuit resets.')
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def cancel_trial(self):
+        """Give the half-open probe back when a caller failed for another reason."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    logger.error(f"SMTP circuit opened after {self._failures} failures")
+                self._opened_at = self._clock()
+            self._trial_running = False
+
+
+class _PooledConnection:
+    __slots__ = ('backend', 'last_used')
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Bounded pool of open email backend connections."""
+
+    def __init__(self, size=2, acquire_timeout=10, max_idle=60, **backend_kwargs):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self.backend_kwargs = backend_kwargs
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+        self.opened = 0
+
+    @contextmanager
+    def connection(self):
+        """Yield an open connection, returned to the pool afterwards."""
+        pooled = self._acquire()
+        try:
+            if time.monotonic() - pooled.last_used > self.max_idle:
+                # The server has probably dropped it already
+                self.reconnect(pooled)
+            else:
+                self._open(pooled)
+            yield pooled
+        except BaseException:
+            self._discard(pooled)
+            raise
+        else:
+            pooled.last_used = time.monotonic()
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+
+    def reconnect(self, pooled):
+        self._close(pooled)
+        self._open(pooled)
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._condition.notify_all()
+        for pooled in idle:
+            self._close(pooled)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                if self._idle:
+                    # Most recently used first, it is the most likely to be alive
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted('No SMTP connection became free in time.')
+                self._condition.wait(remaining)
+
+        try:
+            return _PooledConnection(get_connection(fail_silently=False, **self.backend_kwargs))
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def _open(self, pooled):
+        if pooled.backend.open():
+            self.opened += 1
+
+    def _discard(self, pooled):
+        self._close(pooled)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._condition:
+            self._created -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.backend.close()
+        except Exception:
+            # close() already drops the socket, the QUIT reply is irrelevant
+            pass
+
+
+class PooledEmailSender:
+    """
+    Send email batches over pooled connections, with reconnects, a circuit
+    breaker and per-batch throughput metrics
+    """
+
+    def __init__(self, size=2, batch_size=50, acquire_timeout=10, max_idle=60,
+                 failure_threshold=3, reset_timeout=30, history=50, **backend_kwargs):
+        self.batch_size = batch_size
+        self.pool = SMTPConnectionPool(
+            size=size, acquire_timeout=acquire_timeout, max_idle=max_idle, **backend_kwargs
+        )
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._lock = threading.Lock()
+        self._batches = deque(maxlen=history)
+        self._totals = {'batches': 0, 'messages': 0, 'sent': 0, 'failed': 0, 'reconnects': 0}
+
+    def send(self, messages):
+        """
+        Send ``messages`` in batches of ``batch_size``
+
+        Returns one entry per message: None when sent, the error otherwise.
+        Raises CircuitOpen if the circuit is open before the first batch.
+        """
+        results = []
+        for start in range(0, len(messages), self.batch_size):
+            batch = messages[start:start + self.batch_size]
+            try:
+                results.extend(self.send_batch(batch))
+            except (CircuitOpen, PoolExhausted) as e:
+                if not results:
+                    raise
+                results.extend([e] * len(batch))
+        return results
+
+    def send_batch(self, messages):
+        """Send ``messages`` over one connection; see ``send``."""
+        if not messages:
+            return []
+        self.breaker.allow()
+
+        started = time.monotonic()
+        results = []
+        reconnects = 0
+        try:
+            with self.pool.connection() as pooled:
+                for message in messages:
+                    try:
+                        results.append(self._send_one(pooled, message))
+                    except MESSAGE_ERRORS as e:
+                        results.append(e)
+                    except OSError as e:
+                        # Dropped connection: reopen once and retry the message
+                        logger.warning(f"SMTP connection lost, reconnecting: {str(e)}")
+                        reconnects += 1
+                        self.pool.reconnect(pooled)
+                        try:
+                            results.append(self._send_one(pooled, message))
+                        except MESSAGE_ERRORS as retry_error:
+                            results.append(retry_error)
+        except OSError as e:
+            # The host is unreachable, every unsent message fails with it
+            results.extend([e] * (len(messages) - len(results)))
+            self.breaker.record_failure()
+        except BaseException:
+            self.breaker.cancel_trial()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            self._record_batch(messages, results, time.monotonic() - started, reconnects)
+
+        return results
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._totals,
+                circuit=self.breaker.state,
+                connections_opened=self.pool.opened,
+                last_batches=list(self._batches)[-10:],
+            )
+
+    def close(self):
+        self.pool.close_all()
+
+    @staticmethod
+    def _send_one(pooled, message):
+        if pooled.backend.send_messages([message]):
+            return None
+        return smtplib.SMTPRecipientsRefused({})
+
+    def _record_batch(self, messages, results, seconds, reconnects):
+        sent = sum(1 for result in results if result is None)
+        metrics = {
+            'messages': len(messages),
+            'sent': sent,
+            'seconds': round(seconds, 4),
+            'per_second': round(sent / seconds, 1) if seconds > 0 else None,
+            'reconnects': reconnects,
+        }
+        with self._lock:
+            self._batches.append(metrics)
+            self._totals['batches'] += 1
+            self._totals['messages'] += len(messages)
+            self._totals['sent'] += sent
+            self._totals['failed'] += len(messages) - sent
+            self._totals['reconnects'] += reconnects
+        logger.info(
+            f"SMTP batch: {sent}/{len(messages)} sent in {metrics['seconds']}s "
+            f"({metrics['per_second']} msg/s), {reconnects} reconnects"
+        )
+
+
+_email_sender = None
+_email_sender_lock = threading.Lock()
+
+
+def get_email_sender():
+    """Return the process-wide sender configured from settings.EMAIL_POOL."""
+    global _email_sender
+    if _email_sender is None:
+        with _email_sender_lock:
+            if _email_sender is None:
+                config = dict(DEFAULTS, **getattr(settings, 'EMAIL_POOL', {}))
+                _email_sender = PooledEmailSender(
+                    size=config['SIZE'],
+                    batch_size=config['BATCH_SIZE'],
+                    acquire_timeout=config['ACQUIRE_TIMEOUT'],
+                    max_idle=config['MAX_IDLE'],
+                    failure_threshold=config['FAILURE_THRESHOLD'],
+                    reset_timeout=config['RESET_TIMEOUT'],
+                )
+    return _email_sender
@@ -1,12 +1,35 @@
+import socket
+import socketserver
+import threading
+import time
+from io import StringIO
+from smtplib import SMTPException, SMTPRecipientsRefused
+
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase, APIClient
 from unittest.mock import patch
 from django.utils import timezone
 from datetime import timedelta, datetime
 
-from .models import Notification
+from .broker import NotificationBroker, get_notification_broker
+from .models import Notification, OutboxMessage, ReminderChange, SchedulerLease, UnreadCounter
+from .reminder_daemon import ReminderDaemon
+from .email_rendering import get_email_renderer
+from .email_service import EmailService
+from .messages import compiled
+from .outbox import drain
+from .retention import Purge
+from .smtp_pool import CircuitBreaker, CircuitOpen, PooledEmailSender
 from .scheduler import dispatch_upcoming_appointment_reminders
+from .views import NotificationViewSet
 from appointments.models import Appointment
+from appointments.querycount import QueryBudgetTestMixin
 from authentication.models import NotificationPreferences
 from patients.models import Patient
 from doctors.models import Doctor, Schedule
@@ -19,7 +42,7 @@ class NotificationTests(APITestCase):
         self.client.force_authenticate(user=self.user)
 
     @patch("notifications.email_service.EmailService.send_notification_email", return_value=True)
-    def test_email_sent_on_create(self, mock_send):
+    def test_email_queued_on_create(self, mock_send):
         notification = Notification.objects.create(
             user=self.user,
             type="email",
@@ -27,9 +50,116 @@ class NotificationTests(APITestCase):
             message="World",
         )
         notification.refresh_from_db()
-        self.assertTrue(notification.email_sent)
-        self.assertIsNotNone(notification.email_sent_at)
-        mock_send.assert_called_once()
+        self.assertFalse(notification.email_sent)
+        mock_send.assert_not_called()
+        message = OutboxMessage.objects.get(notification=notification)
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+
+    def test_create_many_matches_create(self):
+        single = Notification.objects.create(
+            user=self.user, type="email", title="<b>Hi</b>", message="a & b",
+        )
+        # Notifications, the unread counter, digest preferences and the outbox rows
+        with self.assertNumQueries(4):
+            created = Notification.create_many([
+                Notification(user=self.user, type="email", title="<b>Hi</b>", message="a & b")
+                for _ in range(30)
+            ] + [Notification(user=self.user, type="system", title="<b>Hi</b>", message="a & b")])
+        self.assertEqual(len(created), 31)
+        stored = Notification.objects.get(pk=created[0].pk)
+        self.assertEqual((stored.title, stored.message), (single.title, single.message))
+        self.assertEqual(Notification.objects.get(pk=created[-1].pk).title, "<b>Hi</b>")
+        self.assertEqual(OutboxMessage.objects.count(), 1 + 30)
+
+    def test_templated_notification_renders_on_read(self):
+        self.user.email = "hello@example.com"
+        self.user.save()
+        notification = Notification.objects.create(
+            user=self.user, type="email", template="appointment_confirmed",
+            params={"doctor": "<O'Neil>", "date": "2026-01-05", "time": "09:00:00"},
+        )
+        stored = Notification.objects.get(pk=notification.pk)
+        self.assertEqual((stored.title, stored.message), ("", ""))
+
+        message = "Your appointment with Dr. &lt;O&#x27;Neil&gt; on 2026-01-05 at 09:00:00 has been confirmed."
+        data = self.client.get(reverse("notification-list")).data[0]
+        self.assertEqual((data["title"], data["message"]), ("Appointment Confirmed", message))
+        self.assertEqual(data["template"], "appointment_confirmed")
+
+        email = EmailService.build_notification_email(stored)
+        self.assertEqual(email.subject, "Appointment Confirmed")
+        self.assertIn(message, email.alternatives[0][0])
+        self.assertIs(compiled("appointment_confirmed"), compiled("appointment_confirmed"))
+
+    def _unread_count(self):
+        response = self.client.get(reverse("notification-unread-count"))
+        self.assertEqual(response.status_code, 200)
+        return response.data["unread_count"]
+
+    def test_unread_counter_follows_changes(self):
+        first = Notification.objects.create(user=self.user, type="system", title="A", message="m")
+        self.assertEqual(self._unread_count(), 1)
+        self.assertTrue(UnreadCounter.objects.filter(user=self.user).exists())
+
+        second = Notification.objects.create(user=self.user, type="system", title="B", message="m")
+        Notification.create_many([
+            Notification(user=self.user, type="system", title=str(n), message="m")
+            for n in range(3)
+        ])
+        self.assertEqual(self._unread_count(), 5)
+
+        self.client.post(f"/api/notifications/notifications/{first.id}/mark_as_read/")
+        # Already read, counted once
+        self.client.post(f"/api/notifications/notifications/{first.id}/mark_as_read/")
+        self.assertEqual(self._unread_count(), 4)
+
+        second.delete()
+        self.assertEqual(self._unread_count(), 3)
+
+        self.client.post("/api/notifications/notifications/mark_all_as_read/")
+        self.assertEqual(self._unread_count(), 0)
+        self.assertEqual(Notification.objects.filter(user=self.user, read=False).count(), 0)
+
+    def test_mark_read_bulk(self):
+        other = User.objects.create_user(username="other", password="p")
+        mine = Notification.create_many([
+            Notification(user=self.user, type="system", title=str(n), message="m")
+            for n in range(4)
+        ])
+        theirs = Notification.objects.create(user=other, type="system", title="X", message="m")
+        self._unread_count()
+        response = self.client.post(
+            reverse("notification-mark-read"),
+            {"ids": [mine[0].id, mine[1].id, theirs.id]}, format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["marked"], 2)
+        self.assertEqual(self._unread_count(), 2)
+        theirs.refresh_from_db()
+        self.assertFalse(theirs.read)
+
+        response = self.client.post(reverse("notification-mark-read"), {"ids": "1"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_inbox_cursor_pagination(self):
+        Notification.create_many([
+            Notification(user=self.user, type="system", title=str(n), message="m")
+            for n in range(5)
+        ])
+        response = self.client.get(reverse("notification-list"), {"page_size": 2})
+        self.assertEqual(len(response.data["results"]), 2)
+        seen = [n["id"] for n in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            seen.extend(n["id"] for n in response.data["results"])
+        expected = list(
+            Notification.objects.filter(user=self.user)
+            .order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+        # Without cursor parameters the full list is returned, as before
+        self.assertEqual(len(self.client.get(reverse("notification-list")).data), 5)
 
     def test_mark_as_read_action(self):
         notification = Notification.objects.create(
@@ -112,7 +242,7 @@ class AppointmentReminderSchedulerTests(APITestCase):
             reminder_hours_before=24,
         )
 
-    @patch("notifications.scheduler.Notification.send_appointment_reminder")
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
     def test_skips_when_email_disabled(self, mock_send):
         self.prefs.email_enabled = False
         self.prefs.save()
@@ -122,7 +252,7 @@ class AppointmentReminderSchedulerTests(APITestCase):
         self.appointment.refresh_from_db()
         self.assertFalse(self.appointment.reminder_sent)
 
-    @patch("notifications.scheduler.Notification.send_appointment_reminder")
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
     def test_sends_when_enabled(self, mock_send):
         schedule_dt = datetime.combine(self.schedule.date, self.schedule.start_time)
         schedule_dt = timezone.make_aware(schedule_dt, timezone.get_current_timezone())
@@ -130,11 +260,11 @@ class AppointmentReminderSchedulerTests(APITestCase):
         self.assertEqual(reminder_time, self.now)
         with patch("notifications.scheduler.timezone.now", return_value=self.now):
             dispatch_upcoming_appointment_reminders()
-        mock_send.assert_called_once_with(self.appointment)
+        mock_send.assert_called_once_with([self.appointment])
         self.appointment.refresh_from_db()
         self.assertTrue(self.appointment.reminder_sent)
 
-    @patch("notifications.scheduler.Notification.send_appointment_reminder")
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
     def test_sends_only_once(self, mock_send):
         schedule_dt = datetime.combine(self.schedule.date, self.schedule.start_time)
         schedule_dt = timezone.make_aware(schedule_dt, timezone.get_current_timezone())
@@ -142,7 +272,7 @@ class AppointmentReminderSchedulerTests(APITestCase):
         self.assertEqual(reminder_time, self.now)
         with patch("notifications.scheduler.timezone.now", return_value=self.now):
             dispatch_upcoming_appointment_reminders()
-        mock_send.assert_called_once_with(self.appointment)
+        mock_send.assert_called_once_with([self.appointment])
         self.appointment.refresh_from_db()
         self.assertTrue(self.appointment.reminder_sent)
 
@@ -150,3 +280,755 @@ class AppointmentReminderSchedulerTests(APITestCase):
         with patch("notifications.scheduler.timezone.now", return_value=self.now):
             dispatch_upcoming_appointment_reminders()
         mock_send.assert_not_called()
+
+    def _dispatch_at(self, now):
+        with patch("notifications.scheduler.timezone.now", return_value=now):
+            dispatch_upcoming_appointment_reminders()
+        self.appointment.refresh_from_db()
+
+    def test_due_at_is_precomputed(self):
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.reminder_due_at, self.now)
+
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
+    def test_not_sent_before_due(self, mock_send):
+        self._dispatch_at(self.now - timedelta(minutes=1))
+        mock_send.assert_not_called()
+        self.assertFalse(self.appointment.reminder_sent)
+
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
+    def test_late_run_still_sends(self, mock_send):
+        self._dispatch_at(self.now + timedelta(minutes=10))
+        mock_send.assert_called_once_with([self.appointment])
+        self.assertTrue(self.appointment.reminder_sent)
+
+    @patch("notifications.scheduler.Notification.send_appointment_reminders")
+    def test_past_appointment_is_dropped(self, mock_send):
+        self._dispatch_at(self.now + timedelta(hours=25))
+        mock_send.assert_not_called()
+        self.assertFalse(self.appointment.reminder_sent)
+        self.assertIsNone(self.appointment.reminder_due_at)
+
+    def test_preference_changes_move_due_at(self):
+        self.prefs.reminder_hours_before = 2
+        self.prefs.save()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.reminder_due_at, self.now + timedelta(hours=22))
+
+        self.prefs.appointment_reminders = False
+        self.prefs.save()
+        self.appointment.refresh_from_db()
+        self.assertIsNone(self.appointment.reminder_due_at)
+
+    def test_moving_the_slot_moves_due_at(self):
+        self.schedule.date += timedelta(days=1)
+        self.schedule.save()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.reminder_due_at, self.now + timedelta(days=1))
+
+    def test_dispatch_cost_does_not_depend_on_upcoming_appointments(self):
+        for day in range(1, 6):
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=self.schedule.date + timedelta(days=day),
+                start_time=self.schedule.start_time, end_time=self.schedule.end_time,
+            )
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, schedule=schedule, status="confirmed",
+            )
+        with self.assertNumQueries(1), \
+                patch("notifications.scheduler.timezone.now", return_value=self.now - timedelta(minutes=1)):
+            dispatch_upcoming_appointment_reminders()
+
+
+class OutboxTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="out", password="p", email="out@example.com")
+        # A private sender so failures here do not trip the shared circuit breaker
+        self.sender = PooledEmailSender()
+        patcher = patch("notifications.outbox.get_email_sender", return_value=self.sender)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queue(self, user=None):
+        return Notification.objects.create(
+            user=user or self.user, type="email", title="Hello", message="World"
+        )
+
+    def test_drain_sends_and_marks_notification(self):
+        notification = self._queue()
+        self.assertEqual(len(mail.outbox), 0)
+
+        totals = drain()
+
+        self.assertEqual(totals, {"sent": 1, "retried": 0, "dead": 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["out@example.com"])
+        notification.refresh_from_db()
+        self.assertTrue(notification.email_sent)
+        self.assertIsNotNone(notification.email_sent_at)
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.SENT)
+        # Nothing left to send
+        self.assertEqual(drain(), {"sent": 0, "retried": 0, "dead": 0})
+
+    def test_drain_sends_claimed_batches_through_the_pool(self):
+        for _ in range(5):
+            self._queue()
+        totals = drain(batch_size=2)
+        self.assertEqual(totals["sent"], 5)
+        self.assertEqual(self.sender.stats()["batches"], 3)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+           side_effect=SMTPException("mail server down"))
+    def test_failure_is_retried_with_backoff(self, mock_send):
+        self._queue()
+        before = timezone.now()
+
+        totals = drain()
+
+        self.assertEqual(totals, {"sent": 0, "retried": 1, "dead": 0})
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.last_error, "mail server down")
+        self.assertGreaterEqual(message.available_at, before + timedelta(seconds=30))
+        # Not due yet
+        self.assertEqual(drain()["retried"], 0)
+
+    @override_settings(NOTIFICATION_OUTBOX={"MAX_ATTEMPTS": 3, "BACKOFF_BASE": 0})
+    @patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+           side_effect=SMTPException("mail server down"))
+    def test_dead_lettered_after_max_attempts(self, mock_send):
+        self._queue()
+        totals = drain()
+        self.assertEqual(totals, {"sent": 0, "retried": 2, "dead": 1})
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.DEAD)
+        self.assertEqual(message.attempts, 3)
+
+    @override_settings(NOTIFICATION_OUTBOX={"MAX_ATTEMPTS": 2, "BACKOFF_BASE": 0})
+    def test_open_circuit_never_dead_letters(self):
+        self._queue()
+        for _ in range(self.sender.breaker.failure_threshold):
+            self.sender.breaker.record_failure()
+        before = timezone.now()
+
+        for _ in range(5):
+            self.assertEqual(drain(), {"sent": 0, "retried": 1, "dead": 0})
+            message = OutboxMessage.objects.get()
+            self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 0))
+            # Amanat pana dupa resetarea circuitului
+            self.assertGreaterEqual(
+                message.available_at, before + timedelta(seconds=self.sender.breaker.reset_timeout - 1)
+            )
+            OutboxMessage.objects.update(available_at=timezone.now())
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.sender.breaker.record_success()
+        self.assertEqual(drain()["sent"], 1)
+        self.assertEqual(OutboxMessage.objects.get().attempts, 1)
+
+    def test_missing_address_is_dead_lettered_immediately(self):
+        user = User.objects.create_user(username="noaddr", password="p")
+        self._queue(user)
+        self.assertEqual(drain(), {"sent": 0, "retried": 0, "dead": 1})
+        self.assertIn("no email address", OutboxMessage.objects.get().last_error)
+
+    def test_confirm_queues_email_without_sending(self):
+        doctor = Doctor.objects.create(
+            user=User.objects.create_user(username="odoc", password="p"), speciality="s"
+        )
+        patient = Patient.objects.create(user=self.user)
+        day = timezone.localdate() + timedelta(days=1)
+        schedule = Schedule.objects.create(
+            doctor=doctor, date=day, start_time=datetime.min.time().replace(hour=9),
+            end_time=datetime.min.time().replace(hour=10),
+        )
+        appointment = Appointment.objects.create(patient=patient, doctor=doctor, schedule=schedule)
+        self.client.force_authenticate(user=doctor.user)
+
+        response = self.client.post(
+            reverse("appointment-confirm", kwargs={"pk": appointment.pk}), secure=True
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.PENDING).count(), 1)
+        drain()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, "Appointment Confirmed")
+
+
+class DigestTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="dig", password="p", email="dig@example.com", first_name="Dana"
+        )
+        NotificationPreferences.objects.create(user=self.user, email_digest=True, digest_window_minutes=10)
+        patcher = patch("notifications.outbox.get_email_sender", return_value=PooledEmailSender())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queue(self, title, user=None):
+        return Notification.objects.create(
+            user=user or self.user, type="email", title=title, message=f"{title} <b>body</b>"
+        )
+
+    def _release(self):
+        OutboxMessage.objects.filter(digest=True).update(available_at=timezone.now())
+
+    def test_emails_are_held_and_sent_as_one_digest(self):
+        before = timezone.now()
+        first = self._queue("First")
+        second = self._queue("Second")
+
+        held = list(OutboxMessage.objects.order_by("id"))
+        self.assertTrue(all(message.digest for message in held))
+        # The second message joins the window opened by the first
+        self.assertEqual(held[0].available_at, held[1].available_at)
+        self.assertGreaterEqual(held[0].available_at, before + timedelta(minutes=10))
+        self.assertEqual(drain(), {"sent": 0, "retried": 0, "dead": 0})
+
+        self._release()
+        self.assertEqual(drain(), {"sent": 2, "retried": 0, "dead": 0})
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.subject, "2 new notifications")
+        self.assertEqual(email.to, ["dig@example.com"])
+        self.assertIn("Hello, Dana!", email.body)
+        self.assertIn("First <b>body</b>", email.body)
+        self.assertIn("Second &lt;b&gt;body&lt;/b&gt;", email.alternatives[0][0])
+        self.assertEqual(
+            set(Notification.objects.filter(email_sent=True).values_list("id", flat=True)),
+            {first.pk, second.pk},
+        )
+
+    def test_time_critical_templates_bypass_the_window(self):
+        self._queue("Newsletter")
+        Notification.objects.create(
+            user=self.user, type="email", template="appointment_reminder",
+            params={"doctor": "House", "date": "2030-01-01", "time": "09:00"},
+        )
+
+        self.assertEqual(drain()["sent"], 1)
+        self.assertEqual(mail.outbox[0].subject, "Appointment Reminder")
+        self.assertEqual(OutboxMessage.objects.get(status=OutboxMessage.PENDING).digest, True)
+
+    def test_users_without_digest_are_not_held(self):
+        other = User.objects.create_user(username="nodig", password="p", email="n@example.com")
+        self._queue("Now", user=other)
+        self.assertEqual(drain()["sent"], 1)
+        self.assertFalse(OutboxMessage.objects.get().digest)
+
+    def test_digest_without_address_is_dead_lettered(self):
+        self.user.email = ""
+        self.user.save()
+        self._queue("First")
+        self._queue("Second")
+        self._release()
+        self.assertEqual(drain(), {"sent": 0, "retried": 0, "dead": 2})
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts mail, optionally drops or refuses."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        self.reply("220 sink ready")
+        delivered = 0
+        data = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if data is not None:
+                if line == b".\r\n":
+                    with sink.lock:
+                        sink.messages.append(b"".join(data))
+                    data = None
+                    delivered += 1
+                    self.reply("250 OK")
+                    if sink.drop_after and delivered >= sink.drop_after:
+                        return
+                else:
+                    data.append(line)
+                continue
+
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "RCPT" and any(address in command for address in sink.refuse):
+                self.reply("550 no such user")
+            elif verb == "DATA":
+                data = []
+                self.reply("354 go ahead")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after=None, refuse=()):
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.drop_after = drop_after
+        self.refuse = refuse
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class PooledEmailSenderTests(APITestCase):
+    def _sender(self, port, **kwargs):
+        return PooledEmailSender(
+            backend="django.core.mail.backends.smtp.EmailBackend",
+            host="127.0.0.1", port=port, username="", password="",
+            use_tls=False, use_ssl=False, timeout=5, **kwargs
+        )
+
+    def _messages(self, count, to="p@example.com"):
+        return [EmailMessage(f"S{i}", "body", "clinic@example.com", [to]) for i in range(count)]
+
+    def test_batches_reuse_one_connection(self):
+        with SMTPSink() as sink:
+            sender = self._sender(sink.server_address[1], size=1)
+            self.assertEqual(sender.send(self._messages(10)), [None] * 10)
+            self.assertEqual(sender.send(self._messages(5)), [None] * 5)
+            sender.close()
+        self.assertEqual(sink.connections, 1)
+        self.assertEqual(len(sink.messages), 15)
+        stats = sender.stats()
+        self.assertEqual(stats["sent"], 15)
+        self.assertEqual(stats["batches"], 2)
+        self.assertEqual(stats["last_batches"][0]["messages"], 10)
+
+    def test_splits_into_batches(self):
+        with SMTPSink() as sink:
+            sender = self._sender(sink.server_address[1], batch_size=4)
+            sender.send(self._messages(10))
+            sender.close()
+        self.assertEqual(
+            [batch["messages"] for batch in sender.stats()["last_batches"]], [4, 4, 2]
+        )
+
+    def test_reconnects_when_server_drops_connection(self):
+        with SMTPSink(drop_after=3) as sink:
+            sender = self._sender(sink.server_address[1])
+            results = sender.send(self._messages(5))
+            sender.close()
+        self.assertEqual(results, [None] * 5)
+        self.assertEqual(len(sink.messages), 5)
+        self.assertEqual(sink.connections, 2)
+        self.assertEqual(sender.stats()["reconnects"], 1)
+
+    def test_refused_recipient_fails_only_its_message(self):
+        with SMTPSink(refuse=("bad@example.com",)) as sink:
+            sender = self._sender(sink.server_address[1])
+            messages = self._messages(2) + self._messages(1, to="bad@example.com") + self._messages(2)
+            results = sender.send(messages)
+            sender.close()
+        self.assertIsInstance(results[2], SMTPRecipientsRefused)
+        self.assertEqual([r for i, r in enumerate(results) if i != 2], [None] * 4)
+        self.assertEqual(sink.connections, 1)
+
+    def test_circuit_opens_when_host_is_down(self):
+        probe = socket.socket()
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        sender = self._sender(port, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            results = sender.send_batch(self._messages(2))
+            self.assertTrue(all(isinstance(r, OSError) for r in results))
+        self.assertEqual(sender.stats()["circuit"], CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            sender.send_batch(self._messages(1))
+
+    def test_email_stats_endpoint_is_admin_only(self):
+        user = User.objects.create_user(username="plain", password="p")
+        self.client.force_authenticate(user=user)
+        url = reverse("notification-email-stats")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        admin = User.objects.create_user(username="boss", password="p", is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("circuit", response.data)
+
+
+class CircuitBreakerTests(APITestCase):
+    def test_half_open_allows_one_trial(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+
+        now[0] = 10.0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.allow()
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.allow()
+
+    def test_failed_trial_reopens(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 10.0
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class ReminderDaemonTests(APITestCase):
+    def setUp(self):
+        self.now = timezone.localtime(timezone.now()).replace(second=0, microsecond=0)
+        patient_user = User.objects.create_user(username="dpat", password="p", email="d@example.com")
+        self.patient = Patient.objects.create(user=patient_user)
+        NotificationPreferences.objects.create(user=patient_user, reminder_hours_before=24)
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username="ddoc", password="p"), speciality="s"
+        )
+        self.appointment = self._book(self.now + timedelta(hours=24))
+
+    def _book(self, start, status="confirmed"):
+        schedule = Schedule.objects.create(
+            doctor=self.doctor, date=start.date(),
+            start_time=start.time().replace(tzinfo=None),
+            end_time=(start + timedelta(minutes=30)).time().replace(tzinfo=None),
+        )
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, schedule=schedule, status=status,
+        )
+
+    def _daemon(self, holder="a"):
+        return ReminderDaemon(holder=holder, horizon=3600, poll_interval=2, lease_ttl=30)
+
+    def test_sleeps_until_deadline_then_fires(self):
+        daemon = self._daemon()
+        self.assertLessEqual(daemon.step(self.now - timedelta(seconds=1)), 1)
+        self.appointment.refresh_from_db()
+        self.assertFalse(self.appointment.reminder_sent)
+
+        daemon.step(self.now)
+        self.appointment.refresh_from_db()
+        self.assertTrue(self.appointment.reminder_sent)
+        self.assertTrue(Notification.objects.filter(template="appointment_reminder").exists())
+
+    def test_learns_new_and_cancelled_appointments_from_the_log(self):
+        daemon = self._daemon()
+        daemon.step(self.now - timedelta(minutes=30))
+        later = self._book(self.now + timedelta(hours=24, minutes=10))
+        daemon.step(self.now - timedelta(minutes=29))
+        self.assertIn(later.id, daemon._deadlines)
+
+        later.status = "cancelled"
+        later.save()
+        daemon.step(self.now - timedelta(minutes=28))
+        self.assertNotIn(later.id, daemon._deadlines)
+        self.assertFalse(ReminderChange.objects.exists())
+
+    def test_idle_step_reads_only_the_change_log(self):
+        daemon = self._daemon()
+        start = self.now - timedelta(minutes=30)
+        daemon.step(start)
+        with self.assertNumQueries(1):
+            daemon.step(start + timedelta(seconds=2))
+
+    def test_one_daemon_holds_the_lease(self):
+        first, second = self._daemon("a"), self._daemon("b")
+        start = self.now - timedelta(minutes=30)
+        first.step(start)
+        self.assertEqual(second.step(start), 15)
+        self.assertEqual(SchedulerLease.objects.get().holder, "a")
+
+        # The first daemon died; once the lease expires the second takes over
+        second.step(start + timedelta(seconds=31))
+        self.assertEqual(SchedulerLease.objects.get().holder, "b")
+        second.step(self.now)
+        self.appointment.refresh_from_db()
+        self.assertTrue(self.appointment.reminder_sent)
+
+
+class EmailRenderingTests(APITestCase):
+    def test_batch_renders_text_and_html_parts(self):
+        ana = User.objects.create_user(username="ana", password="p", email="ana@example.com", first_name="Ana")
+        nomail = User.objects.create_user(username="nomail", password="p")
+        params = {"doctor": "O'Neil <b>", "date": "2026-01-05", "time": "09:00:00"}
+        notifications = [
+            Notification.objects.create(user=ana, type="email", template="appointment_reminder", params=params),
+            Notification.objects.create(user=nomail, type="email", template="appointment_reminder", params=params),
+            Notification.objects.create(user=ana, type="system", title="S", message="m"),
+        ]
+
+        first, missing, system = EmailService.build_notification_emails(notifications)
+
+        self.assertIsInstance(missing, ValueError)
+        self.assertIsInstance(system, ValueError)
+        self.assertEqual(first.subject, "Appointment Reminder")
+        self.assertEqual(first.to, ["ana@example.com"])
+        # Plain text is written separately, not stripped from the HTML
+        self.assertIn("Hello, Ana!", first.body)
+        self.assertIn("Dr. O'Neil <b> on 2026-01-05", first.body)
+        self.assertIn("Please do not reply to this email.", first.body)
+        self.assertNotIn("<div", first.body)
+        html = first.alternatives[0][0]
+        self.assertTrue(html.startswith(get_email_renderer().head_html))
+        self.assertIn("Dr. O&#x27;Neil &lt;b&gt; on 2026-01-05", html)
+        self.assertTrue(html.endswith(get_email_renderer().foot_html))
+
+    def test_renderer_is_built_once(self):
+        self.assertIs(get_email_renderer(), get_email_renderer())
+
+
+class NotificationWaitTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="waiter", password="p")
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("notification-wait")
+
+    def _publish_later(self, user_ids, delay=0.1):
+        timer = threading.Timer(delay, get_notification_broker().publish, [user_ids])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_returns_only_newer_notifications(self):
+        old = Notification.objects.create(user=self.user, type="system", title="A", message="m")
+        new = Notification.create_many([
+            Notification(user=self.user, type="system", title=str(n), message="m")
+            for n in range(2)
+        ])
+        response = self.client.get(self.url, {"after": old.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([n["id"] for n in response.data["results"]], [n.id for n in new])
+        self.assertEqual(response.data["last_id"], new[-1].id)
+
+    def test_times_out_empty(self):
+        response = self.client.get(self.url, {"after": 0, "timeout": 0.05})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"results": [], "last_id": 0})
+
+    def test_woken_by_a_publish_for_the_user(self):
+        self._publish_later([self.user.id])
+        started = time.monotonic()
+        response = self.client.get(self.url, {"timeout": 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_creation_publishes_on_commit(self):
+        broker = get_notification_broker()
+        with broker.subscribe(self.user.id) as subscription:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                Notification.objects.create(user=self.user, type="system", title="A", message="m")
+            self.assertFalse(subscription.event.is_set())
+            for callback in callbacks:
+                callback()
+            self.assertTrue(subscription.event.is_set())
+
+        with broker.subscribe(self.user.id) as subscription:
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.create_many([
+                    Notification(user=self.user, type="system", title="B", message="m")
+                ])
+            self.assertTrue(subscription.event.is_set())
+
+    @override_settings(NOTIFICATION_WAIT={"TIMEOUT": 10})
+    def test_full_broker_rejects(self):
+        broker = NotificationBroker(max_waiters=1)
+        with patch("notifications.views.get_notification_broker", return_value=broker):
+            with broker.subscribe(0):
+                response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "10")
+
+    def test_broker_wakes_only_the_users_subscriptions(self):
+        broker = NotificationBroker()
+        with broker.subscribe(1) as mine, broker.subscribe(2) as theirs:
+            broker.publish({1})
+            self.assertTrue(mine.wait(1))
+            self.assertFalse(theirs.wait(0.01))
+        self.assertEqual(broker.stats(), {"published": 1, "woken": 1, "rejected": 0, "waiting": 0})
+
+
+@override_settings(NOTIFICATION_RETENTION={
+    "CHUNK_SIZE": 2,
+    "PAUSE": 0,
+    "POLICIES": {
+        "read_system": {"filter": {"type": "system", "read": True}, "days": 30},
+        "reminders": {
+            "filter": [{"template": "appointment_reminder"}, {"template": "", "title": "Appointment Reminder"}],
+            "days": 30,
+            "summarize": True,
+        },
+    },
+    "OUTBOX_DAYS": 30,
+    "REMINDER_LOG_DAYS": 7,
+})
+class RetentionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="keep", password="p", email="keep@example.com")
+        self.now = timezone.make_aware(datetime(2026, 6, 15, 12, 0))
+
+    def _notification(self, age_days, **fields):
+        fields = {"type": "system", "title": "T", "message": "m", **fields}
+        notification = Notification.objects.create(user=self.user, **fields)
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=self.now - timedelta(days=age_days)
+        )
+        return notification
+
+    def test_deletes_old_read_system_notifications_in_chunks(self):
+        old = [self._notification(40, read=True) for _ in range(5)]
+        recent = self._notification(10, read=True)
+        unread = self._notification(40)
+
+        with patch("notifications.retention.time.sleep") as sleep:
+            report = Purge(now=self.now).run()
+
+        self.assertEqual(report["policies"]["read_system"], {"deleted": 5})
+        self.assertEqual(sleep.call_count, 2)  # chunks of 2, 2 and 1
+        self.assertFalse(Notification.objects.filter(pk__in=[n.pk for n in old]).exists())
+        self.assertEqual(Notification.objects.filter(pk__in=[recent.pk, unread.pk]).count(), 2)
+
+    def test_summarizes_whole_months_of_reminders(self):
+        # The cutoff (May 16) rounds down to May 1: April and March are whole
+        # months past retention, May is not
+        april = [
+            self._notification(days, type="email", template="appointment_reminder", params={"doctor": "X"})
+            for days in (50, 52)
+        ] + [self._notification(54, type="email", title="Appointment Reminder")]
+        may = self._notification(40, type="email", title="Appointment Reminder")
+        self._notification(80, type="email", title="Appointment Reminder")
+        self.assertEqual(UnreadCounter.for_user(self.user.id), 5)
+
+        report = Purge(now=self.now).run()
+
+        self.assertEqual(report["policies"]["reminders"], {"deleted": 4, "summaries": 2})
+        self.assertFalse(Notification.objects.filter(pk__in=[n.pk for n in april]).exists())
+        self.assertFalse(OutboxMessage.objects.filter(notification_id__in=[n.pk for n in april]).exists())
+        self.assertTrue(Notification.objects.filter(pk=may.pk).exists())
+        summaries = {
+            n.params["month"]: n for n in Notification.objects.filter(template="reminder_summary")
+        }
+        self.assertEqual(sorted(summaries), ["April 2026", "March 2026"])
+        self.assertEqual(summaries["April 2026"].render(), (
+            "Appointment reminders, April 2026", "3 appointment reminders were sent in April 2026.",
+        ))
+        self.assertTrue(summaries["April 2026"].read)
+        # The summarized reminders were unread, the counter follows
+        self.assertEqual(UnreadCounter.for_user(self.user.id), 1)
+        self.assertEqual(
+            UnreadCounter.objects.get(user=self.user).value,
+            Notification.objects.filter(user=self.user, read=False).count(),
+        )
+
+    def test_purges_outbox_and_reminder_log(self):
+        sent = self._notification(40, type="email")
+        OutboxMessage.objects.filter(notification=sent).update(
+            status=OutboxMessage.SENT, created_at=self.now - timedelta(days=40)
+        )
+        pending = self._notification(40, type="email")
+        OutboxMessage.objects.filter(notification=pending).update(created_at=self.now - timedelta(days=40))
+        ReminderChange.objects.create(appointment_id=1)
+        ReminderChange.objects.update(created_at=self.now - timedelta(days=8))
+        ReminderChange.objects.create(appointment_id=2)
+
+        report = Purge(now=self.now).run()
+
+        self.assertEqual(report["outbox"], 1)
+        self.assertEqual(report["reminder_log"], 1)
+        self.assertEqual(OutboxMessage.objects.get().notification_id, pending.pk)
+        self.assertEqual(ReminderChange.objects.get().appointment_id, 2)
+
+    def test_dry_run_only_counts(self):
+        self._notification(40, read=True)
+        self._notification(50, type="email", title="Appointment Reminder")
+        report = Purge(now=self.now, dry_run=True).run()
+        self.assertEqual(report["policies"]["read_system"], {"deleted": 1})
+        self.assertEqual(report["policies"]["reminders"], {"deleted": 1, "summaries": 1})
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_command_reports_each_policy(self):
+        self._notification(40, read=True)
+        out = StringIO()
+        call_command("purge_notifications", stdout=out)
+        self.assertIn("read_system: removed", out.getvalue())
+        self.assertIn("reminder log: removed 0 rows", out.getvalue())
+
+
+class NotificationQueryBudgetTest(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="budget", password="p")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+
+    def _grow(self, size):
+        while Notification.objects.filter(user=self.user).count() < size:
+            Notification.objects.create(user=self.user, type="system", title="T", message="M")
+
+    def test_notification_list(self):
+        self.assertQueryBudget(
+            NotificationViewSet, "list", self._grow,
+            lambda: self.client.get(reverse("notification-list")),
+        )
+
+    def test_notification_page(self):
+        self.assertQueryBudget(
+            NotificationViewSet, "list", self._grow,
+            lambda: self.client.get(reverse("notification-list"), {"page_size": 10}),
+        )
+
+    def test_wait_with_news(self):
+        self.assertQueryBudget(
+            NotificationViewSet, "wait", self._grow,
+            lambda: self.client.get(reverse("notification-wait"), {"after": 0}),
+        )
+
+    def test_unread_count(self):
+        UnreadCounter.for_user(self.user.id)
+        self.assertQueryBudget(
+            NotificationViewSet, "unread_count", self._grow,
+            lambda: self.client.get(reverse("notification-unread-count")),
+        )
+
+    def test_mark_read(self):
+        UnreadCounter.for_user(self.user.id)
+
+        def seed(size):
+            Notification.create_many([
+                Notification(user=self.user, type="system", title="T", message="M")
+                for _ in range(size)
+            ])
+            self.ids = list(
+                Notification.objects.filter(user=self.user, read=False).values_list("id", flat=True)
+            )
+
+        self.assertQueryBudget(
+            NotificationViewSet, "mark_read", seed,
+            lambda: self.client.post(
+                reverse("notification-mark-read"), {"ids": self.ids}, format="json"
+            ),
+        )
@@ -3,16 +3,22 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.utils import timezone
 
-from .models import Notification
+from .broker import BrokerBusy, get_notification_broker, wait_setting
+from .models import Notification, UnreadCounter
+from .pagination import NotificationCursorPagination
 from .serializers import NotificationSerializer
 from .email_service import EmailService
+from .smtp_pool import get_email_sender
+from authentication.permissions import IsAdminRole
 
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationCursorPagination
+    query_budgets = {'list': 2, 'unread_count': 2, 'mark_read': 3, 'wait': 3}
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user=self.request.user).order_by('-created_at', '-id')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -26,8 +32,73 @@ class NotificationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
-        Notification.objects.filter(user=request.user, read=False).update(read=True)
+        marked = Notification.objects.filter(user=request.user, read=False).update(read=True)
+        UnreadCounter.bump({request.user.id: -marked})
         return Response({'status': 'all marked as read'})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """Marcheaza ca citite notificarile din ``ids``"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids
+        ):
+            return Response(
+                {'error': 'ids must be a list of notification ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        marked = Notification.objects.filter(
+            user=request.user, id__in=ids, read=False
+        ).update(read=True)
+        UnreadCounter.bump({request.user.id: -marked})
+        return Response({'status': 'marked as read', 'marked': marked})
+
+    @action(detail=False, methods=['get'])
+    def wait(self, request):
+        """
+        Long-poll: raspunde cu notificarile mai noi decat ``after`` (id)
+
+        Held for up to ``timeout`` seconds (at most NOTIFICATION_WAIT['TIMEOUT'])
+        while there are none; returns them oldest first with the ``last_id``
+        to send as ``after`` on the next request.
+        """
+        max_timeout = wait_setting('TIMEOUT')
+        try:
+            after = int(request.query_params.get('after', 0))
+            timeout = max(0.0, min(float(request.query_params.get('timeout', max_timeout)), max_timeout))
+        except ValueError:
+            return Response(
+                {'error': 'after must be a notification id and timeout a number of seconds'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        def new_notifications():
+            return list(
+                self.get_queryset().filter(id__gt=after).order_by('id')[:wait_setting('LIMIT')]
+            )
+
+        try:
+            # Subscribe before reading so a notification committed in between still wakes us
+            with get_notification_broker().subscribe(request.user.id) as subscription:
+                notifications = new_notifications()
+                if not notifications and subscription.wait(timeout):
+                    notifications = new_notifications()
+        except BrokerBusy as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max_timeout)}
+            )
+
+        return Response({
+            'results': self.get_serializer(notifications, many=True).data,
+            'last_id': notifications[-1].id if notifications else after,
+        })
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Numarul de notificari necitite, pentru badge"""
+        return Response({'unread_count': UnreadCounter.for_user(request.user.id)})
     
     @action(detail=True, methods=['post'])
     def send_email(self, request, pk=None):
@@ -49,3 +120,13 @@ class NotificationViewSet(viewsets.ModelViewSet):
             {'error': 'Failed to send email'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminRole])
+    def email_stats(self, request):
+        """Throughput, reconnects and circuit state of the pooled SMTP sender"""
+        return Response(get_email_sender().stats())
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminRole])
+    def wait_stats(self, request):
+        """Contoarele long-poll: cereri in asteptare, treziri, respingeri"""
+        return Response(get_notification_broker().stats())
@@ -1,10 +1,13 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.urls import reverse
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from doctors.models import Doctor, Schedule
 from appointments.models import Appointment
+from appointments.querycount import QueryBudgetTestMixin
 from .models import Patient
+from .views import PatientViewSet
 from datetime import date, time, timedelta
 
 
@@ -79,3 +82,30 @@ class PatientViewsetQuerysetTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(len(response.data), 2)
 
+
+
+class PatientQueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        doctor_user = User.objects.create_user(username='budget_doc', password='pass')
+        self.doctor = Doctor.objects.create(user=doctor_user, speciality='gen')
+        self.day = next_weekday(date.today() + timedelta(days=1))
+        token = Token.objects.create(user=doctor_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+
+    def _grow_patients(self, size):
+        while Patient.objects.count() < size:
+            n = Patient.objects.count()
+            user = User.objects.create_user(username=f'budget_pat{n}', password='pass')
+            patient = Patient.objects.create(user=user)
+            schedule = Schedule.objects.create(
+                doctor=self.doctor, date=self.day + timedelta(days=7 * n),
+                start_time=time(9, 0), end_time=time(10, 0),
+            )
+            Appointment.objects.create(patient=patient, doctor=self.doctor, schedule=schedule)
+
+    def test_patient_list_as_doctor(self):
+        self.assertQueryBudget(
+            PatientViewSet, 'list', self._grow_patients,
+            lambda: self.client.get(reverse('patient-list')),
+        )
@@ -7,6 +7,8 @@ class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Token, role lookups and the patients joined with their users
+    query_budgets = {'list': 5, 'retrieve': 5}
 
     def get_queryset(self):
         user = self.request.user
@@ -16,12 +18,14 @@ class PatientViewSet(viewsets.ModelViewSet):
             return Patient.objects.all().select_related('user')
 
         if user.is_staff or user.is_superuser:
-            return Patient.objects.all()
+            return Patient.objects.all().select_related('user')
         
         if hasattr(user, "doctor"):
-            return Patient.objects.filter(appointments__doctor=user.doctor).distinct()
+            return Patient.objects.filter(
+                appointments__doctor=user.doctor
+            ).distinct().select_related('user')
         
         if hasattr(user, "patient"):
-            return Patient.objects.filter(pk=user.patient.pk)
+            return Patient.objects.filter(pk=user.patient.pk).select_related('user')
         
         return Patient.objects.none()
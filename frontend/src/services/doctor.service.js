@@ -27,4 +27,12 @@ export default {
   updateSchedule(id, scheduleData) {
     return api.put(`doctors/schedules/${id}/`, scheduleData);
   },
+
+  syncWeek(dateFrom, dateTo, slots) {
+    return api.put("doctors/schedules/week/", {
+      date_from: dateFrom,
+      date_to: dateTo,
+      slots,
+    });
+  },
 };